@@ -0,0 +1,152 @@
+"""
+Per-view request metrics and their Prometheus exposition.
+
+RequestMetricsMiddleware feeds every finished request into the histograms
+kept here. The registry lives in process memory, so each worker process
+reports its own series; Prometheus aggregates them across targets.
+"""
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Upper bounds for timing histograms, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds for the per-request query count histogram
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRICS = {
+    'store_request_duration_seconds': ('Total time spent handling the request', DURATION_BUCKETS),
+    'store_view_duration_seconds': ('Time spent in the view, including template rendering', DURATION_BUCKETS),
+    'store_template_duration_seconds': ('Time spent rendering templates', DURATION_BUCKETS),
+    'store_db_duration_seconds': ('Time spent executing SQL', DURATION_BUCKETS),
+    'store_db_queries': ('SQL queries issued per request', QUERY_COUNT_BUCKETS),
+}
+
+N_PLUS_ONE_METRIC = 'store_n_plus_one_total'
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*%s\s*,?)+\)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def sql_shape(sql):
+    """
+    Reduce a SQL statement to its shape.
+
+    Literals become ``?`` and ``IN`` lists of any length collapse to one
+    placeholder, so the same ORM lookup run for different rows maps to a
+    single shape.
+    """
+    shape = _IN_LIST_RE.sub('IN (...)', sql)
+    shape = _LITERAL_RE.sub('?', shape)
+    return _WHITESPACE_RE.sub(' ', shape).strip()
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yield ``(le, count)`` pairs, ending with ``+Inf``"""
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            running += count
+            yield ('+Inf' if bound == float('inf') else repr(bound)), running
+
+
+class MetricsRegistry:
+    """Thread-safe store of per-view histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = defaultdict(int)
+
+    def observe(self, view, values):
+        """
+        Record one request.
+
+        Args:
+            view: View name used as the ``view`` label
+            values: Mapping of metric name (a key of METRICS) to value
+        """
+        with self._lock:
+            for name, value in values.items():
+                key = (name, view)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(METRICS[name][1])
+                histogram.observe(value)
+
+    def increment(self, name, view, amount=1):
+        with self._lock:
+            self._counters[(name, view)] += amount
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Return all series in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {
+                key: (list(h.cumulative()), h.sum, h.count) for key, h in self._histograms.items()
+            }
+            counters = dict(self._counters)
+
+        lines = []
+        for name, (help_text, _) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, view), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                label = _escape_label(view)
+                for le, cumulative in buckets:
+                    lines.append(f'{name}_bucket{{view="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{label}"}} {total!r}')
+                lines.append(f'{name}_count{{view="{label}"}} {count}')
+
+        lines.append(f'# HELP {N_PLUS_ONE_METRIC} Requests where one SQL shape repeated past the N+1 threshold')
+        lines.append(f'# TYPE {N_PLUS_ONE_METRIC} counter')
+        for (metric, view), value in sorted(counters.items()):
+            if metric == N_PLUS_ONE_METRIC:
+                lines.append(f'{metric}{{view="{_escape_label(view)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint.
+
+    Only answers clients listed in METRICS_ALLOWED_IPS.
+
+    Returns:
+        Plain-text exposition of the per-view histograms
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
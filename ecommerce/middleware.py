@@ -1,19 +1,63 @@
 """
 Custom middleware for security headers and request processing.
 """
+import contextvars
+import logging
+import mimetypes
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .metrics import N_PLUS_ONE_METRIC, registry, sql_shape
+from .routers import pinning
+from .storage import ENCODINGS
+
+logger = logging.getLogger(__name__)
+
+# ManifestStaticFilesStorage inserts a 12 character md5 prefix before the
+# extension, e.g. css/main.1a2b3c4d5e6f.css
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
 
 
 class SecurityHeadersMiddleware:
     """
     Adds comprehensive security headers to all responses.
     """
+    sync_capable = True
+    async_capable = True
     
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        response = self.get_response(request)
-        
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.add_headers(self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_headers(await self.get_response(request))
+
+    def add_headers(self, response):
         # Content Security Policy for payment gateway integration
         response['Content-Security-Policy'] = (
             "default-src 'self'; "
@@ -32,3 +76,314 @@ class SecurityHeadersMiddleware:
         response['Referrer-Policy'] = 'strict-origin-when-cross-origin'
         
         return response
+
+
+def encoding_qualities(header):
+    """
+    Parse an Accept-Encoding header into ``{coding: q}``.
+
+    A coding listed with q=0 is refused, so it is kept with 0.0 rather
+    than dropped: that is what overrides a ``*`` entry. Malformed q-values
+    count as 1.
+    """
+    qualities = {}
+    for part in header.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+class PrecompressedStaticMiddleware:
+    """
+    Serves collected static files from STATIC_ROOT.
+
+    Picks the brotli or gzip variant written by collectstatic when the
+    client accepts it, and marks fingerprinted files as immutable so repeat
+    visits never re-request them. Requests for anything that is not a file
+    under STATIC_ROOT fall through to the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.static_root = settings.STATIC_ROOT
+        self.static_prefix = settings.STATIC_URL or ''
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        name = self.static_name(request)
+        if name is not None:
+            response = self.serve(request, name)
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        name = self.static_name(request)
+        if name is not None:
+            response = await sync_to_async(self.serve)(request, name)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def static_name(self, request):
+        """Return the path below STATIC_URL for static GET/HEAD requests"""
+        if (
+            self.static_root
+            and self.static_prefix.startswith('/')
+            and request.method in ('GET', 'HEAD')
+            and request.path.startswith(self.static_prefix)
+        ):
+            return request.path[len(self.static_prefix):]
+        return None
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.static_root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        hashed = bool(HASHED_NAME_RE.search(name))
+        if not hashed and not was_modified_since(
+            request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime
+        ):
+            return HttpResponseNotModified()
+
+        content_type, _ = mimetypes.guess_type(path)
+        accepted = encoding_qualities(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        served_path, encoding = path, None
+        for token, suffix in ENCODINGS:
+            if accepted.get(token, accepted.get('*', 0)) > 0 and os.path.isfile(path + suffix):
+                served_path, encoding = path + suffix, token
+                break
+
+        response = FileResponse(open(served_path, 'rb'))
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL
+        return response
+
+
+# Timings of the request being handled in the current thread or task
+_active_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class _RequestTimings:
+    """Accumulates SQL and template timings for one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.view_start = None
+        self.rendering = False
+        self.statements = Counter()
+
+
+def _record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper that charges each query to the active request.
+
+    It stays installed on every connection, because async views run their
+    queries on worker-thread connections that only share the request's
+    context variables, not its thread.
+    """
+    timings = _active_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += perf_counter() - start
+        timings.queries += 1
+        timings.statements[sql] += 1
+
+
+def _install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def _mark_view_start():
+    timings = _active_timings.get()
+    if timings is not None:
+        timings.view_start = perf_counter()
+
+
+@contextmanager
+def timed_template_render():
+    """
+    Charge the outermost template render in the block to the active request.
+
+    Entered by the ``TimedDjangoTemplates`` backend around each render.
+    """
+    timings = _active_timings.get()
+    if timings is None or timings.rendering:
+        yield
+        return
+    timings.rendering = True
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.template_time += perf_counter() - start
+        timings.rendering = False
+
+
+class RequestMetricsMiddleware:
+    """
+    Records query count, DB time, template time and view time per request.
+
+    The figures are fed into the per-view histograms served at /metrics.
+    With SERVER_TIMING_HEADER on they are also sent back in a Server-Timing
+    header, to staff and METRICS_ALLOWED_IPS clients only, since they
+    reveal how much work each page costs. Requests where one SQL shape
+    repeats more than N_PLUS_ONE_THRESHOLD times are logged as likely
+    N+1 patterns.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.n_plus_one_threshold = settings.N_PLUS_ONE_THRESHOLD
+        self.server_timing = settings.SERVER_TIMING_HEADER
+        connection_created.connect(_install_query_recorder, dispatch_uid='request_metrics')
+        for connection in connections.all():
+            _install_query_recorder(connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # Avoids a thread hop per request to run a sync hook
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = _RequestTimings()
+        token = _active_timings.set(timings)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _active_timings.reset(token)
+        server_timing = self.finish(request, timings, start)
+        if server_timing and self.timing_allowed(request):
+            response['Server-Timing'] = server_timing
+        return response
+
+    async def __acall__(self, request):
+        timings = _RequestTimings()
+        token = _active_timings.set(timings)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _active_timings.reset(token)
+        server_timing = self.finish(request, timings, start)
+        # The user may not be loaded yet, which needs a query
+        if server_timing and await sync_to_async(self.timing_allowed)(request):
+            response['Server-Timing'] = server_timing
+        return response
+
+    def timing_allowed(self, request):
+        """Whether the client may see Server-Timing: operators only"""
+        if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+            return True
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def finish(self, request, timings, start):
+        """
+        Record the request's figures.
+
+        Returns:
+            The Server-Timing header value, or None when it is turned off
+        """
+        end = perf_counter()
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unresolved'
+        view_time = end - timings.view_start if timings.view_start is not None else 0.0
+        total_time = end - start
+
+        registry.observe(view, {
+            'store_request_duration_seconds': total_time,
+            'store_view_duration_seconds': view_time,
+            'store_template_duration_seconds': timings.template_time,
+            'store_db_duration_seconds': timings.db_time,
+            'store_db_queries': timings.queries,
+        })
+        self.check_n_plus_one(view, timings)
+
+        if not self.server_timing:
+            return None
+        return (
+            f'db;dur={timings.db_time * 1000:.1f};desc="{timings.queries} queries", '
+            f'tpl;dur={timings.template_time * 1000:.1f}, '
+            f'view;dur={view_time * 1000:.1f}, '
+            f'total;dur={total_time * 1000:.1f}'
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _mark_view_start()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        _mark_view_start()
+
+    def check_n_plus_one(self, view, timings):
+        if timings.queries <= self.n_plus_one_threshold:
+            return
+        shapes = Counter()
+        for sql, count in timings.statements.items():
+            shapes[sql_shape(sql)] += count
+        shape, count = shapes.most_common(1)[0]
+        if count > self.n_plus_one_threshold:
+            registry.increment(N_PLUS_ONE_METRIC, view)
+            logger.warning(f"Possible N+1 in {view}: {count} queries shaped like: {shape}")
+
+
+class ReplicaPinningMiddleware:
+    """
+    Gives each request its own primary/replica pin state.
+
+    Requests with unsafe methods are pinned to the primary from the start;
+    safe ones read the catalog from replicas until their first write.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with pinning(request.method not in SAFE_METHODS):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with pinning(request.method not in SAFE_METHODS):
+            return await self.get_response(request)
@@ -0,0 +1,104 @@
+"""
+Database routing between the primary and read replicas.
+
+Catalog reads (products and sizes) go to a replica. Everything else, and
+every write, goes to the primary. The first write in a request pins the
+rest of that request to the primary, so a request always reads its own
+writes. Unsafe requests (POST and friends) are pinned from the start by
+ReplicaPinningMiddleware.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+# Models whose reads can tolerate replication lag
+REPLICA_MODELS = {'store.product', 'store.size'}
+
+
+class _Pin:
+    """Pin state of one request, or of a block nested in it"""
+
+    def __init__(self, pinned, parent=None):
+        self.pinned = pinned
+        self.parent = parent
+
+
+# Pin state of the current request. Async views can run queries in copies
+# of the request's context (tasks started by asyncio.gather, for one), so
+# a write marks the shared state object instead of setting a new value.
+_pin = contextvars.ContextVar('primary_pin', default=None)
+
+
+def pin_to_primary():
+    """Send every further read in this request to the primary"""
+    state = _pin.get()
+    if state is None:
+        # Outside a request, e.g. in a management command
+        _pin.set(_Pin(True))
+    # A write inside a nested block pins the request around it too
+    while state is not None:
+        state.pinned = True
+        state = state.parent
+
+
+def is_pinned():
+    state = _pin.get()
+    return state is not None and state.pinned
+
+
+@contextmanager
+def _pinned_block(state):
+    token = _pin.set(state)
+    try:
+        yield
+    finally:
+        _pin.reset(token)
+
+
+def pinning(pinned=False):
+    """Run a block with its own pin state, e.g. one request"""
+    return _pinned_block(_Pin(pinned))
+
+
+def use_primary():
+    """Read from the primary inside the block, e.g. right before a write"""
+    return _pinned_block(_Pin(True, parent=_pin.get()))
+
+
+def replica_aliases():
+    return settings.REPLICA_DATABASES
+
+
+class PrimaryReplicaRouter:
+    """
+    Route catalog reads to replicas and everything else to the primary.
+
+    With no replicas configured every query goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas or is_pinned() or model._meta.label_lower not in REPLICA_MODELS:
+            return PRIMARY
+        # Related lookups stay on the database the instance came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {PRIMARY, *replica_aliases()}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db == PRIMARY
@@ -0,0 +1,209 @@
+"""
+Cache-first session engine with write-behind to the database.
+
+Sessions are read from and written to the cache. Changed sessions are
+also queued in memory and written to ``django_session`` in one bulk
+upsert every SESSION_WRITE_BEHIND_INTERVAL seconds, and at process exit,
+so the table only matters when the cache misses. Saves that would not
+change anything are skipped. Deletes (logout, flush) hit the cache and
+the table immediately, so a signed-out session cannot come back.
+
+Enable with ``SESSION_ENGINE = 'ecommerce.session_backend'``. Sessions
+changed within the last flush interval are lost if the process is killed
+and the cache is lost with it.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'store:session:'
+
+
+class WriteBehindQueue:
+    """
+    Per-process buffer of sessions waiting to be written to the database.
+
+    Only the newest version of each session is kept. A daemon thread
+    flushes the buffer on an interval.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Held while writing, so a delete cannot interleave with a flush
+        # and be overwritten by an older copy
+        self.flush_lock = threading.RLock()
+        self._thread = None
+
+    def put(self, session):
+        with self._lock:
+            self._pending[session.session_key] = session
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='session-write-behind', daemon=True,
+                )
+                self._thread.start()
+
+    def get(self, session_key):
+        with self._lock:
+            return self._pending.get(session_key)
+
+    def discard(self, session_key):
+        with self._lock:
+            self._pending.pop(session_key, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Session write-behind flush failed: {e}")
+
+    def flush(self):
+        """
+        Write every pending session with one bulk upsert.
+
+        Sessions whose cache entry is gone were deleted, possibly by
+        another process, and are dropped instead of written back.
+
+        Returns:
+            int: Number of sessions written
+        """
+        with self.flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            cache = caches[settings.SESSION_CACHE_ALIAS]
+            cached = cache.get_many([KEY_PREFIX + key for key in pending])
+            sessions = [session for key, session in pending.items() if KEY_PREFIX + key in cached]
+            if not sessions:
+                return 0
+
+            model = SessionStore.get_model_class()
+            using = router.db_for_write(model)
+            try:
+                with transaction.atomic(using=using):
+                    model.objects.using(using).bulk_create(
+                        sessions,
+                        update_conflicts=True,
+                        unique_fields=['session_key'],
+                        update_fields=['session_data', 'expire_date'],
+                        batch_size=500,
+                    )
+            except Exception:
+                # Put them back unless a newer version was queued meanwhile
+                with self._lock:
+                    for session in sessions:
+                        self._pending.setdefault(session.session_key, session)
+                raise
+            return len(sessions)
+
+
+write_behind = WriteBehindQueue(settings.SESSION_WRITE_BEHIND_INTERVAL)
+atexit.register(write_behind.flush)
+
+
+class SessionStore(CachedDBStore):
+    """
+    Cached session store that defers database writes and skips no-op saves.
+    """
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._saved_state = None
+
+    def _state(self, data):
+        """Serialized form of the data, used to spot unchanged sessions"""
+        return self.serializer().dumps(data)
+
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Some backends raise on invalid keys; start a fresh session
+            data = None
+
+        if data is None:
+            # A session written moments ago may still be queued
+            session = write_behind.get(self.session_key) or self._get_session_from_db()
+            if session is None:
+                self._session_key = None
+                return {}
+            data = self.decode(session.session_data)
+            self._cache.set(self.cache_key, data, self.get_expiry_age(expiry=session.expire_date))
+
+        self._saved_state = self._state(data)
+        return data
+
+    def exists(self, session_key):
+        return (
+            self.cache_key_prefix + session_key in self._cache
+            or write_behind.get(session_key) is not None
+            or super().exists(session_key)
+        )
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        state = self._state(data)
+        if not must_create and state == self._saved_state:
+            return
+
+        if must_create:
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+        write_behind.put(self.create_model_instance(data))
+        self._saved_state = state
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        with write_behind.flush_lock:
+            self._cache.delete(self.cache_key_prefix + session_key)
+            write_behind.discard(session_key)
+            self.get_model_class().objects.filter(session_key=session_key).delete()
+
+    @classmethod
+    def clear_expired(cls, batch_size=1000):
+        """
+        Delete expired sessions in short batches.
+
+        Each batch is its own transaction, so the purge never holds the
+        write lock long enough to stall requests the way one table-wide
+        DELETE would. Used by ``manage.py clearsessions``.
+
+        Returns:
+            int: Number of sessions deleted
+        """
+        model = cls.get_model_class()
+        now = timezone.now()
+        deleted = 0
+        while True:
+            keys = list(
+                model.objects.filter(expire_date__lt=now)
+                .values_list('session_key', flat=True)[:batch_size]
+            )
+            if not keys:
+                return deleted
+            deleted += model.objects.filter(session_key__in=keys).delete()[0]
@@ -46,6 +46,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ecommerce.middleware.PrecompressedStaticMiddleware',
+    'ecommerce.middleware.RequestMetricsMiddleware',
+    'ecommerce.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -59,7 +62,8 @@ ROOT_URLCONF = 'ecommerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to RequestMetricsMiddleware
+        'BACKEND': 'ecommerce.template_backends.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,9 +87,91 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME':os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file rather than shared-cache memory, so concurrent test
+        # connections wait on the busy timeout like production ones
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
     }
 }
 
+# Read replicas for catalog queries, as comma-separated database files.
+# Locally a copy of db.sqlite3 refreshed with `manage.py sync_replicas`
+# stands in for a replica.
+REPLICA_DATABASES = []
+for index, name in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv()), start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['ecommerce.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# File-based by default so every worker process on the box shares
+# the catalog version and cached pages.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(BASE_DIR, '.cache')),
+    }
+}
+
+# Seconds an anonymous catalog page stays cached; catalog changes
+# retire it earlier by bumping the catalog version.
+STORE_PAGE_CACHE_TIMEOUT = config('STORE_PAGE_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Seconds an encoded catalog API response stays cached; like pages, it
+# is retired earlier when the catalog version changes.
+CATALOG_API_CACHE_TIMEOUT = config('CATALOG_API_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Products per catalog page and per infinite-scroll fetch
+STORE_PAGE_SIZE = config('STORE_PAGE_SIZE', default=24, cast=int)
+
+# Seconds stock stays held for an unfinished checkout before the
+# release_expired_reservations sweeper hands it back
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=900, cast=int)
+
+# Sessions are served from the cache and written to the database in
+# batches every SESSION_WRITE_BEHIND_INTERVAL seconds
+SESSION_ENGINE = config('SESSION_ENGINE', default='ecommerce.session_backend')
+SESSION_WRITE_BEHIND_INTERVAL = config('SESSION_WRITE_BEHIND_INTERVAL', default=5.0, cast=float)
+
+# Seconds a guest cart is kept after its last change
+GUEST_CART_TTL = config('GUEST_CART_TTL', default=60 * 60 * 24 * 30, cast=int)
+
+# Background jobs run by `manage.py run_jobs`. A failed job is retried
+# after JOB_RETRY_BASE_DELAY seconds, doubling up to JOB_RETRY_MAX_DELAY,
+# and dead-lettered after JOB_MAX_ATTEMPTS runs. A claim older than
+# JOB_LOCK_TIMEOUT seconds is assumed to belong to a dead worker.
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_RETRY_BASE_DELAY = config('JOB_RETRY_BASE_DELAY', default=30, cast=int)
+JOB_RETRY_MAX_DELAY = config('JOB_RETRY_MAX_DELAY', default=3600, cast=int)
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', default=300, cast=int)
+
+# Seconds a checkout's Idempotency-Key is remembered, and after which a
+# request that never finished stops blocking retries with the same key
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=60 * 60 * 24, cast=int)
+IDEMPOTENCY_LOCK_TIMEOUT = config('IDEMPOTENCY_LOCK_TIMEOUT', default=60, cast=int)
+
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='orders@localhost')
+
+# Clients allowed to scrape the Prometheus /metrics endpoint
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
+# Send per-request DB/template/view timings in a Server-Timing header.
+# Off by default; when on, only staff and METRICS_ALLOWED_IPS get it
+SERVER_TIMING_HEADER = config('SERVER_TIMING_HEADER', default=False, cast=bool)
+
+# Log a likely N+1 when one SQL shape runs more than this many times
+# in a single request
+N_PLUS_ONE_THRESHOLD = config('N_PLUS_ONE_THRESHOLD', default=10, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -175,6 +261,25 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static')
 ]
 
+STATIC_ROOT = config('STATIC_ROOT', default=os.path.join(BASE_DIR, 'staticfiles'))
+
+# Fingerprinted names need the manifest written by collectstatic, so the
+# hashed storage is only the default when not running in DEBUG
+STATIC_MANIFEST = config('STATIC_MANIFEST', default=not DEBUG, cast=bool)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'ecommerce.storage.PrecompressedManifestStaticFilesStorage'
+            if STATIC_MANIFEST
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
 MEDIA_URL = '/images/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'static/images')
@@ -0,0 +1,85 @@
+"""
+Static file storage that fingerprints assets and precompresses them.
+
+``collectstatic`` writes a content-hashed copy of every asset plus a
+``staticfiles.json`` manifest (Django's ManifestStaticFilesStorage), then
+writes ``.gz`` and ``.br`` siblings for text assets so they can be served
+without compressing on each request.
+"""
+import gzip
+import logging
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip variants are still written
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Images and fonts are already compressed; only text formats are worth it
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico',
+}
+MIN_COMPRESS_SIZE = 256
+
+# Accept-Encoding token -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def compress_file(path):
+    """
+    Write gzip and brotli variants next to a file.
+
+    A variant is only kept when it is smaller than the original.
+
+    Args:
+        path: Absolute path of the file to compress
+
+    Returns:
+        list: Suffixes of the variants that were written
+    """
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    written = []
+    for suffix, payload in variants.items():
+        if len(payload) >= len(data):
+            continue
+        with open(path + suffix, 'wb') as fh:
+            fh.write(payload)
+        written.append(suffix)
+    return written
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also writes gzip/brotli variants of text assets.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        names = set(paths) | set(self.hashed_files.values())
+        compressed = 0
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            if not self.exists(name):
+                continue
+            if compress_file(self.path(name)):
+                compressed += 1
+
+        if brotli is None:
+            logger.warning('brotli is not installed; only gzip variants were written')
+        logger.info(f'Precompressed {compressed} static files')
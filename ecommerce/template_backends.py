@@ -0,0 +1,27 @@
+"""
+Django template backend that charges rendering time to the current request.
+
+Views render through the configured engine, so timing the backend's
+template wrapper measures every page without touching Django's own
+``Template`` class. Renders outside a request, such as job emails, are
+not timed.
+"""
+from django.template.backends.django import DjangoTemplates, Template
+
+from .middleware import timed_template_render
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with timed_template_render():
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
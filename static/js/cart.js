@@ -1,133 +1,154 @@
 // cart.js
 
 document.addEventListener('DOMContentLoaded', function () {
-    // Function to log selected options to console and update size in the database
-    function logSelectedOptions() {
-        var sizeSelects = document.querySelectorAll('.size-select');
+    // Delegated so product cards appended by infinite scroll work too
+    document.addEventListener('click', function (event) {
+        var button = event.target.closest('.update-cart');
+        if (!button) {
+            return;
+        }
+        var productId = button.dataset.product;
+        var size = button.dataset.size || '';
+        var action = button.dataset.action;
 
-        sizeSelects.forEach(function (select) {
-            var productId = select.getAttribute('data-product');
-            var selectedOption = select.options[select.selectedIndex].text;
+        console.log('productId:', productId, 'size:', size, 'action:', action);
+        console.log('USER:', user);
 
-            console.log('Product ID:', productId, 'Selected Size:', selectedOption);
+        updateUserOrder(productId, size, action);
+    });
 
-            if (user != 'AnonymousUser') {
-                // If the user is logged in, update the size in the database
-                updateSizeInDatabase(productId, selectedOption);
-            }
-        });
-    }
+    // Clicks made in quick succession are coalesced into one batched
+    // request instead of one round trip per click. Guests use the same
+    // endpoint; their cart is kept server-side behind the cart_id cookie.
+    // Cart lines are keyed on product and size
+    var pendingDeltas = {};
+    var flushTimer = null;
+    var FLUSH_DELAY_MS = 400;
+
+    function updateUserOrder(productId, size, action) {
+        console.log('Queueing cart update...');
+
+        var key = productId + ':' + size;
+        var delta = action == 'add' ? 1 : -1;
+        if (!pendingDeltas[key]) {
+            pendingDeltas[key] = { 'productId': productId, 'size': size, 'delta': 0 };
+        }
+        pendingDeltas[key].delta += delta;
 
-    // Attach event listener to the size selects for logging and updating size
-    var sizeSelects = document.querySelectorAll('.size-select');
-    sizeSelects.forEach(function (select) {
-        select.addEventListener('change', logSelectedOptions);
+        clearTimeout(flushTimer);
+        flushTimer = setTimeout(flushCartUpdates, FLUSH_DELAY_MS);
+    }
 
-        // Retrieve the selected size from cookies and set it on page load
-        var productId = select.getAttribute('data-product');
-        var selectedSize = getSelectedSizeFromCookies(productId);
-        if (selectedSize) {
-            select.value = selectedSize;
+    function flushCartUpdates(leaving) {
+        var operations = [];
+        for (var key in pendingDeltas) {
+            if (pendingDeltas[key].delta != 0) {
+                operations.push(pendingDeltas[key]);
+            }
+        }
+        pendingDeltas = {};
+        if (operations.length == 0) {
+            return;
         }
-    });
-
-    // Your existing update-cart script
-    var updateBtns = document.getElementsByClassName('update-cart');
 
-    for (var i = 0; i < updateBtns.length; i++) {
-        updateBtns[i].addEventListener('click', function () {
-            var productId = this.dataset.product;
-            var action = this.dataset.action;
+        postJson('/update_cart/', { 'operations': operations }, leaving)
+            .then((data) => {
+                console.log('data:', data);
+                // The cached catalog only needs the guest badge refreshed
+                if (user == 'AnonymousUser' && location.pathname != '/cart/') {
+                    updateCartBadge();
+                } else {
+                    location.reload();
+                }
+            })
+            .catch(reportFailure);
+    }
 
-            console.log('productId:', productId, 'action:', action);
-            console.log('USER:', user);
+    // A size change sends only the line whose select changed. Changes
+    // made in quick succession go out together, in the order they were
+    // made, and the catalog's products are never written
+    var pendingSizes = [];
+    var sizeTimer = null;
+
+    document.querySelectorAll('.size-select').forEach(function (select) {
+        select.addEventListener('change', function () {
+            pendingSizes.push({
+                'productId': select.dataset.product,
+                'from': select.dataset.size,
+                'to': select.value,
+            });
+            select.dataset.size = select.value;
 
-            if (user == 'AnonymousUser') {
-                addCookieItem(productId, action);
-            } else {
-                updateUserOrder(productId, action);
-            }
+            clearTimeout(sizeTimer);
+            sizeTimer = setTimeout(flushSizeChanges, FLUSH_DELAY_MS);
         });
-    }
-
-    function addCookieItem(productId, action) {
-        console.log('Not logged in...');
+    });
 
-        if (action == 'add') {
-            if (cart[productId] == undefined) {
-                cart[productId] = { 'quantity': 1 };
-            } else {
-                cart[productId]['quantity'] += 1;
-            }
+    function flushSizeChanges(leaving) {
+        var changes = pendingSizes;
+        pendingSizes = [];
+        if (changes.length == 0) {
+            return;
         }
 
-        if (action == 'remove') {
-            cart[productId]['quantity'] -= 1;
+        postJson('/update_size/', { 'changes': changes }, leaving)
+            .then((data) => {
+                console.log('Sizes updated:', data);
+                // Lines moved onto a size already in the cart are merged
+                location.reload();
+            })
+            .catch(reportFailure);
+    }
 
-            if (cart[productId]['quantity'] <= 0) {
-                console.log('Remove Item');
-                delete cart[productId];
-            }
-        }
-        console.log('Cart:', cart);
-        document.cookie = 'cart=' + JSON.stringify(cart) + ";domain=;path=/";
-        // location.reload()
+    // Changes still waiting on a timer would be lost when the visitor
+    // navigates away or closes the tab, so they are sent at once as the
+    // page is hidden. keepalive lets the request outlive the page;
+    // sendBeacon cannot carry the CSRF header. If the tab was only hidden,
+    // the usual refresh runs when the response arrives
+    function flushBeforeLeaving() {
+        clearTimeout(sizeTimer);
+        clearTimeout(flushTimer);
+        flushSizeChanges(true);
+        flushCartUpdates(true);
     }
 
-    function updateUserOrder(productId, action) {
-        console.log('User is logged in, sending data...');
+    window.addEventListener('pagehide', flushBeforeLeaving);
+    document.addEventListener('visibilitychange', function () {
+        if (document.visibilityState == 'hidden') {
+            flushBeforeLeaving();
+        }
+    });
 
-        var url = '/update_item/';
+    // A guest may have been served a cached page, which sets no cookies,
+    // so the CSRF cookie is fetched up front when it is missing
+    var csrfReady = csrftoken ? Promise.resolve() : fetch('/csrf/', { credentials: 'same-origin' })
+        .then(() => {
+            csrftoken = getToken('csrftoken');
+        });
 
-        fetch(url, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrftoken,
-            },
-            body: JSON.stringify({ 'productId': productId, 'action': action })
-        })
+    function postJson(url, payload, keepalive) {
+        return csrfReady
+            .then(() => {
+                return fetch(url, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'X-CSRFToken': csrftoken,
+                    },
+                    body: JSON.stringify(payload),
+                    keepalive: !!keepalive
+                });
+            })
             .then((response) => {
+                if (!response.ok) {
+                    throw new Error(url + ' failed with status ' + response.status);
+                }
                 return response.json();
-            })
-            .then((data) => {
-                console.log('data:', data);
-                location.reload();
             });
     }
 
-    // Function to update the selected size in the database
-// Function to update the selected size in the database
-function updateSizeInDatabase(productId, selectedSize) {
-    var url = '/update_size/';
-
-    fetch(url, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'X-CSRFToken': csrftoken,
-        },
-        body: new URLSearchParams({
-            'productId': productId,
-            'selectedSize': selectedSize,
-        }),
-    })
-        .then((response) => {
-            return response.json();
-        })
-        .then((data) => {
-            console.log('Size updated in the database:', data);
-        });
-}
-
-    // Function to retrieve the selected size from cookies
-    function getSelectedSizeFromCookies(productId) {
-        if (document.cookie && document.cookie.indexOf('cart=') !== -1) {
-            var cartData = JSON.parse(document.cookie.split('cart=')[1].split(';')[0]);
-            if (cartData[productId] && cartData[productId]['size']) {
-                return cartData[productId]['size'];
-            }
-        }
-        return null;
+    function reportFailure(error) {
+        console.error('Cart update failed:', error);
+        alert('Sorry, your cart could not be updated. Please reload the page and try again.');
     }
 });
@@ -1,10 +1,146 @@
+from django import forms
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
 
 # Register your models here.
 
+from . import search
+from .cache import bump_catalog_version
+from .jobs import retry_dead_letters
 from .models import *
 
-admin.site.register(Customer)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
+
+class CappedCountPaginator(Paginator):
+    """
+    Paginator that stops counting at ``limit`` rows.
+
+    The count runs as ``COUNT(*)`` over a ``LIMIT`` subquery, so a change
+    list over millions of rows costs no more than one over ``limit``.
+    Pages past the cap are not linked.
+    """
+    limit = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.limit].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Change list defaults for tables too big to count or join lazily"""
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class StockAdjustmentForm(forms.Form):
+    delta = forms.IntegerField(
+        help_text="Added to each selected product's stock; negative values remove stock. "
+                  "Stock never drops below zero.",
+    )
+
+
+@admin.register(Customer)
+class CustomerAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'email', 'user', 'created_at']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    # Exact match keeps the lookup on the email index
+    search_fields = ['=email']
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ['name', 'size', 'price', 'stock', 'is_active', 'digital']
+    list_filter = ['is_active', 'digital']
+    # Prefix match, so the search can use the index on name
+    search_fields = ['^name']
+    actions = ['activate', 'deactivate', 'adjust_stock']
+
+    def _set_active(self, request, queryset, active):
+        with transaction.atomic():
+            # Index first: the queryset may filter on is_active itself
+            search.index_products(queryset, active=active)
+            updated = queryset.update(is_active=active)
+            transaction.on_commit(bump_catalog_version)
+        self.message_user(request, f"{'Activated' if active else 'Deactivated'} {updated} products")
+
+    @admin.action(description="Activate selected products")
+    def activate(self, request, queryset):
+        self._set_active(request, queryset, True)
+
+    @admin.action(description="Deactivate selected products")
+    def deactivate(self, request, queryset):
+        self._set_active(request, queryset, False)
+
+    @admin.action(description="Adjust stock of selected products")
+    def adjust_stock(self, request, queryset):
+        form = StockAdjustmentForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            with transaction.atomic():
+                updated = queryset.update(stock=Greatest(F('stock') + form.cleaned_data['delta'], Value(0)))
+                transaction.on_commit(bump_catalog_version)
+            self.message_user(request, f"Adjusted stock of {updated} products by {form.cleaned_data['delta']}")
+            return None
+        return TemplateResponse(request, 'admin/store/product/adjust_stock.html', {
+            **self.admin_site.each_context(request),
+            'title': "Adjust stock",
+            'opts': self.model._meta,
+            'form': form,
+            'queryset': queryset[:20],
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+            'selected': request.POST.getlist(admin.helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+        })
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    raw_id_fields = ['product']
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    # total and item_count are stored on the order by update_totals, so
+    # the list needs no per-row aggregate
+    list_display = ['id', 'customer', 'date_ordered', 'complete', 'total', 'item_count', 'transaction_id']
+    list_select_related = ['customer']
+    list_filter = ['complete']
+    raw_id_fields = ['customer']
+    search_fields = ['=transaction_id', '=customer__email']
+    readonly_fields = ['total', 'item_count', 'requires_shipping']
+    inlines = [OrderItemInline]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Lines edited inline change the stored totals
+        form.instance.update_totals()
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ['id', 'order', 'product', 'size', 'quantity', 'date_added']
+    list_select_related = ['order__customer', 'product']
+    raw_id_fields = ['order', 'product']
+
+
+admin.site.register(Job)
+
+
+@admin.register(DeadLetterJob)
+class DeadLetterJobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'attempts', 'failed_at']
+    list_filter = ['name']
+    actions = ['retry']
+
+    @admin.action(description="Requeue selected jobs")
+    def retry(self, request, queryset):
+        self.message_user(request, f"Requeued {retry_dead_letters(queryset)} jobs")
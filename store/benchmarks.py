@@ -0,0 +1,482 @@
+"""
+Benchmarks for the store hot paths.
+
+Each benchmark seeds its own data and yields one result row per
+parameter value. Run them through ``python manage.py benchmark``, which
+executes everything against a throwaway test database and can compare
+the rows with a saved baseline.
+"""
+import asyncio
+import itertools
+import json
+import random
+import secrets
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import AsyncClient, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import search
+from .cache import bump_catalog_version
+from .guest_cart import CART_ID_COOKIE
+from .models import Customer, GuestCart, Order, OrderItem, Product
+from .pagination import paginate
+from .services import CartService
+from .utils import cartData, cookieCart
+
+# Vocabulary for generated names and descriptions, so text searches have
+# a realistic mix of common and rare terms
+WORDS = [
+    'running', 'training', 'compression', 'breathable', 'lightweight',
+    'hoodie', 'jacket', 'shorts', 'leggings', 'joggers', 'tank', 'shirt',
+    'thermal', 'waterproof', 'reflective', 'seamless', 'stretch', 'mesh',
+    'performance', 'recovery', 'climate', 'premium', 'athletic', 'studio',
+    'marathon', 'trail', 'court', 'yoga', 'cycling', 'winter', 'summer',
+    'black', 'white', 'navy', 'charcoal', 'crimson', 'olive', 'sand',
+    'cobalt', 'graphite', 'coral', 'teal', 'ivory', 'burgundy', 'slate',
+    'cotton', 'polyester', 'nylon', 'elastane', 'merino', 'fleece',
+    'bamboo', 'recycled', 'ripstop', 'softshell', 'jersey', 'twill',
+    'zippered', 'pocket', 'hood', 'drawcord', 'cuffed', 'tapered',
+    'relaxed', 'fitted', 'cropped', 'longline', 'sleeveless', 'ventilated',
+    'quickdry', 'antiodor', 'insulated', 'packable', 'windproof', 'durable',
+    'gym', 'hiking', 'tennis', 'basketball', 'football', 'swimming',
+    'boxing', 'crossfit', 'pilates', 'rowing', 'skiing', 'climbing',
+    'everyday', 'travel', 'lounge', 'warmup', 'layering', 'base',
+]
+
+
+# Result keys that are measurements; every other key identifies the row
+LOWER_IS_BETTER = ('median_ms', 'p95_ms', 'max_ms', 'wall_ms')
+HIGHER_IS_BETTER = ('ops_per_sec',)
+MUST_NOT_GROW = ('queries', 'errors')
+OUTCOME_KEYS = ('sold', 'sold_out', 'final_stock', 'oversold', 'duplicate_orders')
+MEASUREMENT_KEYS = frozenset(LOWER_IS_BETTER + HIGHER_IS_BETTER + MUST_NOT_GROW + OUTCOME_KEYS)
+
+# Latency differences below this are treated as noise whatever the ratio
+NOISE_FLOOR_MS = 0.5
+
+
+def measure(func, iterations=20, setup=None):
+    """
+    Call ``func`` repeatedly and collect query count and latency.
+
+    ``func`` is called once as a warm-up before timing starts. The query
+    count is taken from the final iteration. ``setup``, when given, runs
+    before every call and is neither timed nor counted.
+
+    Returns:
+        dict: ``queries``, ``median_ms`` and ``p95_ms`` for the calls
+    """
+    if setup:
+        setup()
+    func()
+    timings = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'queries': len(ctx.captured_queries),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 3),
+    }
+
+
+def seed_products(count, batch_size=5000):
+    """
+    Create ``count`` active products in batches.
+    
+    Each product gets a distinct ``created_at`` one second older than the
+    previous one, like a catalog filled over time.
+    
+    Returns:
+        QuerySet: The products created by this call, oldest ID first
+    """
+    now = timezone.now()
+    rng = random.Random(count)
+    first_id = (Product.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+    for start in range(0, count, batch_size):
+        Product.objects.bulk_create([
+            Product(
+                name=' '.join(rng.sample(WORDS, 2)).title() + f' {i}',
+                description=' '.join(rng.sample(WORDS, 10)),
+                price=Decimal('19.99') + i % 50,
+                digital=bool(i % 5 == 0),
+                stock=100,
+                is_active=True,
+                created_at=now - timedelta(seconds=i),
+            )
+            for i in range(start, min(start + batch_size, count))
+        ])
+    return Product.objects.filter(id__gte=first_id).order_by('id')
+
+
+def seed_guest_cart(lines):
+    """Store a guest cart of ``{product_id: quantity}`` and return its cookie value"""
+    cart = GuestCart.objects.create(
+        key=secrets.token_urlsafe(24),
+        lines={str(product_id): quantity for product_id, quantity in lines.items()},
+    )
+    return cart.key
+
+
+def guest_request(path='/', cart_id=None):
+    """Build an anonymous GET request carrying a ``cart_id`` cookie."""
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    if cart_id is not None:
+        request.COOKIES[CART_ID_COOKIE] = cart_id
+    return request
+
+
+def seed_customer(username):
+    """Create a user with a linked customer profile"""
+    user = User.objects.create_user(username=username, email=f'{username}@example.com')
+    Customer.objects.create(user=user, name=username, email=user.email)
+    return user
+
+
+def fill_cart(customer, products, quantity=1):
+    """Replace the customer's open cart with one line per product"""
+    order, _ = Order.objects.get_or_create(customer=customer, complete=False)
+    order.items.all().delete()
+    OrderItem.objects.bulk_create(
+        [OrderItem(order=order, product=product, quantity=quantity) for product in products]
+    )
+    return order.update_totals()
+
+
+def post_json(client, path, payload, **extra):
+    """POST a JSON body and fail loudly on an error response"""
+    response = client.post(path, json.dumps(payload), content_type='application/json', **extra)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}: {response.content[:200]!r}")
+    return response
+
+
+def row_key(row):
+    """Identify a result row by its non-measurement keys"""
+    return tuple(sorted((key, value) for key, value in row.items() if key not in MEASUREMENT_KEYS))
+
+
+def compare(baseline, results, tolerance=0.5):
+    """
+    Find regressions of ``results`` against ``baseline`` rows.
+
+    Query and error counts may not grow at all. Latencies may grow by
+    ``tolerance`` (a fraction) plus a small noise floor, throughput may
+    drop by ``tolerance``, and an oversold checkout always counts. Rows
+    missing from the baseline are skipped.
+
+    Returns:
+        list: ``{'row', 'metric', 'baseline', 'current'}`` dicts
+    """
+    previous = {row_key(row): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get(row_key(row))
+        if before is None:
+            continue
+        for metric, current in row.items():
+            old = before.get(metric)
+            if old is None:
+                continue
+            if metric in MUST_NOT_GROW:
+                regressed = current > old
+            elif metric in LOWER_IS_BETTER:
+                regressed = current > old * (1 + tolerance) and current - old > NOISE_FLOOR_MS
+            elif metric in HIGHER_IS_BETTER:
+                regressed = current < old * (1 - tolerance)
+            else:
+                regressed = metric == 'oversold' and current and not old
+            if regressed:
+                regressions.append({'row': dict(row_key(row)), 'metric': metric, 'baseline': old, 'current': current})
+    return regressions
+
+
+def bench_cookie_cart(sizes=(1, 10, 50, 100, 200), iterations=20):
+    """Resolve server-side guest carts of growing size through ``cookieCart``."""
+    products = seed_products(max(sizes))
+    for size in sizes:
+        cart_id = seed_guest_cart({p.id: 2 for p in products[:size]})
+        result = measure(lambda: cookieCart(guest_request(cart_id=cart_id)), iterations)
+        yield {'benchmark': 'cookie_cart', 'cart_lines': size, **result}
+
+
+def bench_cart_data(sizes=(1, 10, 50, 100, 200), iterations=20):
+    """Resolve a customer's database cart of growing size through ``cartData``"""
+    products = list(seed_products(max(sizes)))
+    user = seed_customer('cart_data')
+    request = RequestFactory().get('/')
+    request.user = user
+    for size in sizes:
+        fill_cart(user.customer, products[:size], quantity=2)
+        result = measure(lambda: list(cartData(request)['items']), iterations)
+        yield {'benchmark': 'cart_data', 'cart_lines': size, **result}
+
+
+def bench_store_view(sizes=(100, 10000, 100000), iterations=20):
+    """Render the first catalog page for a guest as the catalog grows"""
+    client = Client()
+    seeded = 0
+    for size in sizes:
+        seed_products(size - seeded)
+        seeded = size
+        # A fresh version per measurement keeps the page cache out of it
+        result = measure(lambda: (bump_catalog_version(), client.get('/')), iterations)
+        yield {'benchmark': 'store_view', 'products': size, **result}
+
+
+def bench_update_item(iterations=20):
+    """Add and remove cart lines through the ``updateItem`` endpoint"""
+    products = list(seed_products(20))
+    client = Client()
+    client.force_login(seed_customer('update_item'))
+    # Alternate add and remove so the cart stays small
+    actions = itertools.cycle(
+        [(product.id, action) for product in products for action in ('add', 'remove')]
+    )
+
+    def update():
+        product_id, action = next(actions)
+        post_json(client, '/update_item/', {'productId': product_id, 'action': action})
+
+    result = measure(update, iterations)
+    yield {'benchmark': 'update_item', **result,
+           'ops_per_sec': round(1000 / result['median_ms'], 1)}
+
+
+def bench_process_order(cart_lines=5, iterations=20):
+    """Check out customer and guest carts end to end through ``processOrder``"""
+    products = list(seed_products(cart_lines))
+    Product.objects.filter(pk__in=[product.pk for product in products]).update(stock=10 ** 9)
+    shipping = {'address': '1 Track Lane', 'city': 'Kingston', 'state': 'KIN', 'zipcode': '00000'}
+
+    client = Client()
+    user = seed_customer('process_order')
+    client.force_login(user)
+    cart = {}
+
+    def refill():
+        order = CartService.apply_operations(user.customer, [(product.id, '', 2) for product in products])
+        cart['total'] = str(order.get_cart_total)
+
+    result = measure(
+        lambda: post_json(client, '/process_order/', {
+            'form': {'name': user.username, 'email': user.email, 'total': cart['total']},
+            'shipping': shipping,
+        }),
+        iterations,
+        setup=refill,
+    )
+    yield {'benchmark': 'process_order', 'flow': 'customer', 'cart_lines': cart_lines, **result}
+
+    guest = Client()
+    total = str(sum(product.price * 2 for product in products))
+
+    def refill_guest():
+        # A completed guest order clears the cart
+        guest.cookies[CART_ID_COOKIE] = seed_guest_cart({product.id: 2 for product in products})
+
+    result = measure(
+        lambda: post_json(guest, '/process_order/', {
+            'form': {'name': 'Guest', 'email': 'guest@example.com', 'total': total},
+            'shipping': shipping,
+        }),
+        iterations,
+        setup=refill_guest,
+    )
+    yield {'benchmark': 'process_order', 'flow': 'guest', 'cart_lines': cart_lines, **result}
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 3),
+    }
+
+
+def bench_concurrency(connections=(16, 64, 256), workers=8, client_delay_ms=500, iterations=None):
+    """
+    Compare how many concurrent connections WSGI and ASGI deployments absorb.
+    
+    All connections arrive at once. Each fetches a guest cart page and then
+    holds on for ``client_delay_ms``, like a slow client reading the
+    response. The WSGI deployment is modelled as ``workers`` threads, each
+    stuck with its connection until the client is done. The ASGI
+    deployment serves every connection from one event loop and needs a
+    thread only while the view runs sync code, so under WSGI connections
+    beyond the worker count wait in a queue. Latency is measured from
+    arrival, queueing included.
+    """
+    products = list(seed_products(5))
+    cart_id = seed_guest_cart({product.id: 1 for product in products})
+    delay = client_delay_ms / 1000
+
+    def wsgi_connection(arrived):
+        client = Client()
+        client.cookies[CART_ID_COOKIE] = cart_id
+        client.get('/cart/')
+        time.sleep(delay)
+        elapsed = (time.perf_counter() - arrived) * 1000
+        connection.close()
+        return elapsed
+
+    async def asgi_connection(arrived):
+        # Each ASGI request gets its own thread for sync work, as Django's
+        # ASGIHandler does
+        async with ThreadSensitiveContext():
+            client = AsyncClient()
+            client.cookies[CART_ID_COOKIE] = cart_id
+            await client.get('/cart/')
+            await asyncio.sleep(delay)
+            elapsed = (time.perf_counter() - arrived) * 1000
+            await sync_to_async(lambda: connection.close())()
+        return elapsed
+
+    async def asgi_run(count):
+        arrived = time.perf_counter()
+        return await asyncio.gather(*(asgi_connection(arrived) for _ in range(count)))
+
+    for count in connections:
+        for server in ('wsgi', 'asgi'):
+            start = time.perf_counter()
+            if server == 'wsgi':
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    timings = list(pool.map(wsgi_connection, [start] * count))
+            else:
+                timings = asyncio.run(asgi_run(count))
+            wall_ms = (time.perf_counter() - start) * 1000
+            yield {'benchmark': 'concurrency', 'server': server, 'workers': workers,
+                   'connections': count, 'client_delay_ms': client_delay_ms, **_percentiles(timings),
+                   'wall_ms': round(wall_ms, 3), 'ops_per_sec': round(count / wall_ms * 1000, 1)}
+
+
+def bench_search(sizes=(1000, 100000), iterations=20):
+    """Compare FTS5 search against ``icontains`` scans as the catalog grows"""
+    queries = ['waterproof jacket', 'marath', 'merino base layering']
+    seeded = 0
+    for size in sizes:
+        seed_products(size - seeded)
+        seeded = size
+        search.rebuild_index()
+        for query in queries:
+            scan = measure(
+                lambda: list(Product.objects.filter(
+                    Q(name__icontains=query) | Q(description__icontains=query),
+                    is_active=True,
+                ).order_by('-created_at')[:20]),
+                iterations,
+            )
+            yield {'benchmark': 'search', 'engine': 'icontains', 'products': size,
+                   'query': query, **scan}
+            fts = measure(lambda: search.search(query, limit=20), iterations)
+            yield {'benchmark': 'search', 'engine': 'fts5', 'products': size,
+                   'query': query, **fts}
+
+
+def bench_catalog_pages(catalog_size=500000, pages=(1, 50, 500), iterations=20):
+    """Fetch catalog pages at growing depth through the infinite-scroll endpoint"""
+    seed_products(catalog_size)
+    client = Client()
+    cursor = None
+    for number in range(1, max(pages) + 1):
+        if number in pages:
+            path = '/products/' + (f'?after={cursor}' if cursor else '')
+            # A fresh version per measurement keeps the page cache out of it
+            result = measure(lambda: (bump_catalog_version(), client.get(path)), iterations)
+            yield {'benchmark': 'catalog_pages', 'products': catalog_size, 'page': number, **result}
+        cursor = paginate(Product.objects.filter(is_active=True), cursor).next_cursor
+
+
+def bench_checkout_contention(checkouts=300, stock=25, workers=32, iterations=None):
+    """
+    Race many concurrent guest checkouts for one low-stock product.
+    
+    Every buyer holds one unit and submits ``/process_order/`` twice with
+    the same Idempotency-Key, like a double click, and all submissions
+    run at once. Exactly ``stock`` buyers must get an order, none may get
+    two, the rest must be turned away and stock must never go negative.
+    Latency is measured per submission.
+    """
+    product = Product.objects.create(
+        name='Limited Edition Jersey', price=Decimal('89.00'), stock=stock,
+        is_active=True, digital=False, created_at=timezone.now(),
+    )
+    carts = [seed_guest_cart({product.id: 1}) for _ in range(checkouts)]
+    shipping = {'address': '1 Track Lane', 'city': 'Kingston', 'state': 'KIN', 'zipcode': '00000'}
+    submissions = [buyer for buyer in range(checkouts) for _ in range(2)]
+    random.Random(0).shuffle(submissions)
+
+    def checkout(buyer):
+        # Failures are counted as errors rather than raised
+        client = Client(raise_request_exception=False)
+        client.cookies[CART_ID_COOKIE] = carts[buyer]
+        payload = {
+            'form': {'name': f'Buyer {buyer}', 'email': f'buyer{buyer}@example.com', 'total': str(product.price)},
+            'shipping': shipping,
+        }
+        start = time.perf_counter()
+        try:
+            response = client.post(
+                '/process_order/', json.dumps(payload), content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY=f'checkout-{buyer}',
+            )
+        finally:
+            connection.close()
+        if response.status_code == 200:
+            outcome = 'replayed' if response.has_header('Idempotent-Replayed') else 'sold'
+        elif response.status_code == 409:
+            outcome = 'sold_out' if 'productId' in response.json() else 'in_progress'
+        else:
+            outcome = 'error'
+        return outcome, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(checkout, submissions))
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    outcomes = [outcome for outcome, _ in results]
+    timings = sorted(elapsed for _, elapsed in results)
+    product.refresh_from_db()
+    orders = Order.objects.filter(complete=True, items__product=product)
+    sold = orders.count()
+    yield {
+        'benchmark': 'checkout_contention', 'checkouts': checkouts, 'workers': workers,
+        'initial_stock': stock, 'sold': sold, 'sold_out': outcomes.count('sold_out'),
+        'errors': outcomes.count('error'), 'final_stock': product.stock,
+        'oversold': sold > stock or product.stock < 0 or product.stock != stock - sold,
+        # Buyers who got more than one order for their key
+        'duplicate_orders': orders.values('customer').annotate(count=Count('id')).filter(count__gt=1).count(),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'max_ms': round(timings[-1], 3), 'wall_ms': round(wall_ms, 3),
+    }
+
+
+BENCHMARKS = {
+    'cookie_cart': bench_cookie_cart,
+    'cart_data': bench_cart_data,
+    'store_view': bench_store_view,
+    'update_item': bench_update_item,
+    'process_order': bench_process_order,
+    'concurrency': bench_concurrency,
+    'search': bench_search,
+    'catalog_pages': bench_catalog_pages,
+    'checkout_contention': bench_checkout_contention,
+}
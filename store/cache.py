@@ -0,0 +1,180 @@
+"""
+Catalog versioning, the shared full-page cache for anonymous visitors
+and the validators behind conditional GETs.
+
+The catalog version is an opaque token kept in the cache. Product
+signals replace it whenever the catalog changes, which retires every
+page cached under the previous version at once.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from . import guest_cart
+from .models import Order
+
+CATALOG_VERSION_KEY = 'store:catalog-version'
+
+
+def get_catalog_version():
+    """Return the current catalog version, creating one if none is cached"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate everything derived from the catalog"""
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+
+
+def _cached_page(request):
+    """
+    Look up the shared cached copy of an anonymous GET.
+
+    Returns:
+        tuple: ``(key, response)``; ``key`` is None when the request must
+        not use the page cache, ``response`` is None on a miss
+    """
+    if request.method != 'GET' or request.user.is_authenticated:
+        return None, None
+    key = f'store:page:{get_catalog_version()}:{request.get_full_path()}'
+    cached = cache.get(key)
+    if cached is None:
+        return key, None
+    content, content_type = cached
+    return key, HttpResponse(content, content_type=content_type)
+
+
+def _store_page(key, response):
+    if response.status_code == 200 and not response.streaming:
+        cache.set(
+            key,
+            (response.content, response['Content-Type']),
+            settings.STORE_PAGE_CACHE_TIMEOUT,
+        )
+
+
+def cache_anonymous_page(view):
+    """
+    Serve anonymous GET requests for ``view`` from a shared page cache.
+    
+    Entries are keyed by catalog version and full path, so the rendered
+    page must not contain anything specific to the visitor. Authenticated
+    users always get a fresh render. Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key, cached = await sync_to_async(_cached_page)(request)
+            if cached is not None:
+                return cached
+            response = await view(request, *args, **kwargs)
+            if key is not None:
+                await sync_to_async(_store_page)(key, response)
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key, cached = _cached_page(request)
+        if cached is not None:
+            return cached
+        response = view(request, *args, **kwargs)
+        if key is not None:
+            _store_page(key, response)
+        return response
+
+    return wrapper
+
+
+def get_cart_version(request):
+    """
+    Return a token that changes whenever the visitor's cart changes.
+
+    Customers get their open order's ID and ``updated_at``, read with one
+    query and without creating an order. Guests get the version of their
+    server-side cart.
+    """
+    if request.user.is_authenticated:
+        row = (
+            Order.objects.filter(customer__user=request.user, complete=False)
+            .values_list('id', 'updated_at')
+            .first()
+        )
+        return 'empty' if row is None else f'{row[0]}:{row[1].timestamp()}'
+    return guest_cart.get_version(request)
+
+
+def page_etag(request, *parts, include_cart=True):
+    """
+    Build a strong ETag for a page from versions alone, without rendering.
+    
+    The digest covers the catalog version, the user, the CSRF cookie
+    (pages embedding a token must change when it rotates), the cart
+    version when ``include_cart`` is set and any extra ``parts``.
+    """
+    components = [
+        get_catalog_version(),
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        get_cart_version(request) if include_cart else '',
+        *parts,
+    ]
+    raw = ':'.join(str(component) for component in components)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def revalidate_privately(response):
+    """Let browsers keep a private copy that must be revalidated before reuse"""
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_page(etag_func):
+    """
+    Answer ``If-None-Match`` for ``view`` from ``etag_func`` alone.
+    
+    ``etag_func(request)`` runs before the view, so a matching request
+    gets a 304 without the view or its template running. Responses carry
+    the ETag and private, must-revalidate caching. This does for sync and
+    async views what Django's ``condition`` decorator does for sync ones.
+    """
+    def decorator(view):
+        def finish(etag, response):
+            if response.status_code == 200 and not response.has_header('ETag'):
+                response['ETag'] = etag
+            return revalidate_privately(response)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                etag = quote_etag(await sync_to_async(etag_func)(request))
+                not_modified = get_conditional_response(request, etag=etag)
+                if not_modified is not None:
+                    return revalidate_privately(not_modified)
+                return finish(etag, await view(request, *args, **kwargs))
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = quote_etag(etag_func(request))
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return revalidate_privately(not_modified)
+            return finish(etag, view(request, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
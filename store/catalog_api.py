@@ -0,0 +1,157 @@
+"""
+Read-only JSON catalog API for mobile clients.
+
+Clients name the fields they want with ``fields=``. Only the columns
+those fields need are loaded, through ``only()`` on the querysets
+ProductService hands out. The large description column therefore stays
+in the database unless it is asked for.
+
+Encoded bodies are cached under the catalog version, like anonymous
+pages, so a catalog change retires every cached response at once. The
+same version drives the ETag, so an unchanged response is revalidated
+without touching the database.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_catalog_version
+from .images import srcset
+from .pagination import paginate
+from .services import ProductService
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard encoder is used instead
+    orjson = None
+
+
+def _images(product):
+    derivatives = product.image_derivatives or {}
+    if not product.image or derivatives.get('source') != product.image.name:
+        return None
+    return {'webp': srcset(derivatives, 'webp'), 'jpeg': srcset(derivatives, 'jpeg')}
+
+
+# Public field name -> (model columns it reads, value for one product)
+FIELDS = {
+    'id': (['id'], lambda product: product.pk),
+    'name': (['name'], lambda product: product.name),
+    'price': (['price'], lambda product: str(product.price)),
+    'digital': (['digital'], lambda product: product.digital),
+    'size': (['size'], lambda product: product.size),
+    'description': (['description'], lambda product: product.description),
+    'inStock': (['stock'], lambda product: product.is_in_stock),
+    'imageURL': (['image'], lambda product: product.imageURL),
+    'images': (['image', 'image_derivatives'], _images),
+    'createdAt': (['created_at'], lambda product: product.created_at.isoformat() if product.created_at else None),
+}
+
+DEFAULT_FIELDS = ['id', 'name', 'price', 'imageURL']
+
+# Most products one list page or batch lookup returns
+MAX_PRODUCTS = 100
+
+
+class InvalidFields(ValueError):
+    """Raised when ``fields=`` names a field the API does not offer"""
+
+
+def parse_fields(value):
+    """
+    Turn a comma-separated ``fields=`` value into field names.
+
+    ``id`` is always included and comes first. An empty value means
+    DEFAULT_FIELDS.
+
+    Raises:
+        InvalidFields: If a name is not in FIELDS
+    """
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    if not names:
+        return list(DEFAULT_FIELDS)
+    unknown = sorted(set(names) - FIELDS.keys())
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(unknown)}")
+    return ['id'] + sorted(set(names) - {'id'})
+
+
+def columns(fields):
+    """Model columns to load for ``fields``"""
+    return sorted({column for field in fields for column in FIELDS[field][0]})
+
+
+def serialize(product, fields):
+    return {field: FIELDS[field][1](product) for field in fields}
+
+
+def dumps(payload):
+    """Encode a response body compactly, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def etag(request):
+    """ETag of an API response: the catalog version and the full path"""
+    raw = f'{get_catalog_version()}:{request.get_full_path()}'
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def cached_body(key, build):
+    """
+    Return the encoded body cached under ``key`` for the current catalog.
+
+    ``build()`` makes the payload on a miss. It may return None for a
+    missing resource, which is not cached.
+    """
+    key = f'store:api:{get_catalog_version()}:{key}'
+    body = cache.get(key)
+    if body is None:
+        payload = build()
+        if payload is None:
+            return None
+        body = dumps(payload)
+        cache.set(key, body, settings.CATALOG_API_CACHE_TIMEOUT)
+    return body
+
+
+def product_list(fields, cursor=None, limit=None):
+    """
+    One page of active products, newest first.
+
+    Raises:
+        InvalidCursor: If ``cursor`` is malformed
+    """
+    page = paginate(
+        ProductService.get_active_products().only(*columns(fields), 'created_at'),
+        cursor,
+        limit or settings.STORE_PAGE_SIZE,
+    )
+    return {
+        'products': [serialize(product, fields) for product in page.items],
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    }
+
+
+def product_detail(product_id, fields):
+    """One active product, or None if there is no such product"""
+    # A missing ID is an ordinary 404 for API clients, not an error to log
+    product = ProductService.get_active_products().only(*columns(fields)).filter(pk=product_id).first()
+    return serialize(product, fields) if product else None
+
+
+def product_batch(product_ids, fields):
+    """
+    Active products by ID, in the order asked for, with one query.
+
+    IDs with no active product are listed under ``missing``.
+    """
+    products = ProductService.get_active_products().only(*columns(fields)).in_bulk(product_ids)
+    return {
+        'products': [serialize(products[pk], fields) for pk in product_ids if pk in products],
+        'missing': [pk for pk in product_ids if pk not in products],
+    }
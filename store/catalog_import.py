@@ -0,0 +1,273 @@
+"""
+Streaming catalog import from CSV or JSON Lines supplier feeds.
+
+Rows are read one at a time and upserted in fixed-size batches keyed on
+product name. Each batch costs one lookup of the existing names, one
+``bulk_create`` for new products, one ``bulk_create`` upsert on the
+primary key for known ones and one set-based search index refresh. Memory stays bounded by the batch
+size whatever the feed size.
+
+Columns: ``name`` (required), ``price`` (required for new products),
+``description``, ``size``, ``stock``, ``digital``, ``is_active`` and
+``image`` (a path under MEDIA_ROOT). Missing or empty columns leave the
+stored value alone. A name repeated in the feed is applied once per
+batch, with later rows winning.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import sys
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from ecommerce.routers import use_primary
+
+from . import search
+from .cache import bump_catalog_version
+from .models import Product, Size
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+IMPORT_FIELDS = ['price', 'digital', 'description', 'size', 'stock', 'is_active', 'image']
+
+SIZES = {code for code, _ in Product.SIZE_CHOICES}
+
+MAX_PRICE = Decimal('99999.99')
+
+_TRUE = {'1', 'true', 'yes', 'y', 't'}
+_FALSE = {'0', 'false', 'no', 'n', 'f'}
+
+
+class RowError(ValueError):
+    """Raised for a feed row that cannot be imported"""
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    created: int = 0
+    updated: int = 0
+    rejected: int = 0
+
+
+def detect_format(path):
+    """Guess the feed format from its file name, ignoring a .gz suffix"""
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def open_feed(path):
+    """Open a feed for streaming text reads; ``-`` is stdin, ``.gz`` is decompressed"""
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_rows(stream, fmt):
+    """
+    Yield ``(line_number, row)`` pairs from an open feed.
+
+    ``row`` is a dict, or a RowError for a line that does not parse.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, RowError(f"Invalid JSON: {e.msg}")
+            continue
+        if not isinstance(row, dict):
+            yield line_number, RowError("Expected a JSON object")
+            continue
+        yield line_number, row
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else value
+
+
+def _bool(value, column):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise RowError(f"{column} must be true or false")
+
+
+def clean_row(row):
+    """
+    Validate one feed row.
+
+    Returns:
+        tuple: (name, values) with ``values`` holding only the columns
+            the row provides, converted to model types
+
+    Raises:
+        RowError: If a value is missing or invalid
+    """
+    name = _text(row.get('name'))
+    if name is None or name == '':
+        raise RowError("name is required")
+    if not isinstance(name, str):
+        raise RowError(f"name {name!r} is not text")
+    if len(name) > 200:
+        raise RowError("name is longer than 200 characters")
+
+    values = {}
+    for column in IMPORT_FIELDS:
+        value = _text(row.get(column))
+        if value is None or value == '':
+            continue
+        if column == 'price':
+            try:
+                price = Decimal(str(value)).quantize(Decimal('0.01'))
+            except (InvalidOperation, ValueError):
+                raise RowError(f"price {value!r} is not a number")
+            if not Decimal('0') <= price <= MAX_PRICE:
+                raise RowError(f"price {value!r} is out of range")
+            values['price'] = price
+        elif column == 'stock':
+            try:
+                stock = Decimal(str(value))
+            except (InvalidOperation, ValueError):
+                raise RowError(f"stock {value!r} is not a whole number")
+            # int() would quietly truncate 1.7 to 1
+            if not stock.is_finite() or stock != stock.to_integral_value():
+                raise RowError(f"stock {value!r} is not a whole number")
+            stock = int(stock)
+            if stock < 0:
+                raise RowError("stock cannot be negative")
+            values['stock'] = stock
+        elif column in ('digital', 'is_active'):
+            values[column] = _bool(value, column)
+        elif column == 'size':
+            size = str(value).upper()
+            if size not in SIZES:
+                raise RowError(f"size {value!r} is not one of {sorted(SIZES)}")
+            values['size'] = size
+        elif column == 'image':
+            if len(str(value)) > 100:
+                raise RowError("image path is longer than 100 characters")
+            values['image'] = str(value)
+        else:
+            values[column] = str(value)
+    return name, values
+
+
+def _flush(batch, stats, on_reject):
+    """Upsert one batch of ``{name: (line_number, values)}``"""
+    now = timezone.now()
+    with use_primary(), transaction.atomic():
+        existing = {}
+        # Lowest ID wins where the catalog already holds duplicate names
+        for product in Product.objects.filter(name__in=batch).order_by('-id'):
+            existing[product.name] = product
+
+        to_create, to_update, update_fields = [], [], {'updated_at'}
+        for name, (line_number, values) in batch.items():
+            product = existing.get(name)
+            if product is None:
+                if 'price' not in values:
+                    stats.rejected += 1
+                    on_reject(line_number, name, "price is required for new products")
+                    continue
+                to_create.append(Product(name=name, created_at=now, **values))
+                continue
+            for field, value in values.items():
+                setattr(product, field, value)
+            update_fields.update(values)
+            to_update.append(product)
+
+        Product.objects.bulk_create(to_create)
+        if to_update:
+            # An upsert on the primary key writes the whole batch in linear
+            # time; bulk_update's per-field CASE expressions grow with the
+            # batch and are several times slower on SQLite
+            Product.objects.bulk_create(
+                to_update, update_conflicts=True, unique_fields=['id'], update_fields=sorted(update_fields),
+            )
+        sizes = {p.size for p in to_create + to_update if p.size}
+        if sizes:
+            Size.objects.bulk_create([Size(name=size) for size in sizes], ignore_conflicts=True)
+        search.index_products(Product.objects.filter(name__in=batch))
+
+    stats.created += len(to_create)
+    stats.updated += len(to_update)
+
+
+def import_catalog(rows, batch_size=1000, on_batch=None, on_reject=None):
+    """
+    Upsert a stream of feed rows into the catalog.
+
+    Args:
+        rows: Iterable of ``(line_number, row)`` pairs as from ``read_rows``
+        batch_size: Distinct product names written per transaction
+        on_batch: Called with the running ImportStats after each batch
+        on_reject: Called with ``(line_number, name, reason)`` for each
+            rejected row
+
+    Returns:
+        ImportStats
+    """
+    on_reject = on_reject or (lambda line_number, name, reason: None)
+    stats = ImportStats()
+    batch = {}
+    try:
+        for line_number, row in rows:
+            stats.read += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                name, values = clean_row(row)
+            except RowError as e:
+                stats.rejected += 1
+                on_reject(line_number, row.get('name') if isinstance(row, dict) else None, str(e))
+                continue
+
+            if name in batch:
+                batch[name][1].update(values)
+            else:
+                batch[name] = (line_number, values)
+            if len(batch) >= batch_size:
+                _flush(batch, stats, on_reject)
+                batch = {}
+                if on_batch:
+                    on_batch(stats)
+
+        if batch:
+            _flush(batch, stats, on_reject)
+            if on_batch:
+                on_batch(stats)
+    finally:
+        # bulk writes skip the Product signals that retire cached pages
+        if stats.created or stats.updated:
+            bump_catalog_version()
+
+    logger.info(
+        f"Catalog import: {stats.read} rows, {stats.created} created, "
+        f"{stats.updated} updated, {stats.rejected} rejected"
+    )
+    return stats
@@ -0,0 +1,288 @@
+"""
+Streaming exports of completed orders and customers for finance.
+
+Orders are walked by primary key in chunks. Each chunk costs one query
+for the orders and their customers, one for their lines and products and
+one for their shipping addresses. Output is produced chunk by chunk as
+bytes, so memory stays flat however many orders match, and the caller
+can hand the generator to a StreamingHttpResponse or write it to a file.
+Async callers wrap it in ``aiter_stream`` so each chunk is built in the
+sync thread and sent before the next one is loaded.
+
+CSV has one row per order line, repeating the order, customer and
+shipping columns; an order without lines gets one row with empty line
+columns. JSON Lines has one object per order with its lines nested.
+The customer export has one row or object per customer who completed an
+order in the range, with their order count, spend and first and last
+order dates, aggregated in one query per chunk. Either format can be
+gzipped on the fly.
+"""
+import csv
+import io
+import json
+import logging
+import zlib
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max, Min, Prefetch, Q, Sum
+from django.utils import timezone
+
+from .models import Customer, Order, OrderItem, ShippingAddress
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+CSV_COLUMNS = [
+    'order_id', 'transaction_id', 'date_ordered', 'customer_id', 'customer_name', 'customer_email',
+    'order_total', 'order_item_count', 'product_id', 'product_name', 'size', 'quantity', 'unit_price',
+    'line_total', 'address', 'city', 'state', 'zipcode', 'country',
+]
+
+CUSTOMER_CSV_COLUMNS = [
+    'customer_id', 'name', 'email', 'registered', 'order_count', 'total_spent', 'first_order', 'last_order',
+]
+
+CENT = Decimal('0.01')
+
+SHIPPING_FIELDS = ['address', 'city', 'state', 'zipcode', 'country']
+
+
+def _date_range(prefix, start, end):
+    """
+    Q for ``{prefix}date_ordered`` between two dates, inclusive.
+
+    Days are days in TIME_ZONE; the bounds become datetimes so the range
+    stays on the ``date_ordered`` index.
+    """
+    bounds = Q()
+    if start:
+        bounds &= Q(**{f'{prefix}date_ordered__gte': timezone.make_aware(datetime.combine(start, time.min))})
+    if end:
+        bounds &= Q(**{
+            f'{prefix}date_ordered__lt': timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+        })
+    return bounds
+
+
+def completed_orders(start=None, end=None):
+    """
+    Completed orders placed between two dates, inclusive, with everything
+    the export reads loaded in three queries per chunk.
+    """
+    orders = Order.objects.filter(_date_range('', start, end), complete=True)
+    return orders.select_related('customer').prefetch_related(
+        Prefetch(
+            'items',
+            # The description is the only large product column and is not exported
+            queryset=OrderItem.objects.select_related('product').defer('product__description').order_by('pk'),
+        ),
+        Prefetch('shipping_address', queryset=ShippingAddress.objects.order_by('pk')),
+    )
+
+
+def customer_totals(start=None, end=None):
+    """
+    Customers with a completed order between two dates, inclusive,
+    annotated with their order count, spend and first and last order.
+    """
+    orders = Q(orders__complete=True) & _date_range('orders__', start, end)
+    return Customer.objects.annotate(
+        order_count=Count('orders', filter=orders),
+        total_spent=Sum('orders__total', filter=orders),
+        first_order=Min('orders__date_ordered', filter=orders),
+        last_order=Max('orders__date_ordered', filter=orders),
+    ).filter(order_count__gt=0)
+
+
+def iter_chunks(queryset, chunk_size=500):
+    """Yield lists of at most ``chunk_size`` orders, walking the primary key"""
+    queryset = queryset.order_by('pk')
+    last_pk = 0
+    while True:
+        orders = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not orders:
+            return
+        last_pk = orders[-1].pk
+        yield orders
+
+
+def _lines(order):
+    """``(item, unit_price, line_total)`` for each line of an order"""
+    for item in order.items.all():
+        if item.unit_price is not None:
+            price = item.unit_price
+        else:
+            # Completed before prices were frozen at checkout
+            price = item.product.price if item.product else None
+        yield item, price, price * item.quantity if price is not None else None
+
+
+def _shipping(order):
+    addresses = order.shipping_address.all()
+    return addresses[0] if addresses else None
+
+
+def _csv_rows(order):
+    customer = order.customer
+    shipping = _shipping(order)
+    head = [
+        order.pk, order.transaction_id or '', order.date_ordered.isoformat(),
+        customer.pk if customer else '', customer.name if customer else '', customer.email if customer else '',
+        order.total, order.item_count,
+    ]
+    tail = [getattr(shipping, field) or '' if shipping else '' for field in SHIPPING_FIELDS]
+
+    lines = list(_lines(order))
+    if not lines:
+        yield head + [''] * 6 + tail
+    for item, price, line_total in lines:
+        product = item.product
+        yield head + [
+            item.product_id or '', product.name if product else '', item.size, item.quantity,
+            '' if price is None else price, '' if line_total is None else line_total,
+        ] + tail
+
+
+def _json_record(order):
+    customer = order.customer
+    shipping = _shipping(order)
+    return {
+        'id': order.pk,
+        'transactionId': order.transaction_id,
+        'dateOrdered': order.date_ordered.isoformat(),
+        'customer': {'id': customer.pk, 'name': customer.name, 'email': customer.email} if customer else None,
+        'total': str(order.total),
+        'itemCount': order.item_count,
+        'items': [
+            {
+                'productId': item.product_id,
+                'name': item.product.name if item.product else None,
+                'size': item.size,
+                'quantity': item.quantity,
+                'unitPrice': None if price is None else str(price),
+                'lineTotal': None if line_total is None else str(line_total),
+            }
+            for item, price, line_total in _lines(order)
+        ],
+        'shipping': {field: getattr(shipping, field) for field in SHIPPING_FIELDS} if shipping else None,
+    }
+
+
+def _spent(customer):
+    # SQLite sums decimals without their scale
+    return (customer.total_spent or Decimal(0)).quantize(CENT)
+
+
+def _customer_csv_rows(customer):
+    yield [
+        customer.pk, customer.name or '', customer.email or '', customer.user_id is not None,
+        customer.order_count, _spent(customer),
+        customer.first_order.isoformat(), customer.last_order.isoformat(),
+    ]
+
+
+def _customer_json_record(customer):
+    return {
+        'id': customer.pk,
+        'name': customer.name,
+        'email': customer.email,
+        'registered': customer.user_id is not None,
+        'orderCount': customer.order_count,
+        'totalSpent': str(_spent(customer)),
+        'firstOrder': customer.first_order.isoformat(),
+        'lastOrder': customer.last_order.isoformat(),
+    }
+
+
+def _encode_csv(chunks, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for records in chunks:
+        for record in records:
+            writer.writerows(rows(record))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _encode_jsonl(chunks, record):
+    for records in chunks:
+        yield ''.join(json.dumps(record(each)) + '\n' for each in records).encode()
+
+
+def gzip_stream(chunks, level=6):
+    """Compress a stream of bytes into one gzip member as it is produced"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiter_stream(stream):
+    """
+    Drive a sync stream of bytes from async code, one chunk at a time.
+
+    Under ASGI, Django consumes a sync iterator with a single
+    ``sync_to_async(list)`` call and so holds the whole export in memory.
+    Here each ``next()`` runs, queries included, in the sync thread and
+    its chunk is sent before the next one is built.
+    """
+    done = object()  # StopIteration cannot be raised through a coroutine
+    step = sync_to_async(next)
+    while True:
+        chunk = await step(stream, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def export_orders(fmt='csv', start=None, end=None, compress=False, chunk_size=500):
+    """
+    Stream completed orders as CSV or JSON Lines.
+
+    Args:
+        fmt: One of FORMATS
+        start, end: Optional inclusive date bounds on ``date_ordered``
+        compress: Gzip the output
+        chunk_size: Orders loaded per round of queries
+
+    Returns:
+        Iterator of bytes
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    chunks = iter_chunks(completed_orders(start, end), chunk_size)
+    stream = _encode_csv(chunks, CSV_COLUMNS, _csv_rows) if fmt == 'csv' else _encode_jsonl(chunks, _json_record)
+    logger.info(f"Exporting completed orders as {fmt} from {start or 'the start'} to {end or 'now'}")
+    return gzip_stream(stream) if compress else stream
+
+
+def export_customers(fmt='csv', start=None, end=None, compress=False, chunk_size=500):
+    """
+    Stream customers with completed orders and their totals as CSV or JSON Lines.
+
+    Takes the same arguments as ``export_orders``; the dates bound the
+    orders that are counted.
+
+    Returns:
+        Iterator of bytes
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    chunks = iter_chunks(customer_totals(start, end), chunk_size)
+    if fmt == 'csv':
+        stream = _encode_csv(chunks, CUSTOMER_CSV_COLUMNS, _customer_csv_rows)
+    else:
+        stream = _encode_jsonl(chunks, _customer_json_record)
+    logger.info(f"Exporting customers as {fmt} from {start or 'the start'} to {end or 'now'}")
+    return gzip_stream(stream) if compress else stream
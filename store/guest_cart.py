@@ -0,0 +1,371 @@
+"""
+Server-side carts for visitors who are not logged in.
+
+The browser only holds an opaque ``cart_id`` cookie plus a ``cart_count``
+cookie the page script reads for the cart badge. Cart lines are keyed on
+product and size, like a customer's order lines. They live in the cache
+with the GuestCart table as fallback, and are merged into the customer's
+open order when the visitor logs in.
+
+Carts from the old JSON ``cart`` cookie are still read, and move to the
+server on the visitor's next cart update.
+"""
+import hashlib
+import json
+import logging
+import re
+import secrets
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import GuestCart, Product
+from .services import CART_SIZES, CartService
+
+logger = logging.getLogger(__name__)
+
+CART_ID_COOKIE = 'cart_id'
+CART_COUNT_COOKIE = 'cart_count'
+LEGACY_CART_COOKIE = 'cart'
+
+# Bumped when the cached cart format changes; the table is read instead
+CACHE_PREFIX = 'store:guest-cart:v3:'
+
+# Times an update is reapplied after another request changed the cart first
+SAVE_ATTEMPTS = 5
+
+_CART_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+def _parse_legacy_cookie(request):
+    """
+    Decode the old JSON ``cart`` cookie into ``{(product_id, ''): quantity}`` lines.
+
+    Keys that are not integer product IDs and lines without a usable
+    quantity are dropped. The cookie never held a usable size.
+    """
+    try:
+        cart = json.loads(request.COOKIES.get(LEGACY_CART_COOKIE, '{}'))
+    except (json.JSONDecodeError, TypeError) as e:
+        logger.warning(f"Invalid cart cookie data: {e}")
+        cart = {}
+
+    if not isinstance(cart, dict):
+        logger.warning("Cart cookie is not a JSON object, ignoring it")
+        return {}
+
+    lines = {}
+    for product_id, line in cart.items():
+        try:
+            lines[(int(product_id), '')] = int(line.get("quantity", 0))
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.error(f"Error processing cart item {product_id}: {e}")
+    return lines
+
+
+def _encode_line(product_id, size):
+    return f'{product_id}:{size}' if size else str(product_id)
+
+
+def _decode_line(key):
+    """Inverse of ``_encode_line``; carts stored before sizes have bare IDs"""
+    product_id, _, size = key.partition(':')
+    return int(product_id), size
+
+
+def _cart_id(request):
+    cart_id = request.COOKIES.get(CART_ID_COOKIE, '')
+    return cart_id if _CART_ID_RE.match(cart_id) else None
+
+
+def _current_id(request):
+    """The cart ID, including one created earlier in this request"""
+    return getattr(request, '_guest_cart_new_id', None) or _cart_id(request)
+
+
+def _stored_state(cart_id, lines, updated_at):
+    state = {'lines': lines, 'version': str(updated_at.timestamp()), 'updated_at': updated_at}
+    cache.set(CACHE_PREFIX + cart_id, state, settings.GUEST_CART_TTL)
+    return state
+
+
+def _read(cart_id, fresh=False):
+    """
+    Load a stored cart as ``{'lines': {...}, 'version': str, 'updated_at': datetime}``.
+
+    ``fresh`` skips the cache and reads the table.
+
+    Returns:
+        dict, or None if there is no such cart
+    """
+    if not fresh:
+        state = cache.get(CACHE_PREFIX + cart_id)
+        if state is not None:
+            return state
+    row = GuestCart.objects.filter(key=cart_id).values('lines', 'updated_at').first()
+    if row is None:
+        return None
+    lines = {_decode_line(key): qty for key, qty in row['lines'].items()}
+    return _stored_state(cart_id, lines, row['updated_at'])
+
+
+def _state(request):
+    """The visitor's cart, read once per request"""
+    state = getattr(request, '_guest_cart', None)
+    if state is None:
+        cart_id = _cart_id(request)
+        state = _read(cart_id) if cart_id else None
+        if state is None:
+            legacy = request.COOKIES.get(LEGACY_CART_COOKIE, '')
+            state = {
+                'lines': _parse_legacy_cookie(request) if legacy else {},
+                'version': 'legacy:' + hashlib.md5(legacy.encode(), usedforsecurity=False).hexdigest(),
+                # Not stored yet; the first update creates the cart
+                'updated_at': None,
+            }
+        request._guest_cart = state
+    return state
+
+
+def get_lines(request):
+    """
+    Return the visitor's cart lines.
+
+    Returns:
+        dict: Mapping of (product ID, size) to quantity
+    """
+    return _state(request)['lines']
+
+
+def get_version(request):
+    """Token that changes whenever the visitor's cart changes"""
+    return _state(request)['version']
+
+
+def _save(request, lines, updated_at):
+    """
+    Write ``lines`` if the stored cart is still the one read at ``updated_at``.
+
+    With ``updated_at`` None there is no stored cart yet, and one is
+    created under a new ID.
+
+    Returns:
+        bool: False if another request changed the cart first
+    """
+    encoded = {_encode_line(pid, size): qty for (pid, size), qty in lines.items()}
+    if updated_at is None:
+        cart_id = secrets.token_urlsafe(24)
+        request._guest_cart_new_id = cart_id
+        updated_at = GuestCart.objects.create(key=cart_id, lines=encoded).updated_at
+    else:
+        cart_id = _current_id(request)
+        now = timezone.now()
+        written = GuestCart.objects.filter(key=cart_id, updated_at=updated_at).update(lines=encoded, updated_at=now)
+        if not written:
+            return False
+        updated_at = now
+
+    request._guest_cart = _stored_state(cart_id, dict(lines), updated_at)
+    request._guest_cart_changed = True
+    return True
+
+
+def _update(request, change):
+    """
+    Replace the visitor's cart lines with ``change(lines)``.
+
+    The write is a compare-and-set on ``updated_at``. When another request
+    changed the cart in between, the cart is reread from the table and
+    ``change`` applied again, so concurrent updates never overwrite each
+    other.
+
+    Returns:
+        dict: The updated cart lines
+
+    Raises:
+        ValidationError: If the cart kept changing for SAVE_ATTEMPTS tries
+    """
+    state = _state(request)
+    for attempt in range(SAVE_ATTEMPTS):
+        lines = change(dict(state['lines']))
+        if lines == state['lines'] or _save(request, lines, state['updated_at']):
+            return lines
+        logger.info(f"Guest cart changed concurrently, retrying (attempt {attempt + 1})")
+        cart_id = _current_id(request)
+        state = _read(cart_id, fresh=True) if cart_id else None
+        if state is None:
+            # Purged in between; start a new cart
+            state = {'lines': {}, 'version': 'empty', 'updated_at': None}
+        request._guest_cart = state
+    raise ValidationError("The cart is being changed elsewhere, please retry")
+
+
+def apply_operations(request, operations):
+    """
+    Apply a batch of quantity changes to the visitor's cart.
+
+    Validates products the same way ``CartService.apply_operations``
+    does. Call ``set_cookies`` on the response afterwards.
+
+    Args:
+        request: Django HTTP request object
+        operations: Iterable of (product_id, size, delta) triples
+
+    Returns:
+        dict: The updated cart lines
+
+    Raises:
+        ValidationError: If a product or size is unknown, or a product
+            is no longer available and the batch adds to it
+    """
+    deltas = defaultdict(int)
+    for product_id, size, delta in operations:
+        deltas[(product_id, size)] += delta
+    deltas = {line: delta for line, delta in deltas.items() if delta}
+    if not deltas:
+        return dict(get_lines(request))
+
+    CartService.check_sizes(size for _, size in deltas)
+    product_ids = {product_id for product_id, _ in deltas}
+    active = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'is_active'))
+    unknown = sorted(product_ids - set(active))
+    if unknown:
+        raise ValidationError(f"Unknown products: {unknown}")
+    unavailable = sorted({pid for (pid, _), delta in deltas.items() if delta > 0 and not active[pid]})
+    if unavailable:
+        raise ValidationError(f"Products no longer available: {unavailable}")
+
+    def change(lines):
+        for line, delta in deltas.items():
+            quantity = lines.get(line, 0) + delta
+            if quantity > 0:
+                lines[line] = quantity
+            else:
+                lines.pop(line, None)
+        return lines
+
+    return _update(request, change)
+
+
+def set_sizes(request, changes):
+    """
+    Move lines of the visitor's cart to other sizes.
+
+    Call ``set_cookies`` on the response afterwards.
+
+    Args:
+        request: Django HTTP request object
+        changes: Iterable of (product_id, old_size, new_size) triples,
+            applied as described in ``CartService.resize_lines``
+
+    Returns:
+        dict: The updated cart lines
+
+    Raises:
+        ValidationError: If a size is unknown
+    """
+    changes = [change for change in changes if change[1] != change[2]]
+    CartService.check_sizes(size for change in changes for size in change[1:])
+    return _update(request, lambda lines: CartService.resize_lines(lines, changes))
+
+
+def clear(request):
+    """Delete the visitor's cart; call ``set_cookies`` on the response afterwards"""
+    cart_id = _current_id(request)
+    if cart_id:
+        cache.delete(CACHE_PREFIX + cart_id)
+        GuestCart.objects.filter(key=cart_id).delete()
+    request._guest_cart = {'lines': {}, 'version': 'empty', 'updated_at': None}
+    request._guest_cart_cleared = True
+
+
+def merge_into_customer(request, customer):
+    """
+    Move the visitor's cart into the customer's open order.
+
+    Quantities are added to any lines already in the order with one
+    ``CartService.apply_operations`` batch. Products that are gone or
+    inactive and lines with a size the store no longer offers are
+    dropped.
+
+    Lines that still fail are logged and skipped.
+
+    Returns:
+        Order object, or None if nothing was merged
+    """
+    lines = get_lines(request)
+    if not lines:
+        return None
+    product_ids = {product_id for product_id, _ in lines}
+    active = set(Product.objects.filter(id__in=product_ids, is_active=True).values_list('id', flat=True))
+    operations = [
+        (pid, size, qty) for (pid, size), qty in lines.items()
+        if pid in active and size in CART_SIZES and qty > 0
+    ]
+    try:
+        with transaction.atomic():
+            order = CartService.apply_operations(customer, operations)
+            clear(request)
+    except ValidationError as exc:
+        # A line went bad since the check above; merge the rest one by one
+        logger.warning(f"Guest cart merge for customer {customer.id} failed as a batch: {exc}")
+        merged = []
+        for operation in operations:
+            try:
+                with transaction.atomic():
+                    order = CartService.apply_operations(customer, [operation])
+                merged.append(operation)
+            except ValidationError as exc:
+                logger.warning(f"Skipped guest cart line {operation[:2]}: {exc}")
+        clear(request)
+        operations = merged
+        if not merged:
+            return None
+    logger.info(f"Merged {len(operations)} guest cart lines into order #{order.id}")
+    return order
+
+
+def set_cookies(request, response):
+    """Bring the visitor's cart cookies in line with what this request changed"""
+    if getattr(request, '_guest_cart_cleared', False):
+        response.delete_cookie(CART_ID_COOKIE)
+        response.delete_cookie(CART_COUNT_COOKIE)
+        response.delete_cookie(LEGACY_CART_COOKIE)
+        return response
+    if not getattr(request, '_guest_cart_changed', False):
+        return response
+
+    new_id = getattr(request, '_guest_cart_new_id', None)
+    if new_id:
+        response.set_cookie(
+            CART_ID_COOKIE, new_id, max_age=settings.GUEST_CART_TTL,
+            httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+        )
+    response.set_cookie(
+        CART_COUNT_COOKIE, str(sum(get_lines(request).values())), max_age=settings.GUEST_CART_TTL,
+        samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+    )
+    if LEGACY_CART_COOKIE in request.COOKIES:
+        response.delete_cookie(LEGACY_CART_COOKIE)
+    return response
+
+
+def purge_stale(batch_size=1000):
+    """
+    Delete carts not updated within GUEST_CART_TTL, in short batches.
+
+    Returns:
+        int: Number of carts deleted
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.GUEST_CART_TTL)
+    deleted = 0
+    while True:
+        ids = list(GuestCart.objects.filter(updated_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += GuestCart.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,154 @@
+"""
+Idempotency keys for endpoints that must not run twice.
+
+A client sends an ``Idempotency-Key`` header and reuses it when it
+retries, for example after a timeout. The first request with a key runs
+the view and records its response, cookies included, in the same
+transaction as the view's own writes. The key is claimed in that
+transaction too, so a retry that arrives while the first request is
+still running waits for it and then gets its response back, without
+running the view again. A claim left behind by a request that never
+finished gets a 409 until IDEMPOTENCY_LOCK_TIMEOUT passes. A key reused
+with a different body, or by a different visitor, gets a 422.
+
+Requests without the header run as before.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from . import guest_cart, inventory
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    """Digest of who sent the request and what it asked for"""
+    if request.user.is_authenticated:
+        caller = f'user:{request.user.pk}'
+    else:
+        caller = f'guest:{request.COOKIES.get(guest_cart.CART_ID_COOKIE, "")}'
+    digest = hashlib.sha256(f'{caller}\n{request.method} {request.path}\n'.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(scope, key, digest):
+    """
+    Insert the key, or return the row already holding it.
+
+    Returns:
+        tuple: (IdempotencyKey, claimed) where ``claimed`` means this
+            request owns the key and must run the view
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(scope=scope, key=key, fingerprint=digest), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if record is None:
+        # Purged in between; the caller may simply retry
+        return None, False
+
+    expired = record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    abandoned = (
+        record.status_code is None
+        and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+    )
+    if expired or abandoned:
+        # Take the key over; the conditional UPDATE lets only one retry win
+        taken = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+            fingerprint=digest, status_code=None, content_type='', body='', cookies=[], created_at=now,
+        )
+        if taken:
+            record.fingerprint, record.status_code, record.created_at = digest, None, now
+            return record, True
+    return record, False
+
+
+def _replay(record):
+    response = HttpResponse(record.body, content_type=record.content_type, status=record.status_code)
+    for cookie in record.cookies:
+        response.cookies.load(cookie)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """
+    Make a view replay its recorded response for a repeated Idempotency-Key.
+
+    The view runs in a transaction that also records its response, so a
+    crash can never leave the view's writes committed without the
+    response that a retry should get back.
+
+    Responses with a 409 or 5xx status are not recorded, so the client can
+    retry them with the same key.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return JsonResponse({'error': f'{HEADER} is too long'}, status=400)
+
+            digest = fingerprint(request)
+            # An exception from the view rolls the claim back with it
+            # One write transaction per request; a retry queues here behind
+            # the request holding its key
+            with inventory.write_transaction():
+                record, claimed = _claim(scope, key, digest)
+                if not claimed:
+                    if record is None or record.status_code is None:
+                        response = JsonResponse({'error': 'A request with this key is in progress'}, status=409)
+                        response['Retry-After'] = '1'
+                        return response
+                    if record.fingerprint != digest:
+                        return JsonResponse({'error': f'{HEADER} was used for a different request'}, status=422)
+                    logger.info(f"Replaying response for {scope} key {key}")
+                    return _replay(record)
+
+                response = view(request, *args, **kwargs)
+                if response.status_code == 409 or response.status_code >= 500 or response.streaming:
+                    IdempotencyKey.objects.filter(pk=record.pk).delete()
+                else:
+                    IdempotencyKey.objects.filter(pk=record.pk).update(
+                        status_code=response.status_code,
+                        content_type=response.get('Content-Type', ''),
+                        body=response.content.decode(response.charset),
+                        cookies=[morsel.OutputString() for morsel in response.cookies.values()],
+                    )
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired(batch_size=1000):
+    """
+    Delete keys older than IDEMPOTENCY_KEY_TTL, in short batches.
+
+    Returns:
+        int: Number of keys deleted
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,135 @@
+"""
+Responsive image derivatives for product photos.
+
+Each original is resized to a fixed set of widths and written as WebP and
+JPEG files whose names carry a hash of their content, so they can be
+cached forever. The generated files are recorded on
+``Product.image_derivatives``, which the ``product_image`` template tag
+turns into ``srcset`` attributes.
+
+Rendering works on plain file paths so it can run in worker processes.
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (320, 480, 640, 960, 1280)
+DERIVATIVE_DIR = 'derivatives'
+
+# Pillow format name, file extension and save options per output format
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def target_widths(original_width):
+    """Widths to render for an original, never upscaling it"""
+    widths = [width for width in DERIVATIVE_WIDTHS if width < original_width]
+    return widths or [original_width]
+
+
+def render_derivatives(media_root, name):
+    """
+    Render every derivative of one original image.
+    
+    Args:
+        media_root: Absolute directory the image name is relative to
+        name: Storage name of the original, e.g. ``products/men.jpeg``
+        
+    Returns:
+        dict: Description suitable for ``Product.image_derivatives``
+        
+    Raises:
+        OSError: If the original cannot be read or decoded
+    """
+    with Image.open(os.path.join(media_root, name)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    output_dir = os.path.join(media_root, DERIVATIVE_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+
+    derivatives = {
+        'source': name,
+        'width': image.width,
+        'height': image.height,
+        'bytes': os.path.getsize(os.path.join(media_root, name)),
+    }
+    for key, (pil_format, extension, options) in FORMATS.items():
+        rendered = []
+        for width in target_widths(image.width):
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            if pil_format == 'JPEG' and resized.mode != 'RGB':
+                resized = resized.convert('RGB')
+
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            data = buffer.getvalue()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            filename = f'{stem}-{width}w.{digest}.{extension}'
+            path = os.path.join(output_dir, filename)
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(data)
+            rendered.append([width, f'{DERIVATIVE_DIR}/{filename}', len(data)])
+        derivatives[key] = rendered
+    return derivatives
+
+
+def render_task(task):
+    """Process-pool entry point: returns (pk, derivatives or None)"""
+    pk, media_root, name = task
+    try:
+        return pk, render_derivatives(media_root, name)
+    except OSError as e:
+        logger.warning(f"Could not render derivatives for {name}: {e}")
+        return pk, None
+
+
+def needs_derivatives(product):
+    """True when the product's image has no derivatives for its current file"""
+    if not product.image:
+        return bool(product.image_derivatives)
+    return (product.image_derivatives or {}).get('source') != product.image.name
+
+
+def update_product_derivatives(product):
+    """
+    Render derivatives for one product in-process and store them.
+    
+    Run by the ``render_image_derivatives`` job after an upload; bulk work
+    goes through the ``generate_image_derivatives`` command instead.
+    Cached pages still showing the plain image are retired once the
+    derivatives are committed.
+    """
+    from .cache import bump_catalog_version
+    from .models import Product
+
+    derivatives = {}
+    if product.image:
+        pk, derivatives = render_task((product.pk, settings.MEDIA_ROOT, product.image.name))
+        if derivatives is None:
+            return
+    # A queryset update skips signals, so this cannot re-trigger itself
+    Product.objects.filter(pk=product.pk).update(image_derivatives=derivatives)
+    product.image_derivatives = derivatives
+    transaction.on_commit(bump_catalog_version)
+
+
+def srcset(derivatives, key):
+    """Build a ``srcset`` attribute value for one output format"""
+    return ', '.join(
+        f'{default_storage.url(name)} {width}w' for width, name, size in derivatives.get(key, [])
+    )
@@ -0,0 +1,200 @@
+"""
+Inventory reservations with contention-safe stock decrements.
+
+``Product.stock`` is the quantity still available to sell. Checkout holds
+stock by decrementing it with a conditional ``UPDATE ... WHERE stock >= n``
+and records the hold as a StockReservation. Completing the order consumes
+the holds; holds left behind by abandoned checkouts expire and are handed
+back in bulk by ``release_expired``.
+
+Only physical products are tracked; digital products never run out.
+
+Cached catalog pages show whether a product is in stock, not how many
+are left, so they are only retired when a change here takes a product's
+stock to zero or back up from it.
+"""
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+from . import cache
+from .models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(ValidationError):
+    """Raised when a product cannot cover the requested quantity"""
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f"Not enough stock for product {product_id}")
+
+
+# SQLite's busy handler polls, sleeping up to 100 ms between tries, so
+# under load a waiting writer sleeps long after the lock is free and the
+# unluckiest ones time out. Writers in this process queue here instead and
+# are woken as soon as the lock is handed over; only writers in other
+# processes still meet the busy handler. Reentrant, so write transactions
+# can nest.
+_sqlite_writers = threading.RLock()
+
+
+def begin_write():
+    """
+    Take the SQLite write lock at the start of the current transaction.
+    
+    SQLite transactions start deferred, and one that reads before it
+    writes fails with "database is locked" instead of waiting when another
+    writer got in first. A no-op write up front makes concurrent checkouts
+    queue on the busy timeout. Other engines rely on row locks instead.
+    """
+    if connection.vendor == 'sqlite' and connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {Product._meta.db_table} SET stock = stock WHERE 0")
+
+
+@contextmanager
+def write_transaction():
+    """
+    ``transaction.atomic()`` that takes the database write lock up front.
+    
+    Works as a decorator too. On SQLite, writers in this process queue on
+    a lock of their own rather than polling the database; see
+    ``begin_write`` for why the write lock is taken first.
+    """
+    queue = _sqlite_writers if connection.vendor == 'sqlite' else nullcontext()
+    with queue, transaction.atomic():
+        begin_write()
+        yield
+
+
+def _availability_changed():
+    """Retire cached catalog pages once the current transaction commits"""
+    transaction.on_commit(cache.bump_catalog_version)
+
+
+def _restock(changes):
+    """Add each product's change to its stock"""
+    if Product.objects.filter(pk__in=changes, stock=0).exists():
+        _availability_changed()
+    Product.objects.filter(pk__in=changes).update(stock=_stock_change(changes))
+
+
+def _stock_change(changes):
+    """CASE expression adding each product's change to its stock"""
+    return F('stock') + Case(
+        *[When(pk=product_id, then=Value(change)) for product_id, change in changes.items()],
+        default=Value(0),
+    )
+
+
+def reserve_order(order, ttl=None):
+    """
+    Hold stock for every physical line of ``order``.
+    
+    Existing holds are adjusted to the current quantities and their
+    expiry is pushed out, so calling this again on the same order is
+    cheap. Must run inside a transaction: when a product runs short,
+    InsufficientStock is raised and the rollback undoes earlier holds.
+    
+    Args:
+        order: Order object
+        ttl: Seconds the hold lasts (default: STOCK_RESERVATION_TTL)
+        
+    Raises:
+        InsufficientStock: If a product cannot cover its line
+    """
+    ttl = settings.STOCK_RESERVATION_TTL if ttl is None else ttl
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+
+    wanted = {
+        row['product_id']: row['quantity']
+        for row in order.items.filter(product__isnull=False, product__digital=False)
+        .values('product_id').annotate(quantity=Sum('quantity')).order_by()
+        if row['quantity'] > 0
+    }
+    held = dict(order.reservations.values_list('product_id', 'quantity'))
+
+    taken_ids = []
+    released = {}
+    # Fixed order keeps concurrent checkouts from deadlocking on row locks
+    for product_id in sorted(set(wanted) | set(held)):
+        change = wanted.get(product_id, 0) - held.get(product_id, 0)
+        if change > 0:
+            taken = Product.objects.filter(pk=product_id, stock__gte=change).update(
+                stock=F('stock') - change
+            )
+            if not taken:
+                raise InsufficientStock(product_id)
+            taken_ids.append(product_id)
+        elif change < 0:
+            released[product_id] = -change
+    if taken_ids and Product.objects.filter(pk__in=taken_ids, stock=0).exists():
+        _availability_changed()
+    if released:
+        _restock(released)
+
+    order.reservations.all().delete()
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in wanted.items()
+    ])
+
+
+def consume_reservations(order):
+    """Turn the order's holds into sales; the stock stays decremented"""
+    order.reservations.all().delete()
+
+
+def release_order(order):
+    """Hand back all stock held for ``order``"""
+    _release(order.reservations.values_list('id', 'product_id', 'quantity'))
+
+
+def _release(rows):
+    """Return the held quantity of each (id, product_id, quantity) row to stock"""
+    rows = list(rows)
+    if not rows:
+        return 0
+    totals = defaultdict(int)
+    for _, product_id, quantity in rows:
+        totals[product_id] += quantity
+    _restock(totals)
+    StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def release_expired(batch_size=1000):
+    """
+    Hand back stock from every expired hold, one batch per transaction.
+    
+    Each batch costs a fixed number of queries: one read, one UPDATE
+    across all affected products and one DELETE.
+    
+    Returns:
+        int: Number of holds released
+    """
+    now = timezone.now()
+    released = 0
+    while True:
+        with write_transaction():
+            count = _release(
+                StockReservation.objects.filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+        released += count
+        if count < batch_size:
+            break
+    if released:
+        logger.info(f"Released {released} expired stock reservations")
+    return released
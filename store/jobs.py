@@ -0,0 +1,216 @@
+"""
+Durable background jobs kept in the database.
+
+Follow-up work such as confirmation emails is queued with ``enqueue``
+inside the transaction that makes it necessary. The job therefore
+exists exactly when that transaction commits, and the request does not
+wait for the work itself.
+
+The ``run_jobs`` worker claims due jobs and runs their handlers. A job
+is deleted once its handler succeeds. A failing job is retried with
+exponential backoff and moved to DeadLetterJob once it runs out of
+attempts. No broker is needed, so this runs on a single box with SQLite.
+
+A claim that outlives JOB_LOCK_TIMEOUT is treated as abandoned by a dead
+worker, and the job runs again. Handlers must be safe to repeat.
+"""
+import logging
+import os
+import random
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import images
+from .models import DeadLetterJob, Job, Order, Product
+
+logger = logging.getLogger(__name__)
+
+# Job name -> handler, filled by the @job decorator
+HANDLERS = {}
+
+
+def job(name):
+    """Register the decorated function as the handler for jobs called ``name``"""
+    def register(func):
+        HANDLERS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    """
+    Queue a job for the worker.
+
+    Call it inside the transaction whose commit should trigger the job.
+
+    Args:
+        name: Registered job name
+        payload: JSON-serializable keyword arguments for the handler
+        delay: Seconds to wait before the job becomes due
+        max_attempts: Runs before the job is dead-lettered (default: JOB_MAX_ATTEMPTS)
+
+    Returns:
+        Job object
+    """
+    if name not in HANDLERS:
+        raise ValueError(f"Unknown job: {name}")
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def enqueue_order_completed(order):
+    """Queue the follow-ups of a completed checkout"""
+    enqueue('send_order_confirmation', {'order_id': order.id})
+
+
+def retry_delay(attempts):
+    """Seconds before retrying a job that has failed ``attempts`` times, with jitter"""
+    delay = min(settings.JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker, limit=10):
+    """
+    Lock up to ``limit`` due jobs for ``worker``.
+
+    The single UPDATE re-checks that each job is still unclaimed, so two
+    workers can never both take the same job. Every claim counts as an
+    attempt, so a job that keeps killing its worker still reaches the
+    dead-letter table.
+
+    Returns:
+        list: Claimed Job objects, oldest first
+    """
+    now = timezone.now()
+    claimable = Q(run_at__lte=now) & (
+        Q(locked_at__isnull=True) | Q(locked_at__lt=now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT))
+    )
+    ids = list(Job.objects.filter(claimable).order_by('run_at', 'id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    Job.objects.filter(claimable, id__in=ids).update(
+        locked_at=now, locked_by=worker, attempts=F('attempts') + 1,
+    )
+    return list(Job.objects.filter(id__in=ids, locked_by=worker, locked_at=now).order_by('run_at', 'id'))
+
+
+def run(claimed, worker):
+    """
+    Run one claimed job and record the outcome.
+
+    Returns:
+        bool: True if the handler succeeded
+    """
+    try:
+        handler = HANDLERS[claimed.name]
+    except KeyError:
+        _failed(claimed, f"No handler registered for {claimed.name}")
+        return False
+
+    try:
+        # Database work done by the handler commits together with the
+        # job's removal
+        with transaction.atomic():
+            handler(**claimed.payload)
+            Job.objects.filter(pk=claimed.pk, locked_by=worker).delete()
+    except Exception as e:
+        _failed(claimed, f"{type(e).__name__}: {e}")
+        return False
+    return True
+
+
+def _failed(claimed, error):
+    """Schedule a retry, or dead-letter the job when it is out of attempts"""
+    if claimed.attempts >= claimed.max_attempts:
+        with transaction.atomic():
+            DeadLetterJob.objects.create(
+                name=claimed.name,
+                payload=claimed.payload,
+                attempts=claimed.attempts,
+                last_error=error,
+                created_at=claimed.created_at,
+            )
+            Job.objects.filter(pk=claimed.pk).delete()
+        logger.error(f"Job {claimed} dead-lettered after {claimed.attempts} attempts: {error}")
+        return
+
+    delay = retry_delay(claimed.attempts)
+    Job.objects.filter(pk=claimed.pk).update(
+        run_at=timezone.now() + timedelta(seconds=delay),
+        locked_at=None,
+        locked_by='',
+        last_error=error,
+    )
+    logger.warning(f"Job {claimed} failed (attempt {claimed.attempts}), retrying in {delay:.0f}s: {error}")
+
+
+def run_pending(worker=None, limit=10):
+    """
+    Claim and run one batch of due jobs.
+
+    Returns:
+        tuple: (succeeded, failed) counts; both 0 when nothing was due
+    """
+    worker = worker or worker_name()
+    succeeded = failed = 0
+    for claimed in claim(worker, limit):
+        if run(claimed, worker):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def retry_dead_letters(queryset):
+    """
+    Move dead-lettered jobs back onto the queue with fresh attempts.
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    with transaction.atomic():
+        dead = list(queryset)
+        Job.objects.bulk_create([
+            Job(name=d.name, payload=d.payload, max_attempts=settings.JOB_MAX_ATTEMPTS) for d in dead
+        ])
+        DeadLetterJob.objects.filter(pk__in=[d.pk for d in dead]).delete()
+    return len(dead)
+
+
+@job('send_order_confirmation')
+def send_order_confirmation(order_id):
+    """Email the customer a summary of their completed order"""
+    order = Order.objects.select_related('customer').get(pk=order_id)
+    if not order.customer or not order.customer.email:
+        logger.info(f"Order #{order_id} has no customer email, skipping confirmation")
+        return
+    items = order.items.select_related('product').filter(product__isnull=False)
+    body = render_to_string('store/emails/order_confirmation.txt', {'order': order, 'items': items})
+    send_mail(f"Your order #{order.id}", body, None, [order.customer.email])
+    logger.info(f"Sent confirmation for order #{order.id} to {order.customer.email}")
+
+
+@job('render_image_derivatives')
+def render_image_derivatives(product_id):
+    """Render the responsive derivatives of a product's uploaded image"""
+    product = Product.objects.only('id', 'image', 'image_derivatives').filter(pk=product_id).first()
+    # Deleted, or rendered by an earlier run of a repeated job
+    if product is None or not images.needs_derivatives(product):
+        return
+    images.update_product_derivatives(product)
+    logger.info(f"Rendered image derivatives for product {product_id}")
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+
+from store.benchmarks import BENCHMARKS, compare
+
+
+class Command(BaseCommand):
+    help = "Run store benchmarks against a throwaway test database"
+
+    def use_file_database(self):
+        """
+        Put the SQLite test database in a temporary file instead of memory.
+        
+        An on-disk database matches production and lets concurrent
+        benchmarks wait on real file locks.
+        """
+        if connection.vendor != 'sqlite':
+            return None
+        tmpdir = tempfile.mkdtemp(prefix='store-benchmark-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'benchmark.sqlite3')
+        return tmpdir
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help=f"Benchmarks to run (default: all). Choices: {', '.join(BENCHMARKS)}",
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help="Timed calls per measurement (default: 20)",
+        )
+        parser.add_argument(
+            '--json', metavar='PATH',
+            help="Write the results as JSON to PATH ('-' for stdout)",
+        )
+        parser.add_argument(
+            '--compare', metavar='BASELINE',
+            help="Fail if results regress against a JSON file written by --json",
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help="Allowed latency growth and throughput drop as a fraction (default: 0.5)",
+        )
+
+    def load_baseline(self, path):
+        try:
+            with open(path) as fh:
+                return json.load(fh)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+    def write_json(self, path, results):
+        document = {
+            'generated_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'results': results,
+        }
+        payload = json.dumps(document, indent=2, default=str)
+        if path == '-':
+            self.stdout.write(payload)
+        else:
+            with open(path, 'w') as fh:
+                fh.write(payload + '\n')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+        baseline = self.load_baseline(options['compare']) if options['compare'] else None
+        quiet = options['json'] == '-'
+        results = []
+
+        # Request logging would dominate the timings of the small hot paths
+        logging.disable(logging.WARNING)
+        setup_test_environment()
+        tmpdir = self.use_file_database()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # A private in-memory cache keeps benchmark pages out of the real one
+        isolated_cache = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        })
+        isolated_cache.enable()
+        try:
+            for name in names:
+                for row in BENCHMARKS[name](iterations=options['iterations']):
+                    results.append(row)
+                    if not quiet:
+                        self.stdout.write(
+                            '  '.join(f"{key}={value}" for key, value in row.items())
+                        )
+        finally:
+            isolated_cache.disable()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if options['json']:
+            self.write_json(options['json'], results)
+        if baseline is None:
+            return
+
+        regressions = compare(baseline, results, options['tolerance'])
+        for regression in regressions:
+            row = '  '.join(f"{key}={value}" for key, value in regression['row'].items())
+            self.stderr.write(self.style.ERROR(
+                f"{row}  {regression['metric']}: {regression['baseline']} -> {regression['current']}"
+            ))
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}")
+        self.stderr.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
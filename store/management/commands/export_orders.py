@@ -0,0 +1,61 @@
+import sys
+from datetime import date
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream completed orders with their lines and shipping addresses, or customers with their "
+        "order totals, to CSV or JSON Lines"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o', default='-',
+            help="File to write, or - for stdout (default). A .gz suffix turns on --gzip",
+        )
+        parser.add_argument('--format', choices=exports.FORMATS, help="Default: from --output, else csv")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output")
+        parser.add_argument(
+            '--customers', action='store_true',
+            help="Export customers with their order count and spend instead of orders",
+        )
+        parser.add_argument('--start', type=date.fromisoformat, help="First order date, YYYY-MM-DD")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last order date, YYYY-MM-DD")
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders loaded per round of queries")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        compress = options['gzip'] or path.endswith('.gz')
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'jsonl' if path.removesuffix('.gz').endswith(('.jsonl', '.ndjson')) else 'csv'
+        if options['start'] and options['end'] and options['start'] > options['end']:
+            raise CommandError("--start is after --end")
+
+        export = exports.export_customers if options['customers'] else exports.export_orders
+        stream = export(
+            fmt, start=options['start'], end=options['end'], compress=compress, chunk_size=options['batch_size'],
+        )
+        started = perf_counter()
+        written = 0
+        out = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        try:
+            for chunk in stream:
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+            else:
+                out.flush()
+
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {written} bytes of {fmt}{' (gzip)' if compress else ''} to {path} "
+                f"in {perf_counter() - started:.1f}s"
+            ))
@@ -0,0 +1,77 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog_import
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSON Lines product feed into the catalog, upserting on name"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file (.csv, .jsonl, optionally .gz) or '-' for stdin")
+        parser.add_argument(
+            '--format', choices=catalog_import.FORMATS,
+            help="Feed format (default: from the file extension)",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Products written per transaction (default: 1000)",
+        )
+        parser.add_argument(
+            '--rejects', metavar='PATH',
+            help="Write rejected rows to PATH as CSV (line, name, reason)",
+        )
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or catalog_import.detect_format(options['path'])
+        if fmt is None:
+            raise CommandError("Cannot tell the feed format from the file name; pass --format")
+
+        try:
+            feed = catalog_import.open_feed(options['path'])
+        except OSError as e:
+            raise CommandError(f"Cannot open feed: {e}")
+
+        rejects_file = open(options['rejects'], 'w', newline='') if options['rejects'] else None
+        rejects = csv.writer(rejects_file) if rejects_file else None
+        if rejects:
+            rejects.writerow(['line', 'name', 'reason'])
+        shown = [0]
+
+        def on_reject(line_number, name, reason):
+            if rejects:
+                rejects.writerow([line_number, name or '', reason])
+            elif shown[0] < 20:
+                self.stderr.write(f"Line {line_number}: {reason}")
+            shown[0] += 1
+
+        start = time.perf_counter()
+
+        def on_batch(stats):
+            rate = stats.read / max(time.perf_counter() - start, 1e-9)
+            self.stdout.write(
+                f"{stats.read} rows: {stats.created} created, {stats.updated} updated, "
+                f"{stats.rejected} rejected ({rate:.0f} rows/s)"
+            )
+
+        try:
+            with feed:
+                stats = catalog_import.import_catalog(
+                    catalog_import.read_rows(feed, fmt),
+                    batch_size=options['batch_size'],
+                    on_batch=on_batch,
+                    on_reject=on_reject,
+                )
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        if stats.rejected and not rejects and stats.rejected > 20:
+            self.stderr.write(f"... {stats.rejected - 20} more rejected rows; use --rejects to keep them all")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.created + stats.updated} products "
+            f"({stats.created} created, {stats.updated} updated, {stats.rejected} rejected) "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store import guest_cart
+
+
+class Command(BaseCommand):
+    help = "Delete guest carts idle for longer than GUEST_CART_TTL (run periodically)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Carts deleted per query (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        deleted = guest_cart.purge_stale(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} stale guest carts"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text product search index from the product table"
+
+    def handle(self, *args, **options):
+        if not search.is_available(write=True):
+            raise CommandError("The full-text index requires SQLite with FTS5")
+
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} products"))
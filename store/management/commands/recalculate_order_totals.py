@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Order
+from store.services import OrderService
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored total, item_count and requires_shipping of orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Orders recomputed per batch (default: 1000)",
+        )
+        parser.add_argument(
+            '--open-only', action='store_true',
+            help="Only recompute orders that are not complete yet",
+        )
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options['open_only']:
+            queryset = queryset.filter(complete=False)
+
+        updated = OrderService.recalculate_totals(queryset, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Recalculated totals for {updated} orders"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store import rollups
+
+
+class Command(BaseCommand):
+    help = "Fold new and changed orders into the sales rollup tables (run periodically)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Recompute every rollup row instead of only days with changed orders",
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            days = rollups.rebuild_rollups()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups for {days} days"))
+        else:
+            days = rollups.update_rollups()
+            self.stdout.write(self.style.SUCCESS(f"Updated sales rollups for {days} days"))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs until stopped, or once with --once"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Run every job that is due now, then exit",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help="Jobs claimed at a time (default: 10)",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help="Seconds to sleep when no job is due (default: 1)",
+        )
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_name()
+        succeeded = failed = 0
+        try:
+            while True:
+                close_old_connections()
+                done, errors = jobs.run_pending(worker, limit=options['batch_size'])
+                succeeded += done
+                failed += errors
+                if done or errors:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Ran {succeeded} jobs, {failed} failed"))
@@ -0,0 +1,28 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ecommerce.routers import PRIMARY
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database onto the local stand-in replicas"
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError("Only SQLite replicas can be synced locally; use real replication")
+        if not settings.REPLICA_DATABASES:
+            raise CommandError("No replicas configured; set DATABASE_REPLICAS")
+
+        # The backup API takes a consistent snapshot while the primary is in use
+        primary.ensure_connection()
+        for alias in settings.REPLICA_DATABASES:
+            target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f"Synced {alias}"))
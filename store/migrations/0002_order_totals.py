@@ -0,0 +1,72 @@
+# Generated by Django 4.2.3 on 2026-10-17 19:15
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+def backfill_totals(apps, schema_editor):
+    """
+    Fill the new columns of existing orders.
+
+    Mirrors OrderService.recalculate_totals on the historical models:
+    orders are walked by primary key, with one grouped aggregate and one
+    bulk update per batch. Lines are priced at the product price, as
+    OrderItem.unit_price only arrives in 0011.
+    """
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    last_pk = 0
+    while True:
+        orders = list(Order.objects.filter(pk__gt=last_pk).order_by('pk')[:1000])
+        if not orders:
+            return
+        last_pk = orders[-1].pk
+        totals = {
+            row['order_id']: row
+            for row in OrderItem.objects.filter(order__in=orders)
+            .values('order_id')
+            .annotate(
+                total=Sum(
+                    F('quantity') * F('product__price'),
+                    output_field=models.DecimalField(max_digits=12, decimal_places=2),
+                ),
+                item_count=Sum('quantity'),
+                physical_items=Count('id', filter=Q(product__digital=False)),
+            )
+            .order_by()
+        }
+        for order in orders:
+            row = totals.get(order.pk, {})
+            # SQLite sums are not exact decimals
+            order.total = Decimal(str(row.get('total') or 0)).quantize(Decimal('0.01'))
+            order.item_count = row.get('item_count') or 0
+            order.requires_shipping = bool(row.get('physical_items'))
+        Order.objects.bulk_update(orders, ['total', 'item_count', 'requires_shipping'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='requires_shipping',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.3 on 2026-10-17 19:26
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold repeated (order, product) lines into one before adding the constraint"""
+    OrderItem = apps.get_model('store', 'OrderItem')
+    duplicates = (
+        OrderItem.objects.filter(product__isnull=False)
+        .values('order_id', 'product_id')
+        .annotate(lines=Count('id'), quantity=Sum('quantity'))
+        .filter(lines__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        lines = OrderItem.objects.filter(
+            order_id=row['order_id'], product_id=row['product_id']
+        ).order_by('id')
+        keep = lines.first()
+        lines.exclude(pk=keep.pk).delete()
+        OrderItem.objects.filter(pk=keep.pk).update(quantity=row['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
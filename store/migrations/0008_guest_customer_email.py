@@ -0,0 +1,42 @@
+# Generated by Django 4.2.3 on 2026-10-17 19:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_guests(apps, schema_editor):
+    """Fold guest customers sharing an email into the oldest one before adding the constraint"""
+    Customer = apps.get_model('store', 'Customer')
+    Order = apps.get_model('store', 'Order')
+    ShippingAddress = apps.get_model('store', 'ShippingAddress')
+    duplicates = (
+        Customer.objects.filter(user__isnull=True, email__isnull=False)
+        .values('email')
+        .annotate(customers=Count('id'))
+        .filter(customers__gt=1)
+        .order_by()
+    )
+    for row in duplicates:
+        ids = list(
+            Customer.objects.filter(user__isnull=True, email=row['email'])
+            .order_by('id').values_list('id', flat=True)
+        )
+        keep, others = ids[0], ids[1:]
+        Order.objects.filter(customer_id__in=others).update(customer_id=keep)
+        ShippingAddress.objects.filter(customer_id__in=others).update(customer_id=keep)
+        Customer.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_guest_cart'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_guests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customer',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('email',), name='unique_guest_customer_email'),
+        ),
+    ]
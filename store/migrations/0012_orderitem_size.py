@@ -0,0 +1,26 @@
+# Generated by Django 4.2.3 on 2026-10-17 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='orderitem',
+            name='unique_order_product',
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='size',
+            field=models.CharField(blank=True, choices=[('XS', 'Extra Small'), ('S', 'Small'), ('M', 'Medium'), ('L', 'Large'), ('XL', 'Extra Large'), ('XXL', 'XXL')], default='', max_length=3),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product', 'size'), name='unique_order_product_size'),
+        ),
+    ]
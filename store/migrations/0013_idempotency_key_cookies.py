@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-17 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_orderitem_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='cookies',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,4 +1,8 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 from django.utils import timezone
@@ -67,6 +71,12 @@ class Customer(models.Model):
         indexes = [
             models.Index(fields=['email', 'name']),
         ]
+        constraints = [
+            # One guest customer per email, so guest checkout can upsert on it
+            models.UniqueConstraint(
+                fields=['email'], condition=models.Q(user__isnull=True), name='unique_guest_customer_email',
+            ),
+        ]
     
     def __str__(self):
         return self.name if self.name else self.email or f"Customer {self.id}"
@@ -87,6 +97,7 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=7, decimal_places=2)
     digital = models.BooleanField(default=False)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     size = models.CharField(max_length=3, choices=SIZE_CHOICES, null=True, blank=True)
     description = models.TextField(blank=True, null=True)
     stock = models.IntegerField(default=0)
@@ -129,6 +140,9 @@ class Order(models.Model):
     date_ordered = models.DateTimeField(auto_now_add=True)
     complete = models.BooleanField(default=False)
     transaction_id = models.CharField(max_length=200, null=True, blank=True, db_index=True)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.IntegerField(default=0)
+    requires_shipping = models.BooleanField(default=False)
     created_at = models.DateTimeField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -139,6 +153,8 @@ class Order(models.Model):
         indexes = [
             models.Index(fields=['-date_ordered']),
             models.Index(fields=['complete', '-date_ordered']),
+            # Incremental sales rollups scan orders changed since their mark
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -147,33 +163,71 @@ class Order(models.Model):
     @property
     def shipping(self):
         """Determine if order requires shipping (has physical products)"""
-        shipping = False
-        orderitems = self.orderitem_set.all()
-        for item in orderitems:
-            if not item.product.digital:
-                shipping = True
-                break
-        return shipping
+        return self.requires_shipping
     
     @property
     def get_cart_total(self):
         """Calculate total cart value"""
-        orderitems = self.orderitem_set.all()
-        total = sum([item.get_total for item in orderitems])
-        return total
+        return self.total
 
     @property
     def get_cart_items(self):
         """Get total number of items in cart"""
-        orderitems = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitems])
-        return total
+        return self.item_count
+
+    @staticmethod
+    def totals_aggregates():
+        """Aggregate expressions over OrderItem rows backing the stored totals"""
+        return {
+            'total': Sum(
+                F('quantity') * OrderItem.price_expression(),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            'item_count': Sum('quantity'),
+            'physical_items': Count('id', filter=Q(product__digital=False)),
+        }
+
+    @staticmethod
+    def quantize_total(value):
+        """Round an aggregated total to cents; SQLite sums are not exact decimals"""
+        return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+    def update_totals(self):
+        """
+        Recompute total, item_count and requires_shipping from the order items.
+
+        Runs one aggregate query and one UPDATE; call it inside the same
+        transaction that changed the order items.
+        """
+        values = self.items.aggregate(**self.totals_aggregates())
+        self.total = Order.quantize_total(values['total'])
+        self.item_count = values['item_count'] or 0
+        self.requires_shipping = bool(values['physical_items'])
+        # updated_at doubles as the cart version behind conditional GETs
+        self.updated_at = timezone.now()
+        Order.objects.filter(pk=self.pk).update(
+            total=self.total,
+            item_count=self.item_count,
+            requires_shipping=self.requires_shipping,
+            updated_at=self.updated_at,
+        )
+        return self
+
+    def freeze_prices(self):
+        """Copy each line's current product price into unit_price with one UPDATE"""
+        self.items.filter(product__isnull=False).update(
+            unit_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+        )
 
 class OrderItem(models.Model):
     """Individual item in an order with quantity"""
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, blank=True, null=True, related_name='order_items')
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     quantity = models.IntegerField(default=0)
+    # Size picked for this line; empty until the shopper chooses one
+    size = models.CharField(max_length=3, choices=Product.SIZE_CHOICES, blank=True, default='')
+    # Price at checkout; open carts leave it empty and follow the product
+    unit_price = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -183,6 +237,9 @@ class OrderItem(models.Model):
         indexes = [
             models.Index(fields=['order', '-date_added']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product', 'size'], name='unique_order_product_size'),
+        ]
     
     def __str__(self):
         return f"{self.quantity}x {self.product.name if self.product else 'Deleted Product'}"
@@ -190,10 +247,50 @@ class OrderItem(models.Model):
     @property
     def get_total(self):
         """Calculate total price for this order item"""
+        if self.unit_price is not None:
+            return self.unit_price * self.quantity
         if self.product:
             total = self.product.price * self.quantity
             return total
         return 0
+
+    @staticmethod
+    def price_expression():
+        """Line unit price for queries: the checkout price, else the current one"""
+        return Coalesce(F('unit_price'), F('product__price'))
+    
+class StockReservation(models.Model):
+    """Stock held for an open order until checkout completes or the hold expires"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['expires_at']
+        verbose_name = 'Stock Reservation'
+        verbose_name_plural = 'Stock Reservations'
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='unique_reservation_order_product'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x product {self.product_id} for order #{self.order_id}"
+
+
+class GuestCart(models.Model):
+    """Server-side cart of a visitor who is not logged in, found by an opaque cookie ID"""
+    key = models.CharField(max_length=64, unique=True)
+    lines = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Guest Cart'
+        verbose_name_plural = 'Guest Carts'
+
+    def __str__(self):
+        return f"Guest cart {self.key[:8]}"
     
 class ShippingAddress(models.Model):
     """Shipping address for physical product orders"""
@@ -218,6 +315,140 @@ class ShippingAddress(models.Model):
     def full_address(self):
         """Return formatted full address"""
         return f"{self.address}, {self.city}, {self.state} {self.zipcode}, {self.country}"
-    
-    
-    
\ No newline at end of file
+
+
+class Job(models.Model):
+    """Background task waiting to run, or being run, by the run_jobs worker"""
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['run_at']
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            models.Index(fields=['run_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id}"
+
+
+class DeadLetterJob(models.Model):
+    """Job that failed on every attempt, kept for inspection and manual retry"""
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    failed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-failed_at']
+        verbose_name = 'Dead Letter Job'
+        verbose_name_plural = 'Dead Letter Jobs'
+
+    def __str__(self):
+        return f"{self.name} (failed {self.attempts}x)"
+
+
+class TransactionSequence(models.Model):
+    """
+    Source of order transaction IDs.
+
+    Each checkout inserts a row and uses its auto-increment ID, which the
+    database hands out uniquely and in increasing order to every process.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Transaction Sequence'
+        verbose_name_plural = 'Transaction Sequence'
+
+    def __str__(self):
+        return f"Transaction {self.id}"
+
+
+class IdempotencyKey(models.Model):
+    """Response recorded for a client-supplied Idempotency-Key, replayed on retries"""
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    # Digest of the caller and request body; a reused key must match it
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.TextField(blank=True)
+    # Set-Cookie values of the response, so a replay sets the same cookies
+    cookies = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_scope_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+
+class DailySales(models.Model):
+    """Completed orders rolled up per day of date_ordered"""
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily Sales'
+        verbose_name_plural = 'Daily Sales'
+
+    def __str__(self):
+        return f"{self.date}: {self.revenue}"
+
+
+class DailyProductSales(models.Model):
+    """Completed order lines rolled up per day and product"""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='daily_sales')
+    # Kept so reports never read the catalog
+    product_name = models.CharField(max_length=200, blank=True)
+    orders = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily Product Sales'
+        verbose_name_plural = 'Daily Product Sales'
+        indexes = [
+            models.Index(fields=['date', 'product']),
+            models.Index(fields=['product', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date}: {self.product_name} x{self.quantity}"
+
+
+class RollupState(models.Model):
+    """How far an incremental rollup has read its source rows"""
+    name = models.CharField(max_length=50, unique=True)
+    high_water_mark = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Rollup State'
+        verbose_name_plural = 'Rollup States'
+
+    def __str__(self):
+        return f"{self.name} through {self.high_water_mark}"
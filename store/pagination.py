@@ -0,0 +1,97 @@
+"""
+Keyset (cursor) pagination over ``(created_at, id)``.
+
+Pages are fetched by seeking the ``-created_at`` index from the last row
+of the previous page instead of using OFFSET, so every page costs the
+same regardless of how deep it is. Nothing is counted.
+
+Products without ``created_at`` sort after all dated products and are
+paged by ``id`` alone.
+"""
+import base64
+import json
+from collections import namedtuple
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'has_next'])
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(obj):
+    """Build the opaque cursor pointing just after ``obj``"""
+    created_at = obj.created_at.isoformat() if obj.created_at else None
+    payload = json.dumps([created_at, obj.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by ``encode_cursor``.
+    
+    Returns:
+        tuple: ``(created_at, pk)``; ``created_at`` may be None
+        
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        pk = int(pk)
+        if created_at is not None:
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError("Bad timestamp")
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+    return created_at, pk
+
+
+def paginate(queryset, cursor=None, page_size=24):
+    """
+    Return one page of ``queryset`` ordered newest first.
+    
+    Args:
+        queryset: Unordered queryset of a model with ``created_at``
+        cursor: Cursor from the previous page's ``next_cursor``, or None
+        page_size: Number of rows per page
+        
+    Returns:
+        KeysetPage with the rows, the cursor for the next page and
+        whether a next page exists
+        
+    Raises:
+        InvalidCursor: If ``cursor`` is malformed
+    """
+    queryset = queryset.order_by(F('created_at').desc(nulls_last=True), 'pk')
+    dated = queryset.filter(created_at__isnull=False)
+    undated = queryset.filter(created_at__isnull=True)
+    wanted = page_size + 1
+
+    if cursor is None:
+        items = list(dated[:wanted])
+    else:
+        created_at, after_pk = decode_cursor(cursor)
+        if created_at is None:
+            items = []
+            undated = undated.filter(pk__gt=after_pk)
+        else:
+            # The range condition lets the index seek; the OR only skips
+            # rows sharing the cursor's exact timestamp
+            items = list(dated.filter(
+                Q(created_at__lt=created_at) | Q(pk__gt=after_pk),
+                created_at__lte=created_at,
+            )[:wanted])
+
+    if len(items) < wanted:
+        items += list(undated[:wanted - len(items)])
+
+    has_next = len(items) > page_size
+    items = items[:page_size]
+    next_cursor = encode_cursor(items[-1]) if has_next else None
+    return KeysetPage(items, next_cursor, has_next)
@@ -0,0 +1,179 @@
+"""
+Sales rollups: completed orders summed per day and per day and product.
+
+Reports read DailySales and DailyProductSales instead of scanning the
+order tables. ``update_rollups`` keeps them current incrementally. Each
+run finds the completed orders changed since the last run's high-water
+mark, then recomputes every day those orders fall on. Recomputing whole
+days keeps reruns harmless. ``rebuild_rollups`` recomputes everything.
+
+Days are days of ``Order.date_ordered`` in TIME_ZONE. The mark follows
+``Order.updated_at``, which changes whenever an order is completed or its
+totals change. An order completed long after it was created therefore
+still lands on its day. Line revenue uses the price frozen at checkout.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySales, Order, OrderItem, RollupState
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = 'sales'
+
+# Orders changed this recently are left for the next run, so a slow
+# transaction that commits after the mark moved past it is not skipped
+SAFETY_LAG = timedelta(minutes=5)
+
+# Days recomputed per transaction
+DAYS_PER_BATCH = 100
+
+_REVENUE = models.DecimalField(max_digits=14, decimal_places=2)
+
+
+def _day_rows(orders):
+    """DailySales rows for a queryset of completed orders"""
+    rows = (
+        orders.annotate(day=TruncDate('date_ordered'))
+        .values('day')
+        .annotate(order_count=Count('id'), item_count=Sum('item_count'), revenue=Sum('total'))
+        .order_by()
+    )
+    return [
+        DailySales(
+            date=row['day'],
+            orders=row['order_count'],
+            items=row['item_count'] or 0,
+            revenue=Order.quantize_total(row['revenue']),
+        )
+        for row in rows
+    ]
+
+
+def _product_rows(orders):
+    """DailyProductSales rows for the lines of a queryset of completed orders"""
+    rows = (
+        OrderItem.objects.filter(order__in=orders, quantity__gt=0)
+        .annotate(day=TruncDate('order__date_ordered'))
+        .values('day', 'product_id', 'product__name')
+        .annotate(
+            order_count=Count('order_id', distinct=True),
+            quantity_sum=Sum('quantity'),
+            revenue=Sum(F('quantity') * OrderItem.price_expression(), output_field=_REVENUE),
+        )
+        .order_by()
+    )
+    return [
+        DailyProductSales(
+            date=row['day'],
+            product_id=row['product_id'],
+            product_name=row['product__name'] or '',
+            orders=row['order_count'],
+            quantity=row['quantity_sum'],
+            revenue=Order.quantize_total(row['revenue']),
+        )
+        for row in rows
+    ]
+
+
+def _recompute_days(days):
+    """Replace the rollup rows of ``days`` from the order tables"""
+    days = sorted(days)
+    for start in range(0, len(days), DAYS_PER_BATCH):
+        batch = days[start:start + DAYS_PER_BATCH]
+        orders = Order.objects.filter(complete=True).annotate(day=TruncDate('date_ordered')).filter(day__in=batch)
+        with transaction.atomic():
+            DailySales.objects.filter(date__in=batch).delete()
+            DailyProductSales.objects.filter(date__in=batch).delete()
+            DailySales.objects.bulk_create(_day_rows(orders))
+            DailyProductSales.objects.bulk_create(_product_rows(orders), batch_size=1000)
+
+
+def update_rollups(now=None):
+    """
+    Fold orders changed since the high-water mark into the rollups.
+
+    Returns:
+        int: Number of days recomputed
+    """
+    now = now or timezone.now()
+    state, _ = RollupState.objects.get_or_create(name=ROLLUP_NAME)
+    if state.high_water_mark is None:
+        return rebuild_rollups(now)
+
+    mark = now - SAFETY_LAG
+    changed = Order.objects.filter(
+        complete=True, updated_at__gt=state.high_water_mark, updated_at__lte=mark,
+    )
+    days = set(
+        changed.annotate(day=TruncDate('date_ordered')).values_list('day', flat=True).distinct().order_by()
+    )
+    _recompute_days(days)
+    RollupState.objects.filter(pk=state.pk).update(high_water_mark=mark, updated_at=now)
+    logger.info(f"Sales rollups updated for {len(days)} days through {mark}")
+    return len(days)
+
+
+def rebuild_rollups(now=None):
+    """
+    Recompute every rollup row from scratch.
+
+    Returns:
+        int: Number of days with sales
+    """
+    now = now or timezone.now()
+    mark = now - SAFETY_LAG
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailyProductSales.objects.all().delete()
+        # Orders changed after the mark are folded in again by the next
+        # incremental run, which is harmless
+        orders = Order.objects.filter(complete=True)
+        days = _day_rows(orders)
+        DailySales.objects.bulk_create(days, batch_size=1000)
+        DailyProductSales.objects.bulk_create(_product_rows(orders), batch_size=1000)
+        RollupState.objects.update_or_create(name=ROLLUP_NAME, defaults={'high_water_mark': mark})
+    logger.info(f"Sales rollups rebuilt for {len(days)} days")
+    return len(days)
+
+
+def sales_report(start, end, top=20):
+    """
+    Summarize sales between two dates, inclusive, from the rollups alone.
+
+    Returns:
+        dict: Per-day totals, the best-selling products and the time the
+            rollups are current to
+    """
+    days = DailySales.objects.filter(date__range=(start, end)).order_by('date')
+    products = (
+        DailyProductSales.objects.filter(date__range=(start, end))
+        .values('product_id')
+        .annotate(name=Max('product_name'), orders=Sum('orders'), quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-revenue')[:top]
+    )
+    mark = RollupState.objects.filter(name=ROLLUP_NAME).values_list('high_water_mark', flat=True).first()
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'currentThrough': mark.isoformat() if mark else None,
+        'days': [
+            {'date': day.date.isoformat(), 'orders': day.orders, 'items': day.items, 'revenue': str(day.revenue)}
+            for day in days
+        ],
+        'products': [
+            {
+                'productId': row['product_id'],
+                'name': row['name'],
+                'orders': row['orders'],
+                'quantity': row['quantity'],
+                'revenue': str(Order.quantize_total(row['revenue'])),
+            }
+            for row in products
+        ],
+    }
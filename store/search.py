@@ -0,0 +1,174 @@
+"""
+Full-text product search backed by an SQLite FTS5 index.
+
+The index covers product name and description for active products and
+is kept current by the Product signal handlers. Other database engines
+fall back to ``icontains`` matching without ranking or snippets.
+"""
+import html
+import logging
+import re
+from collections import namedtuple
+
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'store_product_fts'
+
+# Name matches outrank description matches
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SNIPPET_TOKENS = 12
+
+# Control characters mark highlights inside the raw snippet so the text
+# can be HTML-escaped before the <mark> tags are inserted
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+SearchHit = namedtuple('SearchHit', ['product_id', 'rank', 'snippet'])
+
+
+def _connection(write=False):
+    """Connection holding the product table for reads or writes"""
+    if write:
+        return connections[router.db_for_write(Product)]
+    return connections[router.db_for_read(Product)]
+
+
+def is_available(write=False):
+    """Return True when the product database supports the FTS5 index"""
+    return _connection(write).vendor == 'sqlite'
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 MATCH expression.
+    
+    Every word becomes a quoted prefix term, so user input can never be
+    parsed as FTS5 syntax and partially typed words still match.
+    
+    Returns:
+        str: MATCH expression, or an empty string if there are no words
+    """
+    terms = _TERM_RE.findall(query or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index_product(product):
+    """Insert or refresh a single product in the index"""
+    if not is_available(write=True):
+        return
+    with _connection(write=True).cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+        if product.is_active:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+                [product.pk, product.name or '', product.description or ''],
+            )
+
+
+def remove_product(product_id):
+    """Drop a product from the index"""
+    if not is_available(write=True):
+        return
+    with _connection(write=True).cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def index_products(queryset, active=None):
+    """
+    Refresh every product in ``queryset`` in the index.
+    
+    Runs as set-based statements over the queryset's SQL, so it costs the
+    same for ten products as for the whole catalog. By default each
+    product is indexed if it is active. Pass ``active`` to index (True)
+    or drop (False) them all regardless, e.g. right before bulk-updating
+    ``is_active`` on the same queryset.
+    """
+    if not is_available(write=True):
+        return
+    ids_sql, params = queryset.values('pk').query.sql_with_params()
+    product_table = Product._meta.db_table
+    with _connection(write=True).cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({ids_sql})", params)
+        if active is not False:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+                f"SELECT id, COALESCE(name, ''), COALESCE(description, '') "
+                f"FROM {product_table} WHERE id IN ({ids_sql})"
+                + (" AND is_active" if active is None else ""),
+                params,
+            )
+
+
+def rebuild_index():
+    """
+    Rebuild the whole index from the product table in one statement.
+    
+    Returns:
+        int: Number of products indexed
+    """
+    if not is_available(write=True):
+        return 0
+    product_table = Product._meta.db_table
+    with _connection(write=True).cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+            f"SELECT id, COALESCE(name, ''), COALESCE(description, '') "
+            f"FROM {product_table} WHERE is_active"
+        )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        count = cursor.fetchone()[0]
+    logger.info(f"Search index rebuilt with {count} products")
+    return count
+
+
+def _highlight(raw_snippet):
+    """HTML-escape a snippet and wrap matched terms in <mark> tags"""
+    escaped = html.escape(raw_snippet or '')
+    return escaped.replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search(query, limit=20):
+    """
+    Search active products by name and description.
+    
+    Args:
+        query: Free text typed by the user
+        limit: Maximum number of hits to return
+        
+    Returns:
+        list: SearchHit tuples, best match first
+    """
+    connection = _connection()
+    if connection.vendor != 'sqlite':
+        products = Product.objects.filter(
+            Q(name__icontains=query) | Q(description__icontains=query),
+            is_active=True,
+        ).order_by('-created_at').values_list('id', flat=True)[:limit]
+        return [SearchHit(pk, 0.0, '') for pk in products]
+
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, %s, %s) AS rank, "
+            f"snippet({FTS_TABLE}, -1, %s, %s, '…', %s) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY rank LIMIT %s",
+            [NAME_WEIGHT, DESCRIPTION_WEIGHT, _MARK_START, _MARK_END,
+             SNIPPET_TOKENS, match, limit],
+        )
+        rows = cursor.fetchall()
+    return [SearchHit(pk, rank, _highlight(snippet)) for pk, rank, snippet in rows]
@@ -2,19 +2,26 @@
 Service layer for business logic - separates concerns from views.
 """
 import logging
+from collections import defaultdict
 from decimal import Decimal
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from .models import Order, OrderItem, Product, Customer, ShippingAddress
+from django.db.models import Case, F, Value, When
+from . import inventory, jobs, search
+from .models import Order, OrderItem, Product, Customer, ShippingAddress, TransactionSequence
 
 logger = logging.getLogger(__name__)
 
+# Sizes a cart line may hold; the empty size means none chosen yet
+CART_SIZES = {''} | {code for code, _ in Product.SIZE_CHOICES}
+
 
 class CartService:
     """Handle cart operations"""
     
     @staticmethod
-    def add_item_to_cart(customer, product_id, quantity=1):
+    @transaction.atomic
+    def add_item_to_cart(customer, product_id, quantity=1, size=''):
         """
         Add an item to the customer's cart.
         
@@ -22,6 +29,7 @@ class CartService:
             customer: Customer object
             product_id: ID of the product to add
             quantity: Number of items to add (default: 1)
+            size: Size of the line (default: none chosen)
             
         Returns:
             OrderItem object
@@ -46,54 +54,220 @@ class CartService:
         order_item, item_created = OrderItem.objects.get_or_create(
             order=order,
             product=product,
+            size=size,
             defaults={'quantity': quantity}
         )
         
         if not item_created:
             order_item.quantity += quantity
             order_item.save()
+
+        order.update_totals()
             
-        logger.info(f\"Added {quantity}x {product.name} to cart for {customer.email}\")
+        logger.info(f"Added {quantity}x {product.name} to cart for {customer.email}")
         return order_item
     
     @staticmethod
-    def remove_item_from_cart(customer, product_id):
+    @transaction.atomic
+    def remove_item_from_cart(customer, product_id, size=''):
         """Remove an item from the cart completely"""
         try:
             order = Order.objects.get(customer=customer, complete=False)
-            order_item = OrderItem.objects.get(order=order, product_id=product_id)
+            order_item = OrderItem.objects.get(order=order, product_id=product_id, size=size)
             order_item.delete()
-            logger.info(f\"Removed product {product_id} from cart for {customer.email}\")
+            order.update_totals()
+            logger.info(f"Removed product {product_id} from cart for {customer.email}")
         except ObjectDoesNotExist:
-            logger.warning(f\"Attempted to remove non-existent item from cart\")
+            logger.warning(f"Attempted to remove non-existent item from cart")
     
     @staticmethod
-    def update_item_quantity(customer, product_id, quantity):
+    @transaction.atomic
+    def update_item_quantity(customer, product_id, quantity, size=''):
         """Update quantity of a cart item"""
         if quantity <= 0:
-            CartService.remove_item_from_cart(customer, product_id)
+            CartService.remove_item_from_cart(customer, product_id, size)
             return
             
         try:
             order = Order.objects.get(customer=customer, complete=False)
-            order_item = OrderItem.objects.get(order=order, product_id=product_id)
+            order_item = OrderItem.objects.get(order=order, product_id=product_id, size=size)
             order_item.quantity = quantity
             order_item.save()
-            logger.info(f\"Updated product {product_id} quantity to {quantity}\")
+            order.update_totals()
+            logger.info(f"Updated product {product_id} quantity to {quantity}")
         except ObjectDoesNotExist:
-            logger.error(f\"Cart item not found for update\")
+            logger.error(f"Cart item not found for update")
             raise
 
 
+    @staticmethod
+    def check_sizes(sizes):
+        """
+        Reject sizes a cart line cannot hold; the empty size means none chosen.
+        
+        Raises:
+            ValidationError: If a size is not one of Product.SIZE_CHOICES
+        """
+        unknown = sorted(set(sizes) - CART_SIZES)
+        if unknown:
+            raise ValidationError(f"Unknown sizes: {unknown}")
+
+    @staticmethod
+    def resize_lines(lines, changes):
+        """
+        Apply size changes to ``{(product_id, size): quantity}`` cart lines.
+        
+        Changes apply one after another, in the order given. A line moved
+        onto a size the cart already holds for that product is merged into
+        it, and a change naming a line the cart does not hold is skipped.
+        
+        Returns:
+            dict: The new lines; the input is left alone
+        """
+        lines = dict(lines)
+        for product_id, old_size, new_size in changes:
+            quantity = lines.pop((product_id, old_size), None)
+            if quantity is not None:
+                lines[(product_id, new_size)] = lines.get((product_id, new_size), 0) + quantity
+        return lines
+
+    @staticmethod
+    @transaction.atomic
+    def apply_operations(customer, operations):
+        """
+        Apply a batch of quantity changes to the customer's cart atomically.
+        
+        Cart lines are keyed on product and size. Deltas for the same line
+        are summed first. Missing lines are inserted, every quantity is
+        adjusted with a single UPDATE using F-expressions, and lines that
+        drop to zero are deleted, so the number of queries does not depend
+        on the number of operations and concurrent batches cannot lose
+        each other's updates.
+        
+        Args:
+            customer: Customer object
+            operations: Iterable of (product_id, size, delta) triples
+            
+        Returns:
+            Order object with refreshed totals
+            
+        Raises:
+            ValidationError: If a product or size is unknown, or a product
+                is no longer available and the batch adds to it
+        """
+        deltas = defaultdict(int)
+        for product_id, size, delta in operations:
+            deltas[(product_id, size)] += delta
+        deltas = {line: delta for line, delta in deltas.items() if delta}
+        
+        order, created = Order.objects.get_or_create(customer=customer, complete=False)
+        if not deltas:
+            return order
+        
+        CartService.check_sizes(size for _, size in deltas)
+        product_ids = {product_id for product_id, _ in deltas}
+        active = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'is_active'))
+        unknown = sorted(product_ids - set(active))
+        if unknown:
+            raise ValidationError(f"Unknown products: {unknown}")
+        unavailable = sorted({pid for (pid, _), delta in deltas.items() if delta > 0 and not active[pid]})
+        if unavailable:
+            raise ValidationError(f"Products no longer available: {unavailable}")
+        
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product_id=pid, size=size, quantity=0)
+             for (pid, size), delta in deltas.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        OrderItem.objects.filter(order=order, product_id__in=product_ids).update(
+            quantity=F('quantity') + Case(
+                *[When(product_id=pid, size=size, then=Value(delta)) for (pid, size), delta in deltas.items()],
+                default=Value(0),
+            )
+        )
+        OrderItem.objects.filter(order=order, quantity__lte=0).delete()
+        order.update_totals()
+        
+        logger.info(f"Applied {len(deltas)} cart changes for {customer.email}")
+        return order
+
+    @staticmethod
+    @transaction.atomic
+    def set_sizes(customer, changes):
+        """
+        Move lines of the customer's cart to other sizes in one batch.
+        
+        Only the lines of the products named in ``changes`` are read.
+        Lines that moved are deleted and the resulting lines upserted, so
+        a batch costs the same few queries however many lines it moves,
+        and the catalog's Product rows are never written.
+        
+        Args:
+            customer: Customer object
+            changes: Iterable of (product_id, old_size, new_size) triples,
+                applied as described in ``resize_lines``
+            
+        Returns:
+            Order object
+            
+        Raises:
+            ValidationError: If a size is unknown
+        """
+        changes = [change for change in changes if change[1] != change[2]]
+        order, created = Order.objects.get_or_create(customer=customer, complete=False)
+        if not changes:
+            return order
+        CartService.check_sizes(size for change in changes for size in change[1:])
+        
+        items = order.items.filter(product_id__in={change[0] for change in changes})
+        before = {(item.product_id, item.size): item.quantity for item in items}
+        after = CartService.resize_lines(before, changes)
+        if after == before:
+            return order
+        
+        gone = [item.pk for item in items if (item.product_id, item.size) not in after]
+        OrderItem.objects.filter(pk__in=gone).delete()
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product_id=pid, size=size, quantity=quantity)
+             for (pid, size), quantity in after.items() if before.get((pid, size)) != quantity],
+            update_conflicts=True,
+            unique_fields=['order', 'product', 'size'],
+            update_fields=['quantity'],
+        )
+        # Totals are unchanged, but the cart version behind conditional
+        # GETs must move
+        order.update_totals()
+        
+        logger.info(f"Changed the size of {len(changes)} cart lines for {customer.email}")
+        return order
+
+
 class OrderService:
     """Handle order processing"""
     
     @staticmethod
-    @transaction.atomic
+    def next_transaction_id():
+        """
+        Allocate a transaction ID for a checkout.
+        
+        IDs come from a database sequence, so they never collide across
+        worker processes and always increase. They are zero-padded, so
+        they also sort in allocation order as strings.
+        
+        Returns:
+            str: ID such as ``TX000000000042``
+        """
+        return f"TX{TransactionSequence.objects.create().id:012d}"
+    
+    @staticmethod
+    @inventory.write_transaction()
     def complete_order(customer, order, shipping_data=None):
         """
         Complete an order and create shipping address if needed.
         
+        Follow-up work is queued as background jobs that commit with the
+        order.
+        
         Args:
             customer: Customer object
             order: Order object
@@ -101,12 +275,21 @@ class OrderService:
             
         Returns:
             Order object
+            
+        Raises:
+            ValidationError: If the order is empty
+            InsufficientStock: If a product cannot cover its line
         """
-        # Validate order total matches calculated total
-        calculated_total = order.get_cart_total
+        # Charge today's prices: freeze them on the lines, then total the
+        # order from those same lines
+        order.freeze_prices()
+        calculated_total = order.update_totals().get_cart_total
         
         if calculated_total == 0:
-            raise ValidationError(\"Cannot complete empty order\")
+            raise ValidationError("Cannot complete empty order")
+        
+        # Raises InsufficientStock, rolling back the whole checkout
+        inventory.reserve_order(order)
         
         # Create shipping address if physical products exist
         if order.shipping and shipping_data:
@@ -122,32 +305,99 @@ class OrderService:
         
         order.complete = True
         order.save()
+        inventory.consume_reservations(order)
+        jobs.enqueue_order_completed(order)
         
-        logger.info(f\"Order #{order.id} completed for {customer.email}\")
+        logger.info(f"Order #{order.id} completed for {customer.email}")
         return order
 
 
+    @staticmethod
+    def recalculate_totals(queryset=None, batch_size=1000):
+        """
+        Recompute stored totals for many orders in bulk.
+        
+        Walks orders by primary key in batches; each batch costs one
+        grouped aggregate query over OrderItem and one bulk update.
+        
+        Args:
+            queryset: Orders to recompute (default: all orders)
+            batch_size: Number of orders handled per batch
+            
+        Returns:
+            int: Number of orders recomputed
+        """
+        if queryset is None:
+            queryset = Order.objects.all()
+        queryset = queryset.order_by('pk')
+        
+        updated = 0
+        last_pk = 0
+        while True:
+            orders = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not orders:
+                break
+            last_pk = orders[-1].pk
+            
+            totals = {
+                row['order_id']: row
+                for row in OrderItem.objects.filter(order__in=orders)
+                .values('order_id')
+                .annotate(**Order.totals_aggregates())
+                .order_by()
+            }
+            for order in orders:
+                row = totals.get(order.pk, {})
+                order.total = Order.quantize_total(row.get('total'))
+                order.item_count = row.get('item_count') or 0
+                order.requires_shipping = bool(row.get('physical_items'))
+            
+            with transaction.atomic():
+                Order.objects.bulk_update(orders, ['total', 'item_count', 'requires_shipping'])
+            updated += len(orders)
+            
+        logger.info(f"Recalculated totals for {updated} orders")
+        return updated
+
+
 class ProductService:
-    \"\"\"Handle product queries and operations\"\"\"
+    """Handle product queries and operations"""
     
     @staticmethod
     def get_active_products():
-        \"\"\"Get all active products\"\"\"
+        """Get all active products"""
         return Product.objects.filter(is_active=True).order_by('-created_at')
     
     @staticmethod
     def get_product_by_id(product_id):
-        \"\"\"Get a single product by ID\"\"\"
+        """Get a single product by ID"""
         try:
             return Product.objects.get(id=product_id, is_active=True)
         except ObjectDoesNotExist:
-            logger.error(f\"Product {product_id} not found or inactive\")
+            logger.error(f"Product {product_id} not found or inactive")
             raise
     
     @staticmethod
-    def search_products(query):
-        \"\"\"Search products by name\"\"\"
+    def search_products(query, limit=50):
+        """
+        Search active products by name and description.
+        
+        Uses the full-text index, so results are ordered by relevance
+        and partially typed words match as prefixes.
+        
+        Args:
+            query: Free text typed by the user
+            limit: Maximum number of products to return
+            
+        Returns:
+            QuerySet of products, best match first
+        """
+        hits = search.search(query, limit=limit)
+        if not hits:
+            return Product.objects.none()
+        
+        relevance = Case(*[When(pk=hit.product_id, then=position) for position, hit in enumerate(hits)])
         return Product.objects.filter(
-            name__icontains=query,
+            pk__in=[hit.product_id for hit in hits],
             is_active=True
-        ).order_by('-created_at')
+        ).order_by(relevance)
@@ -0,0 +1,35 @@
+"""
+Model signal handlers for the store app.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import images, jobs, search
+from .cache import bump_catalog_version
+from .models import Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    """Retire cached catalog pages once the change is committed"""
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Keep the full-text index in step with the product row"""
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def render_image_derivatives(sender, instance, **kwargs):
+    """Queue resizing a newly uploaded image, off the request path"""
+    if images.needs_derivatives(instance):
+        jobs.enqueue('render_image_derivatives', {'product_id': instance.pk})
@@ -0,0 +1,41 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from store.images import srcset
+
+register = template.Library()
+
+# Catalog grid: three columns on large screens, two on medium, one below
+CATALOG_SIZES = '(min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw'
+
+
+@register.simple_tag
+def product_image(product, css_class='thumbnail', sizes=CATALOG_SIZES):
+    """
+    Render a lazily loaded, responsive product image.
+    
+    Emits a <picture> offering WebP and JPEG derivatives through srcset,
+    falling back to the original image or the placeholder.
+    """
+    derivatives = product.image_derivatives or {}
+    if product.image and derivatives.get('source') == product.image.name:
+        smallest = derivatives['jpeg'][0]
+        return format_html(
+            '<picture>'
+            '<source type="image/webp" srcset="{}" sizes="{}">'
+            '<img class="{}" src="{}" srcset="{}" sizes="{}" width="{}" height="{}" '
+            'alt="{}" loading="lazy" decoding="async">'
+            '</picture>',
+            srcset(derivatives, 'webp'), sizes,
+            css_class, default_storage.url(smallest[1]), srcset(derivatives, 'jpeg'), sizes,
+            derivatives['width'], derivatives['height'],
+            product.name or '',
+        )
+
+    src = product.imageURL if product.image else static('images/2+placeholder.png')
+    return format_html(
+        '<img class="{}" src="{}" alt="{}" loading="lazy" decoding="async">',
+        css_class, src, product.name or '',
+    )
@@ -1,3 +1,458 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.template.base import Template
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from ecommerce.middleware import PrecompressedStaticMiddleware, ReplicaPinningMiddleware, encoding_qualities
+from ecommerce.routers import is_pinned
+
+from . import exports, guest_cart, inventory, jobs
+from .benchmarks import bench_checkout_contention, seed_guest_cart
+from .cache import get_catalog_version
+from .models import Customer, GuestCart, IdempotencyKey, Job, Order, OrderItem, Product, TransactionSequence
+from .services import CartService, OrderService
+
+# Checkout latency under contention, queueing for the write lock included.
+# Nothing may come near SQLite's 5 s busy timeout, which fails the request
+CHECKOUT_P95_BOUND_MS = 3000
+CHECKOUT_MAX_BOUND_MS = 4000
+
+
+def create_customer(username):
+    """Create a user with a linked customer profile"""
+    user = User.objects.create_user(username=username, email=f'{username}@example.com')
+    Customer.objects.create(user=user, name=username, email=user.email)
+    return user
+
+
+def create_product(price='10.00', stock=10, digital=True, **fields):
+    return Product.objects.create(
+        name=fields.pop('name', 'Test Tee'), price=Decimal(price), stock=stock, digital=digital, **fields
+    )
+
+
+def checkout_payload(total, name='Guest', email='guest@example.com'):
+    return {
+        'form': {'name': name, 'email': email, 'total': str(total)},
+        'shipping': {'address': '1 Track Lane', 'city': 'Kingston', 'state': 'KIN', 'zipcode': '00000'},
+    }
+
+
+class AcceptEncodingTestCase(SimpleTestCase):
+
+    def test_refused_codings_keep_q_zero(self):
+        qualities = encoding_qualities('gzip;q=0, br; q=0.8, *;q=0.1, identity')
+        self.assertEqual(qualities, {'gzip': 0.0, 'br': 0.8, '*': 0.1, 'identity': 1.0})
+
+    def test_q_zero_is_not_served_precompressed(self):
+        with tempfile.TemporaryDirectory() as root, self.settings(STATIC_ROOT=root):
+            for name in ('app.js', 'app.js.gz'):
+                with open(os.path.join(root, name), 'wb') as f:
+                    f.write(b'x')
+            middleware = PrecompressedStaticMiddleware(lambda request: None)
+            for header, encoding in [('gzip;q=0', None), ('gzip;q=0.5', 'gzip'), ('*, gzip;q=0', None), ('br, *', 'gzip')]:
+                response = middleware(RequestFactory().get('/static/app.js', HTTP_ACCEPT_ENCODING=header))
+                response.close()
+                self.assertEqual(response.get('Content-Encoding'), encoding, header)
+
+
+class ServerTimingTestCase(TestCase):
+
+    def get(self, user=None, remote_addr='203.0.113.5'):
+        client = Client(REMOTE_ADDR=remote_addr)
+        if user:
+            client.force_login(user)
+        return client.get('/api/products/')
+
+    def test_off_by_default(self):
+        self.assertNotIn('Server-Timing', self.get(remote_addr='127.0.0.1'))
+
+    def test_sent_only_to_operators(self):
+        staff = User.objects.create_user(username='ops', is_staff=True)
+        with self.settings(SERVER_TIMING_HEADER=True):
+            self.assertNotIn('Server-Timing', self.get())
+            self.assertIn('Server-Timing', self.get(remote_addr='127.0.0.1'))
+            self.assertIn('Server-Timing', self.get(user=staff))
+
+    def test_template_time_is_reported_without_patching_templates(self):
+        with self.settings(SERVER_TIMING_HEADER=True):
+            response = Client(REMOTE_ADDR='127.0.0.1').get('/login.html')
+        self.assertGreater(float(re.search(r'tpl;dur=([\d.]+)', response['Server-Timing']).group(1)), 0)
+        self.assertEqual(Template.render.__module__, 'django.template.base')
+
+
+class ReplicaPinningTestCase(TestCase):
+
+    async def test_write_in_an_async_view_pins_the_rest_of_the_request(self):
+        pinned = []
+
+        async def view(request):
+            pinned.append(is_pinned())
+            # gather() runs each query in a task with its own context copy
+            await asyncio.gather(sync_to_async(Customer.objects.create)(name='Writer'), asyncio.sleep(0))
+            pinned.append(is_pinned())
+            pinned.append(await sync_to_async(is_pinned)())
+            return None
+
+        await ReplicaPinningMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(pinned, [False, True, True])
+
+
+class CatalogApiTestCase(TestCase):
+
+    def test_unknown_product_is_a_quiet_404(self):
+        product = create_product(is_active=False)
+        with self.assertNoLogs('store', level='WARNING'):
+            response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.status_code, 404)
+
+
+class CheckoutTestCase(TestCase):
+
+    def setUp(self):
+        self.user = create_customer('shopper')
+        self.client.force_login(self.user)
+        self.product = create_product(price='10.00')
+
+    def process_order(self, total, **headers):
+        return self.client.post(
+            '/process_order/', json.dumps(checkout_payload(total)), content_type='application/json', **headers,
+        )
+
+    def test_price_change_after_adding_to_cart_is_charged_consistently(self):
+        CartService.apply_operations(self.user.customer, [(self.product.id, '', 2)])
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('20.00'))
+
+        # The total shown before the price change no longer matches
+        response = self.process_order('20.00')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.process_order('40.00')
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(customer=self.user.customer, complete=True)
+        line = order.items.get()
+        self.assertEqual(line.unit_price, Decimal('20.00'))
+        self.assertEqual(order.total, Decimal('40.00'))
+        self.assertEqual(order.total, line.get_total)
+
+    def test_total_mismatch_rolls_back_guest_checkout(self):
+        guest = Client()
+        guest.cookies[guest_cart.CART_ID_COOKIE] = seed_guest_cart({self.product.id: 1})
+        orders, customers = Order.objects.count(), Customer.objects.count()
+
+        response = guest.post(
+            '/process_order/', json.dumps(checkout_payload('99.00')), content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['total'], '10.00')
+        self.assertEqual(Order.objects.count(), orders)
+        self.assertEqual(Customer.objects.count(), customers)
+        self.assertFalse(TransactionSequence.objects.exists())
+
+
+class IdempotencyTestCase(TestCase):
+
+    def setUp(self):
+        self.product = create_product(price='10.00', stock=1, digital=False)
+        self.cart_id = seed_guest_cart({self.product.id: 1})
+        self.client.cookies[guest_cart.CART_ID_COOKIE] = self.cart_id
+
+    def post(self, total, key='checkout-1'):
+        return self.client.post(
+            '/process_order/', json.dumps(checkout_payload(total)), content_type='application/json',
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_response_and_cookies(self):
+        first = self.post('10.00')
+        self.assertEqual(first.status_code, 200)
+        cleared = first.cookies[guest_cart.CART_ID_COOKIE].OutputString()
+
+        # The first response was lost, so the retry still carries the cart
+        self.client.cookies[guest_cart.CART_ID_COOKIE] = self.cart_id
+        retry = self.post('10.00')
+
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry.cookies[guest_cart.CART_ID_COOKIE].OutputString(), cleared)
+        self.assertEqual(Order.objects.filter(complete=True).count(), 1)
+
+    def test_key_in_progress_gets_409(self):
+        IdempotencyKey.objects.create(scope='process_order', key='checkout-1', fingerprint='running')
+
+        response = self.post('10.00')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.filter(complete=True).exists())
+
+    def test_409_from_the_view_is_not_recorded(self):
+        Product.objects.filter(pk=self.product.pk).update(stock=0)
+        self.assertEqual(self.post('10.00').status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        Product.objects.filter(pk=self.product.pk).update(stock=1)
+        response = self.post('10.00')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_key_reused_for_a_different_request_gets_422(self):
+        self.assertEqual(self.post('99.00').status_code, 400)
+
+        response = self.post('10.00')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(Order.objects.filter(complete=True).exists())
+
+
+class OrderAdminTestCase(TestCase):
+
+    def test_inline_line_edits_update_order_totals(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass')
+        self.client.force_login(admin_user)
+        product = create_product(price='10.00')
+        order = Order.objects.create(customer=Customer.objects.create(name='Buyer'))
+        line = OrderItem.objects.create(order=order, product=product, quantity=1)
+        order.update_totals()
+
+        response = self.client.post(f'/admin/store/order/{order.pk}/change/', {
+            'customer': order.customer_id,
+            'transaction_id': '',
+            'created_at_0': '', 'created_at_1': '',
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '1',
+            'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': line.pk, 'items-0-order': order.pk, 'items-0-product': product.pk,
+            'items-0-quantity': '3', 'items-0-size': '', 'items-0-unit_price': '',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.total), (3, Decimal('30.00')))
+
+
+class CatalogVersionTestCase(TestCase):
+
+    def checkout(self, product, quantity):
+        customer = Customer.objects.create(name='Buyer', email=f'buyer{quantity}@example.com')
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.create(order=order, product=product, quantity=quantity)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderService.complete_order(customer, order, {'address': '1 Track Lane'})
+        return order
+
+    def test_catalog_pages_are_retired_only_when_availability_changes(self):
+        product = create_product(stock=3, digital=False)
+        version = get_catalog_version()
+
+        self.checkout(product, 2)
+        self.assertEqual(get_catalog_version(), version)
+
+        # The last unit sells out the product
+        self.checkout(product, 1)
+        sold_out = get_catalog_version()
+        self.assertNotEqual(sold_out, version)
+
+        # A held unit coming back puts it in stock again
+        held = Order.objects.create(customer=Customer.objects.create(name='Holder'))
+        OrderItem.objects.create(order=held, product=product, quantity=1)
+        Product.objects.filter(pk=product.pk).update(stock=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.reserve_order(held)
+        self.assertNotEqual(get_catalog_version(), sold_out)
+        restocked = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.release_order(held)
+        self.assertNotEqual(get_catalog_version(), restocked)
+
+
+class ImageDerivativesTestCase(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        os.makedirs(os.path.join(media_root.name, 'products'))
+        Image.new('RGB', (800, 600), 'teal').save(os.path.join(media_root.name, 'products', 'tee.jpg'))
+
+    def test_upload_queues_rendering_and_retires_catalog_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(image='products/tee.jpg')
+        product.refresh_from_db()
+        self.assertEqual(product.image_derivatives, {})
+        self.assertTrue(Job.objects.filter(name='render_image_derivatives', payload={'product_id': product.id}).exists())
+
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.run_pending()
+        product.refresh_from_db()
+        self.assertEqual(product.image_derivatives['source'], 'products/tee.jpg')
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class CatalogImportTestCase(TestCase):
+
+    def import_feed(self, rows):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        feed, rejects = os.path.join(directory.name, 'feed.jsonl'), os.path.join(directory.name, 'rejects.csv')
+        with open(feed, 'w') as f:
+            f.writelines(line + '\n' for line in rows)
+        call_command('import_catalog', feed, rejects=rejects, stdout=io.StringIO())
+        with open(rejects, newline='') as f:
+            return {int(row['line']): row['reason'] for row in csv.DictReader(f)}
+
+    def test_feed_upserts_valid_rows_and_rejects_the_rest(self):
+        create_product(name='Hat', stock=1)
+        rejects = self.import_feed([
+            '{"name": "Tee", "price": "12.50", "stock": 3}',
+            '{"name": "Hat", "stock": 5}',
+            '{"name": 123, "price": "1.00"}',
+            '{"name": "Cap", "price": "5.00", "stock": 1.7}',
+            '{"name": "Mug", "stock": "4"}',
+            'not json',
+            '{"name": "Tee", "stock": "2.0"}',
+        ])
+
+        self.assertEqual(sorted(rejects), [3, 4, 5, 6])
+        self.assertIn("not text", rejects[3])
+        self.assertIn("not a whole number", rejects[4])
+        self.assertIn("price is required", rejects[5])
+        self.assertIn("Invalid JSON", rejects[6])
+        stock = dict(Product.objects.values_list('name', 'stock'))
+        self.assertEqual(stock, {'Tee': 2, 'Hat': 5})
+        self.assertEqual(Product.objects.get(name='Tee').price, Decimal('12.50'))
+
+
+class GuestCartTestCase(TestCase):
+
+    def setUp(self):
+        self.tee, self.cap = create_product(name='Tee'), create_product(name='Cap')
+        self.cart_id = seed_guest_cart({self.tee.id: 1})
+
+    def guest_request(self):
+        request = RequestFactory().get('/cart/')
+        request.COOKIES[guest_cart.CART_ID_COOKIE] = self.cart_id
+        return request
+
+    def test_first_time_guest_gets_a_csrf_cookie_for_cart_updates(self):
+        guest = Client(enforce_csrf_checks=True)
+        self.assertNotIn('csrftoken', guest.get('/').cookies)
+
+        response = guest.get('/csrf/')
+        self.assertIn('no-cache', response['Cache-Control'])
+        token = response.cookies['csrftoken'].value
+
+        response = guest.post(
+            '/update_cart/', json.dumps({'operations': [{'productId': self.tee.id, 'delta': 1}]}),
+            content_type='application/json', HTTP_X_CSRFTOKEN=token,
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_concurrent_updates_are_not_lost(self):
+        first, second = self.guest_request(), self.guest_request()
+        # Both requests read the cart before either writes
+        guest_cart.get_lines(first)
+        guest_cart.get_lines(second)
+
+        guest_cart.apply_operations(first, [(self.tee.id, '', 1)])
+        guest_cart.apply_operations(second, [(self.cap.id, '', 2)])
+
+        stored = GuestCart.objects.get(key=self.cart_id).lines
+        self.assertEqual(stored, {str(self.tee.id): 2, str(self.cap.id): 2})
+
+    def login(self):
+        user = create_customer('returning')
+        user.set_password('secret-pass')
+        user.save()
+        self.client.cookies[guest_cart.CART_ID_COOKIE] = self.cart_id
+        response = self.client.post('/login.html', {'userName': 'returning', 'pwd': 'secret-pass'})
+        self.assertEqual(response.status_code, 302)
+        return user.customer
+
+    def test_login_skips_guest_lines_that_cannot_be_merged(self):
+        GuestCart.objects.filter(key=self.cart_id).update(
+            lines={str(self.tee.id): 1, f'{self.cap.id}:ZZ': 1, f'{self.cap.id}:M': 2},
+        )
+        real_apply = CartService.apply_operations
+
+        def apply_operations(customer, operations):
+            # The tee is withdrawn between the merge's check and its batch
+            if len(operations) > 1 or operations[0][0] == self.tee.id:
+                raise ValidationError("Products no longer available")
+            return real_apply(customer, operations)
+
+        with mock.patch.object(CartService, 'apply_operations', side_effect=apply_operations):
+            customer = self.login()
+
+        order = Order.objects.get(customer=customer, complete=False)
+        self.assertEqual(list(order.items.values_list('product', 'size', 'quantity')), [(self.cap.id, 'M', 2)])
+        self.assertFalse(GuestCart.objects.filter(key=self.cart_id).exists())
+
+    def test_login_survives_a_failed_merge(self):
+        with mock.patch.object(guest_cart, 'merge_into_customer', side_effect=ValidationError("bad cart")):
+            self.login()
+
+
+class ExportTestCase(TransactionTestCase):
+    """Exports over ASGI, where the stream is pulled from async code"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(username='finance', password='ledger-pass', is_staff=True)
+        product = create_product(price='12.50')
+        customer = Customer.objects.create(name='Ada', email='ada@example.com')
+        for quantity in (1, 3):
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.create(order=order, product=product, quantity=quantity)
+            OrderService.complete_order(customer, order)
+
+    async def download(self, path):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.staff)
+        response = await client.get(path, {'format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in body.splitlines()]
+
+    async def test_orders_stream_one_chunk_at_a_time(self):
+        iter_chunks = exports.iter_chunks
+        with mock.patch.object(exports, 'iter_chunks', lambda queryset, chunk_size: iter_chunks(queryset, 1)):
+            records = await self.download('/reports/orders/export/')
+        self.assertEqual([record['total'] for record in records], ['12.50', '37.50'])
+
+    async def test_customers_export_totals(self):
+        [record] = await self.download('/reports/customers/export/')
+        self.assertEqual(
+            (record['email'], record['orderCount'], record['totalSpent']), ('ada@example.com', 2, '50.00'),
+        )
+
+
+class CheckoutContentionTestCase(TransactionTestCase):
+    """Concurrent checkouts on real transactions, one connection per thread"""
+
+    def test_hundreds_of_parallel_checkouts(self):
+        # 300 buyers for 25 units, each submitting twice with one key
+        [result] = bench_checkout_contention(checkouts=300, stock=25, workers=32)
+
+        self.assertFalse(result['oversold'])
+        self.assertEqual(result['sold'], 25)
+        self.assertEqual(result['final_stock'], 0)
+        self.assertEqual(result['duplicate_orders'], 0)
+        self.assertEqual(result['errors'], 0)
+        self.assertLess(result['p95_ms'], CHECKOUT_P95_BOUND_MS, result)
+        self.assertLess(result['max_ms'], CHECKOUT_MAX_BOUND_MS, result)
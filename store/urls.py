@@ -7,7 +7,17 @@ urlpatterns = [
 	path('', views.store, name="store"),
 	path('cart/', views.cart, name="cart"),
 	path('checkout/', views.checkout, name="checkout"),
+	path('products/', views.productPage, name="product_page"),
+	path('search/', views.searchProducts, name="search"),
+	path('api/products/', views.apiProductList, name="api_products"),
+	path('api/products/batch/', views.apiProductBatch, name="api_products_batch"),
+	path('api/products/<int:product_id>/', views.apiProductDetail, name="api_product"),
+	path('reports/sales/', views.salesReport, name="sales_report"),
+	path('reports/orders/export/', views.exportOrders, name="export_orders"),
+	path('reports/customers/export/', views.exportCustomers, name="export_customers"),
+	path('csrf/', views.csrfToken, name="csrf_token"),
 	path('update_item/', views.updateItem, name="update_item"),
+	path('update_cart/', views.updateCart, name="update_cart"),
     path('update_size/', views.updateSize, name='update_size'),
 	path('process_order/', views.processOrder, name="process_order"),
 	path('login.html', views.loginview, name='login'),
@@ -1,13 +1,67 @@
-import json
 import logging
+from asgiref.sync import sync_to_async
+from . import guest_cart
 from .models import Product, Order, OrderItem, Customer
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
+def get_product_snapshot(request, product_ids):
+    """
+    Resolve products for the current request with a single bulk query.
+
+    Products already fetched during this request are reused, so
+    ``cookieCart`` and ``guestOrder`` share one lookup per request.
+
+    Args:
+        request: Django HTTP request object
+        product_ids: Iterable of product primary keys
+
+    Returns:
+        dict: Mapping of product ID to Product for the IDs that exist
+    """
+    snapshot = getattr(request, '_product_snapshot', None)
+    if snapshot is None:
+        snapshot = {}
+        request._product_snapshot = snapshot
+
+    missing = [pk for pk in product_ids if pk not in snapshot]
+    if missing:
+        snapshot.update(Product.objects.in_bulk(missing))
+    return {pk: snapshot[pk] for pk in product_ids if pk in snapshot}
+
+
+async def aget_product_snapshot(request, product_ids):
+    """Async version of ``get_product_snapshot``"""
+    snapshot = getattr(request, '_product_snapshot', None)
+    if snapshot is None:
+        snapshot = {}
+        request._product_snapshot = snapshot
+
+    missing = [pk for pk in product_ids if pk not in snapshot]
+    if missing:
+        snapshot.update(await Product.objects.ain_bulk(missing))
+    return {pk: snapshot[pk] for pk in product_ids if pk in snapshot}
+
+
+async def aget_user(request):
+    """
+    Return ``request.user`` once it has been loaded off the event loop.
+
+    The auth middleware installs a lazy user that reads the session and
+    user tables on first access, which async code must not do directly.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
 def cookieCart(request):
     """
-    Retrieve and process cart data from cookies for anonymous users.
+    Retrieve and process the server-side cart of an anonymous user.
+
+    All products in the cart are resolved with one query, regardless of
+    how many lines the cart holds.
     
     Args:
         request: Django HTTP request object
@@ -15,47 +69,52 @@ def cookieCart(request):
     Returns:
         dict: Dictionary containing cart items, order summary, and items list
     """
-    try:
-        cart = json.loads(request.COOKIES.get('cart', '{}'))
-    except (json.JSONDecodeError, TypeError) as e:
-        logger.warning(f"Invalid cart cookie data: {e}")
-        cart = {}
-            
+    cart = guest_cart.get_lines(request)
+    products = get_product_snapshot(request, list({product_id for product_id, _ in cart}))
+    return _summarize_cookie_cart(cart, products)
+
+
+async def acookieCart(request):
+    """Async version of ``cookieCart``"""
+    cart = await sync_to_async(guest_cart.get_lines)(request)
+    products = await aget_product_snapshot(request, list({product_id for product_id, _ in cart}))
+    return _summarize_cookie_cart(cart, products)
+
+
+def _summarize_cookie_cart(cart, products):
+    """Build the cart dict for ``cookieCart`` from parsed lines and products"""
     items = []
     order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False} 
-    cartItems = order['get_cart_items']
-            
-    for product_id in cart:
-        try:
-            cartItems += cart[product_id].get("quantity", 0)
-                    
-            product = Product.objects.get(id=product_id)
-            quantity = cart[product_id].get("quantity", 0)
-            total = (product.price * quantity)
-                    
-            order['get_cart_total'] += total     
-            order['get_cart_items'] += quantity
-                    
-            item = {
-                'product': {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': product.price,
-                    'imageURL': product.imageURL,
-                    'size': product.size,
-                },
-                'quantity': quantity,
-                'get_total': total
-            }
-            items.append(item)
-                    
-            if not product.digital:
-                order['shipping'] = True
-        except ObjectDoesNotExist:
+
+    for (product_id, size), quantity in cart.items():
+        product = products.get(product_id)
+        if product is None:
             logger.warning(f"Product with ID {product_id} not found in database")
-        except (KeyError, ValueError) as e:
-            logger.error(f"Error processing cart item {product_id}: {e}")
-    
+            continue
+
+        total = (product.price * quantity)
+
+        order['get_cart_total'] += total     
+        order['get_cart_items'] += quantity
+
+        item = {
+            'product': {
+                'id': product.id,
+                'name': product.name,
+                'price': product.price,
+                'imageURL': product.imageURL,
+                'size': product.size,
+            },
+            'size': size,
+            'quantity': quantity,
+            'get_total': total
+        }
+        items.append(item)
+
+        if not product.digital:
+            order['shipping'] = True
+
+    cartItems = order['get_cart_items']
     logger.debug(f"Cart items count: {cartItems}")
     return {'cartItems': cartItems, 'order': order, 'items': items}
 
@@ -73,7 +132,7 @@ def cartData(request):
         try:
             customer = request.user.customer
             order, created = Order.objects.get_or_create(customer=customer, complete=False)
-            items = order.orderitem_set.select_related('product').all()
+            items = order.items.select_related('product').all()
             cartItems = order.get_cart_items
         except ObjectDoesNotExist:
             logger.error(f"Customer profile not found for user {request.user.username}")
@@ -89,10 +148,43 @@ def cartData(request):
     return {'cartItems': cartItems, 'order': order, 'items': items}
 
 
+async def acartData(request):
+    """
+    Async version of ``cartData`` for async views.
+    
+    Uses the async ORM API and returns the customer's items as a list,
+    so templates can render them without touching the database.
+    
+    Args:
+        request: Django HTTP request object
+        
+    Returns:
+        dict: Dictionary containing cart items, order, and items list
+    """
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return await acookieCart(request)
+    
+    try:
+        customer = await Customer.objects.aget(user=user)
+    except Customer.DoesNotExist:
+        logger.error(f"Customer profile not found for user {user.username}")
+        # Fall back to cookie cart
+        return await acookieCart(request)
+    
+    order, created = await Order.objects.aget_or_create(customer=customer, complete=False)
+    items = [item async for item in order.items.select_related('product')]
+    return {'cartItems': order.get_cart_items, 'order': order, 'items': items}
+
+
 def guestOrder(request, data):
     """
     Create an order for a guest user (not authenticated).
     
+    Runs as one transaction with a fixed number of queries: the cart's
+    products are resolved in one lookup, the guest customer is upserted
+    on its email and the order lines go in with a single bulk insert.
+    
     Args:
         request: Django HTTP request object
         data: Order data including form information
@@ -109,36 +201,35 @@ def guestOrder(request, data):
         logger.error(f"Missing required field in form data: {e}")
         raise ValueError(f"Missing required field: {e}")
           
-    cookieData = cookieCart(request)
-    items = cookieData['items']
-          
-    customer, created = Customer.objects.get_or_create(
-        email=email,
-        defaults={'name': name}
-    )
+    cart = guest_cart.get_lines(request)
+    product_ids = {product_id for product_id, _ in cart}
+    products = get_product_snapshot(request, list(product_ids))
+    for product_id in product_ids - products.keys():
+        logger.warning(f"Product with ID {product_id} not found in database")
     
-    if not created and customer.name != name:
-        customer.name = name
-        customer.save()
-          
-    order = Order.objects.create(
-        customer=customer,
-        complete=False,
-    )
-          
-    for item in items:
-        try:
-            product = Product.objects.get(id=item['product']['id'])
-                   
-            OrderItem.objects.create(
-                product=product,
-                order=order,
-                quantity=item['quantity']
-            )
-        except ObjectDoesNotExist:
-            logger.error(f"Product {item['product']['id']} not found while creating order item")
-        except (KeyError, ValueError) as e:
-            logger.error(f"Error creating order item: {e}")
+    with transaction.atomic():
+        # The unique guest email constraint makes concurrent checkouts
+        # with the same email converge on one customer
+        customer, created = Customer.objects.get_or_create(
+            email=email,
+            user=None,
+            defaults={'name': name}
+        )
+        
+        if not created and customer.name != name:
+            customer.name = name
+            customer.save(update_fields=['name', 'updated_at'])
+              
+        order = Order.objects.create(
+            customer=customer,
+            complete=False,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(product=products[product_id], order=order, size=size, quantity=quantity)
+            for (product_id, size), quantity in cart.items()
+            if product_id in products and quantity > 0
+        ])
+        order.update_totals()
         
     logger.info(f"Guest order created: Order #{order.id} for {email}")
     return customer, order
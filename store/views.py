@@ -3,22 +3,93 @@ Views for the e-commerce store application.
 """
 import json
 import logging
-import datetime
+from datetime import date, timedelta
 from decimal import Decimal
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods, require_POST
 from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from asgiref.sync import sync_to_async
 
+from . import catalog_api, exports, guest_cart, inventory, jobs, rollups, search
+from .idempotency import idempotent
+from .cache import cache_anonymous_page, conditional_page, page_etag, revalidate_privately
+from .inventory import InsufficientStock
 from .models import Order, OrderItem, Product, Customer, ShippingAddress
-from .utils import cookieCart, cartData, guestOrder
+from .pagination import InvalidCursor, paginate
+from .services import CartService, OrderService
+from .utils import acartData, aget_user, cookieCart, guestOrder
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on operations accepted by one updateCart request
+MAX_CART_OPERATIONS = 100
+
+
+def _cart_state(order):
+    """Summarize an order's lines and stored totals for JSON responses"""
+    items = order.items.filter(product__isnull=False).values('product_id', 'size', 'quantity')
+    return {
+        'cartItems': order.get_cart_items,
+        'total': str(order.get_cart_total),
+        'shipping': order.shipping,
+        'items': [
+            {'productId': item['product_id'], 'size': item['size'], 'quantity': item['quantity']}
+            for item in items
+        ],
+    }
+
+
+def _guest_cart_state(request):
+    """Same summary as ``_cart_state`` for the visitor's server-side cart"""
+    cart = cookieCart(request)
+    return {
+        'cartItems': cart['cartItems'],
+        'total': str(cart['order']['get_cart_total']),
+        'shipping': cart['order']['shipping'],
+        'items': [
+            {'productId': item['product']['id'], 'size': item['size'], 'quantity': item['quantity']}
+            for item in cart['items']
+        ],
+    }
+
+
+def _store_etag(request):
+    """ETag for the catalog page; only customers see a server-side cart badge"""
+    return page_etag(request, include_cart=request.user.is_authenticated)
+
+
+def _cart_etag(request):
+    """ETag for pages that render the visitor's cart"""
+    return page_etag(request)
+
+
+@require_http_methods(["GET"])
+@never_cache
+@ensure_csrf_cookie
+def csrfToken(request):
+    """
+    Issue the CSRF cookie.
+    
+    Guests can get the catalog from the shared page cache, which never
+    carries a Set-Cookie, so cart.js calls this before its first POST
+    when it finds no csrftoken cookie.
+    
+    Returns:
+        Empty JSON response that sets the csrftoken cookie
+    """
+    return JsonResponse({})
+
 
 @require_http_methods(["GET", "POST"])
 def loginview(request):
@@ -47,7 +118,12 @@ def loginview(request):
                     customer = Customer.objects.get(user=user)
                     login(request, user)
                     logger.info(f"User {username} logged in successfully")
-                    return redirect('store')
+                    try:
+                        guest_cart.merge_into_customer(request, customer)
+                    except ValidationError as e:
+                        # The login stands; the guest cart is kept for another try
+                        logger.warning(f"Could not merge guest cart for {username}: {e}")
+                    return guest_cart.set_cookies(request, redirect('store'))
                 except Customer.DoesNotExist:
                     error = "yes"
                     logger.warning(f"User {username} has no customer profile")
@@ -58,64 +134,364 @@ def loginview(request):
     return render(request, 'store/login.html', {'error': error})
 
 
-def store(request):
+@conditional_page(_store_etag)
+@cache_anonymous_page
+async def store(request):
     """
     Display the main product catalog page.
     
-    Shows all active products with cart item count for the user.
+    Shows one page of active products, newest first, with cart item
+    count for the user. Anonymous visitors share one cached page; their
+    cart badge is filled in client-side from the cart cookie. Clients
+    revalidating an unchanged page get a 304 without a render.
     
     Returns:
         Rendered store page with products and cart information
     """
-    data = cartData(request)
-    cartItems = data['cartItems']
+    cartItems = 0
+    if (await aget_user(request)).is_authenticated:
+        cartItems = (await acartData(request))['cartItems']
     
-    products = Product.objects.filter(is_active=True).order_by('-created_at')
-    context = {'products': products, 'cartItems': cartItems}
+    # paginate() may issue two queries; one thread hop covers both
+    products = Product.objects.filter(is_active=True)
+    try:
+        page = await sync_to_async(paginate)(products, request.GET.get('after'), settings.STORE_PAGE_SIZE)
+    except InvalidCursor:
+        logger.warning(f"Invalid store cursor: {request.GET.get('after')}")
+        page = await sync_to_async(paginate)(products, None, settings.STORE_PAGE_SIZE)
+    
+    context = {'products': page.items, 'page': page, 'cartItems': cartItems}
     
-    logger.debug(f"Store page accessed with {products.count()} products")
+    logger.debug(f"Store page rendered with {len(page.items)} products")
     return render(request, 'store/store.html', context)
+
+
+@cache_anonymous_page
+@require_http_methods(["GET"])
+def productPage(request):
+    """
+    Return the next page of the product catalog for infinite scroll.
+    
+    Expects the ``after`` cursor from the previous page.
+    
+    Returns:
+        JSON response with rendered product cards and the next cursor
+    """
+    try:
+        page = paginate(
+            Product.objects.filter(is_active=True),
+            request.GET.get('after'),
+            settings.STORE_PAGE_SIZE,
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    html = render_to_string('store/product_cards.html', {'products': page.items}, request=request)
+    return JsonResponse({
+        'html': html,
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    })
    
 
-def cart(request):
+@conditional_page(_cart_etag)
+async def cart(request):
     """
     Display the shopping cart page.
     
-    Shows cart items for both authenticated and guest users.
+    Shows cart items for both authenticated and guest users. Clients
+    revalidating an unchanged cart get a 304 without a render.
     
     Returns:
         Rendered cart page with items and order summary
     """
-    data = cartData(request)
+    data = await acartData(request)
     cartItems = data['cartItems']
     order = data['order']             
     items = data['items']
     
-    context = {'items': items, 'order': order, 'cartItems': cartItems}
+    context = {'items': items, 'order': order, 'cartItems': cartItems, 'sizes': Product.SIZE_CHOICES}
     logger.debug(f"Cart accessed with {cartItems} items")
     return render(request, 'store/cart.html', context)
 
 
 
-def checkout(request):
+def _hold_stock(order):
+    """Hold stock for an open order; raises InsufficientStock on a shortfall"""
+    with inventory.write_transaction():
+        inventory.reserve_order(order)
+
+
+async def checkout(request):
     """
     Display the checkout page.
     
-    Shows order summary and shipping information form.
+    Shows order summary and shipping information form. The stock hold is
+    refreshed on every visit, after which an unchanged page is answered
+    with a 304 without a render.
     
     Returns:
         Rendered checkout page with order details
     """
-    data = cartData(request)
+    data = await acartData(request)
     cartItems = data['cartItems']
     order = data['order']             
     items = data['items']
     
-    context = {'items': items, 'order': order, 'cartItems': cartItems}
+    # Hold stock for logged-in customers while they fill in the form;
+    # abandoned holds expire and are swept back into stock
+    stock_error = None
+    if isinstance(order, Order) and order.get_cart_items:
+        try:
+            await sync_to_async(_hold_stock)(order)
+        except InsufficientStock as e:
+            logger.warning(f"Checkout hold failed for order #{order.id}: {e.message}")
+            stock_error = "Some items in your cart are no longer available in the requested quantity."
+    
+    etag = f'"{await sync_to_async(page_etag)(request, bool(stock_error))}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return revalidate_privately(not_modified)
+    
+    context = {'items': items, 'order': order, 'cartItems': cartItems, 'stock_error': stock_error}
     logger.debug(f"Checkout accessed with {cartItems} items")
-    return render(request, 'store/checkout.html', context)
+    response = render(request, 'store/checkout.html', context)
+    response['ETag'] = etag
+    return revalidate_privately(response)
+
+
+
+
+@require_http_methods(["GET"])
+def searchProducts(request):
+    """
+    Full-text product search via AJAX.
+    
+    Expects a ``q`` query parameter and an optional ``limit`` (max 50).
+    Matches on name and description, ranked by relevance, with
+    partially typed words matching as prefixes.
+    
+    Returns:
+        JSON response with matching products and highlighted snippets
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 50)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    hits = search.search(query, limit=limit) if query else []
+    products = Product.objects.filter(is_active=True).in_bulk([hit.product_id for hit in hits])
+    
+    results = []
+    for hit in hits:
+        product = products.get(hit.product_id)
+        if product is None:
+            continue
+        results.append({
+            'id': product.id,
+            'name': product.name,
+            'price': str(product.price),
+            'imageURL': product.imageURL,
+            'snippet': hit.snippet,
+        })
+    
+    logger.debug(f"Search for '{query}' returned {len(results)} products")
+    return JsonResponse({'query': query, 'results': results})
+
+
+def _api_response(body):
+    return HttpResponse(body, content_type='application/json')
+
+
+def _api_fields(request):
+    """Fields named by ``fields=``; raises InvalidFields"""
+    return catalog_api.parse_fields(request.GET.get('fields'))
+
+
+@require_http_methods(["GET"])
+@conditional_page(catalog_api.etag)
+def apiProductList(request):
+    """
+    List active products, newest first, for API clients.
+    
+    Accepts ``fields`` (comma-separated, see ``catalog_api.FIELDS``),
+    the ``after`` cursor from the previous page and ``limit`` (max 100).
+    
+    Returns:
+        JSON response with the products and the next cursor
+    """
+    try:
+        fields = _api_fields(request)
+        limit = min(max(int(request.GET.get('limit', settings.STORE_PAGE_SIZE)), 1), catalog_api.MAX_PRODUCTS)
+    except catalog_api.InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    cursor = request.GET.get('after')
+    
+    try:
+        body = catalog_api.cached_body(
+            f"list:{','.join(fields)}:{limit}:{cursor or ''}",
+            lambda: catalog_api.product_list(fields, cursor, limit),
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return _api_response(body)
+
+
+@require_http_methods(["GET"])
+@conditional_page(catalog_api.etag)
+def apiProductDetail(request, product_id):
+    """
+    Return one active product for API clients.
+    
+    Accepts ``fields`` like ``apiProductList``.
+    
+    Returns:
+        JSON response with the product, or 404
+    """
+    try:
+        fields = _api_fields(request)
+    except catalog_api.InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    body = catalog_api.cached_body(
+        f"detail:{','.join(fields)}:{product_id}",
+        lambda: catalog_api.product_detail(product_id, fields),
+    )
+    if body is None:
+        return JsonResponse({'error': 'Product not found'}, status=404)
+    return _api_response(body)
+
+
+@require_http_methods(["GET"])
+@conditional_page(catalog_api.etag)
+def apiProductBatch(request):
+    """
+    Return several active products by ID for API clients.
+    
+    Expects ``ids`` (comma-separated, at most 100) and accepts ``fields``
+    like ``apiProductList``. Products come back in the order asked for;
+    IDs without an active product are listed under ``missing``.
+    
+    Returns:
+        JSON response with the products found and the IDs missing
+    """
+    try:
+        fields = _api_fields(request)
+        product_ids = list(dict.fromkeys(int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()))
+    except catalog_api.InvalidFields as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid ids'}, status=400)
+    if not product_ids or len(product_ids) > catalog_api.MAX_PRODUCTS:
+        return JsonResponse({'error': f'Expected 1 to {catalog_api.MAX_PRODUCTS} ids'}, status=400)
+    
+    body = catalog_api.cached_body(
+        f"batch:{','.join(fields)}:{','.join(map(str, product_ids))}",
+        lambda: catalog_api.product_batch(product_ids, fields),
+    )
+    return _api_response(body)
+
+
+# Longest date range one sales report may cover
+MAX_REPORT_DAYS = 366
+
+
+@require_http_methods(["GET"])
+def salesReport(request):
+    """
+    Sales per day and best-selling products for staff dashboards.
+    
+    Accepts ``start`` and ``end`` dates (YYYY-MM-DD, default the last 30
+    days) and an optional ``top`` (max 100). Reads only the rollup
+    tables maintained by ``manage.py rollup_sales``, never the orders.
+    
+    Returns:
+        JSON response with the report, or 403 for non-staff users
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    
+    try:
+        end = date.fromisoformat(request.GET['end']) if 'end' in request.GET else date.today()
+        start = date.fromisoformat(request.GET['start']) if 'start' in request.GET else end - timedelta(days=29)
+        top = min(max(int(request.GET.get('top', 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start, end or top'}, status=400)
+    if start > end or (end - start).days >= MAX_REPORT_DAYS:
+        return JsonResponse({'error': f'Range must be 1 to {MAX_REPORT_DAYS} days'}, status=400)
+    
+    return JsonResponse(rollups.sales_report(start, end, top=top))
+
+
+def _export_response(request, name, export):
+    """
+    Stream ``export(fmt, start=, end=, compress=)`` as an attachment.
+
+    Parameters are read from the query string as described on
+    ``exportOrders``. Under ASGI the stream is wrapped in
+    ``exports.aiter_stream`` so it is sent a chunk at a time.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return JsonResponse({'error': f'format must be one of {", ".join(exports.FORMATS)}'}, status=400)
+    try:
+        start = date.fromisoformat(request.GET['start']) if 'start' in request.GET else None
+        end = date.fromisoformat(request.GET['end']) if 'end' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start or end'}, status=400)
+    compress = request.GET.get('gzip') == '1'
+    
+    filename = f"{name}-{date.today():%Y%m%d}.{fmt}"
+    if compress:
+        filename += '.gz'
+    stream = export(fmt, start=start, end=end, compress=compress)
+    if isinstance(request, ASGIRequest):
+        stream = exports.aiter_stream(stream)
+    response = StreamingHttpResponse(
+        stream,
+        content_type='application/gzip' if compress else f'{exports.CONTENT_TYPES[fmt]}; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
 
 
+@require_http_methods(["GET"])
+def exportOrders(request):
+    """
+    Download completed orders with their lines and shipping addresses.
+    
+    Accepts ``format`` (csv or jsonl, default csv), optional ``start``
+    and ``end`` dates (YYYY-MM-DD) and ``gzip=1``. The body is streamed
+    a chunk of orders at a time, so the export never sits in memory.
+    
+    Returns:
+        Streaming attachment, or a JSON error for bad parameters and
+        non-staff users
+    """
+    return _export_response(request, 'orders', exports.export_orders)
+
+
+@require_http_methods(["GET"])
+def exportCustomers(request):
+    """
+    Download customers who completed an order, with their order count,
+    spend and first and last order dates.
+    
+    Takes the same parameters as ``exportOrders``; ``start`` and ``end``
+    bound the orders that are counted.
+    
+    Returns:
+        Streaming attachment, or a JSON error for bad parameters and
+        non-staff users
+    """
+    return _export_response(request, 'customers', exports.export_customers)
 
 
 @require_POST
@@ -123,8 +499,9 @@ def updateItem(request):
     """
     Update cart item quantity via AJAX.
     
-    Expects JSON payload with productId and action ('add' or 'remove').
-    Handles both authenticated and anonymous users.
+    Expects JSON payload with productId, action ('add' or 'remove') and
+    an optional size naming the cart line. Handles both authenticated
+    and anonymous users.
     
     Returns:
         JSON response confirming the update
@@ -133,44 +510,42 @@ def updateItem(request):
         data = json.loads(request.body)
         product_id = data.get('productId')
         action = data.get('action')
+        size = data.get('size') or ''
         
         if not product_id or not action:
             return JsonResponse({'error': 'Missing productId or action'}, status=400)
         
         logger.info(f"Update item request: Product {product_id}, Action: {action}")
         
+        if action not in ('add', 'remove'):
+            return JsonResponse({'error': 'Invalid action'}, status=400)
+        
         if not request.user.is_authenticated:
-            # Handle cookie-based cart for anonymous users
-            return JsonResponse({'message': 'Item updated in cookie cart'}, safe=False)
+            # Anonymous carts are kept server-side behind the cart_id cookie
+            product_id = int(product_id)
+            lines = guest_cart.apply_operations(request, [(product_id, size, 1 if action == 'add' else -1)])
+            response = JsonResponse({'message': 'Item was updated', 'quantity': lines.get((product_id, size), 0)})
+            return guest_cart.set_cookies(request, response)
         
         # Handle database cart for authenticated users
         customer = request.user.customer
         product = get_object_or_404(Product, id=product_id)
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        
-        order_item, item_created = OrderItem.objects.get_or_create(
-            order=order,
-            product=product
-        )
         
-        if action == 'add':
-            order_item.quantity += 1
-        elif action == 'remove':
-            order_item.quantity -= 1
-        else:
-            return JsonResponse({'error': 'Invalid action'}, status=400)
-            
-        order_item.save()
-        
-        if order_item.quantity <= 0:
-            order_item.delete()
+        order = CartService.apply_operations(customer, [(product.id, size, 1 if action == 'add' else -1)])
+        quantity = order.items.filter(product=product, size=size).values_list('quantity', flat=True).first() or 0
+        if not quantity:
             logger.info(f"Removed product {product_id} from cart")
         
-        return JsonResponse({'message': 'Item was updated', 'quantity': order_item.quantity if order_item.quantity > 0 else 0}, safe=False)
+        return JsonResponse({'message': 'Item was updated', 'quantity': quantity}, safe=False)
         
     except json.JSONDecodeError:
         logger.error("Invalid JSON in updateItem request")
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid productId'}, status=400)
+    except ValidationError as e:
+        logger.warning(f"Rejected cart update: {e.messages[0]}")
+        return JsonResponse({'error': e.messages[0]}, status=400)
     except Customer.DoesNotExist:
         logger.error(f"Customer profile not found for user {request.user.username}")
         return JsonResponse({'error': 'Customer profile not found'}, status=404)
@@ -178,31 +553,94 @@ def updateItem(request):
         logger.error(f"Error updating cart item: {str(e)}")
         return JsonResponse({'error': 'Server error'}, status=500)
 
+@require_POST
+def updateCart(request):
+    """
+    Apply a batch of cart quantity changes via AJAX.
+    
+    Expects a JSON payload ``{"operations": [{"productId": 1, "size": "M", "delta": 2}, ...]}``;
+    ``size`` is optional and names the cart line. All operations are
+    applied in a single transaction, so rapid clicks coalesced by the
+    client cost one request.
+    
+    Returns:
+        JSON response with the resulting cart state
+    """
+    try:
+        data = json.loads(request.body)
+        operations = [
+            (int(op['productId']), str(op.get('size') or ''), int(op['delta'])) for op in data['operations']
+        ]
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in updateCart request")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid operations'}, status=400)
+    
+    if not operations or len(operations) > MAX_CART_OPERATIONS:
+        return JsonResponse(
+            {'error': f'Expected 1 to {MAX_CART_OPERATIONS} operations'}, status=400
+        )
+    
+    try:
+        if not request.user.is_authenticated:
+            guest_cart.apply_operations(request, operations)
+            return guest_cart.set_cookies(request, JsonResponse(_guest_cart_state(request)))
+        order = CartService.apply_operations(request.user.customer, operations)
+        return JsonResponse(_cart_state(order))
+    except ValidationError as e:
+        logger.warning(f"Rejected cart update: {e.messages[0]}")
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    except Customer.DoesNotExist:
+        logger.error(f"Customer profile not found for user {request.user.username}")
+        return JsonResponse({'error': 'Customer profile not found'}, status=404)
+    except Exception as e:
+        logger.error(f"Error updating cart: {str(e)}")
+        return JsonResponse({'error': 'Server error'}, status=500)
+
+
 @require_POST
 def updateSize(request):
     """
-    Update product size selection.
+    Change the size of cart lines via AJAX.
     
-    Note: This updates the product's size, not the order item.
-    Consider refactoring to update OrderItem size instead.
+    Expects a JSON payload ``{"changes": [{"productId": 1, "from": "", "to": "M"}, ...]}``.
+    Only the named lines are rewritten, in one transaction, and the
+    catalog's products are left alone. A line moved onto a size already
+    in the cart is merged into it.
     
     Returns:
-        JSON response with success status
+        JSON response with the resulting cart state
     """
     try:
-        product_id = request.POST.get('productId')
-        selected_size = request.POST.get('selectedSize')
-        
-        if not product_id or not selected_size:
-            return JsonResponse({'error': 'Missing parameters'}, status=400)
-        
-        product = get_object_or_404(Product, id=product_id)
-        product.size = selected_size
-        product.save()
-        
-        logger.info(f"Updated product {product_id} size to {selected_size}")
-        return JsonResponse({'success': True})
-        
+        data = json.loads(request.body)
+        changes = [
+            (int(change['productId']), str(change.get('from') or ''), str(change.get('to') or ''))
+            for change in data['changes']
+        ]
+    except json.JSONDecodeError:
+        logger.error("Invalid JSON in updateSize request")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid changes'}, status=400)
+    
+    if not changes or len(changes) > MAX_CART_OPERATIONS:
+        return JsonResponse(
+            {'error': f'Expected 1 to {MAX_CART_OPERATIONS} changes'}, status=400
+        )
+    
+    try:
+        if not request.user.is_authenticated:
+            guest_cart.set_sizes(request, changes)
+            return guest_cart.set_cookies(request, JsonResponse(_guest_cart_state(request)))
+        order = CartService.set_sizes(request.user.customer, changes)
+        return JsonResponse(_cart_state(order))
+    except ValidationError as e:
+        logger.warning(f"Rejected size change: {e.messages[0]}")
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    except Customer.DoesNotExist:
+        logger.error(f"Customer profile not found for user {request.user.username}")
+        return JsonResponse({'error': 'Customer profile not found'}, status=404)
     except Exception as e:
         logger.error(f"Error updating size: {str(e)}")
         return JsonResponse({'error': 'Failed to update size'}, status=500)
@@ -210,56 +648,79 @@ def updateSize(request):
 
 @csrf_exempt
 @require_POST
+@idempotent('process_order')
 def processOrder(request):
     """
     Process and complete an order.
     
     Validates order total, creates shipping address if needed,
-    and marks order as complete.
+    and marks order as complete. Clients that may retry send an
+    ``Idempotency-Key`` header and get the first response replayed.
     
     Returns:
         JSON response confirming order completion
     """
     try:
-        transaction_id = str(datetime.datetime.now().timestamp())
         data = json.loads(request.body)
         
-        if request.user.is_authenticated:
-            customer = request.user.customer
-            order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        else:
-            customer, order = guestOrder(request, data)
-        
-        # Validate order total
-        submitted_total = Decimal(str(data['form']['total']))
-        calculated_total = Decimal(str(order.get_cart_total))
-        
-        order.transaction_id = transaction_id
-        
-        # Only complete if totals match (within 0.01 for rounding)
-        if abs(submitted_total - calculated_total) < Decimal('0.01'):
-            order.complete = True
+        with inventory.write_transaction():
+            transaction_id = OrderService.next_transaction_id()
+            
+            if request.user.is_authenticated:
+                customer = request.user.customer
+                order, created = Order.objects.get_or_create(customer=customer, complete=False)
+            else:
+                customer, order = guestOrder(request, data)
+            
+            # Charge today's prices: freeze them on the lines and total the
+            # order from those same lines before checking what was shown
+            order.freeze_prices()
+            order.update_totals()
+            
+            # Validate order total
+            submitted_total = Decimal(str(data['form']['total']))
+            calculated_total = Decimal(str(order.get_cart_total))
+            
+            order.transaction_id = transaction_id
+            
+            # Only complete if totals match (within 0.01 for rounding)
+            if abs(submitted_total - calculated_total) < Decimal('0.01'):
+                order.complete = True
+            else:
+                logger.warning(f"Order total mismatch: submitted={submitted_total}, calculated={calculated_total}")
+                # Returning does not leave the block by an exception, so
+                # undo the guest order and transaction ID explicitly
+                transaction.set_rollback(True)
+                return JsonResponse({'error': 'Order total mismatch', 'total': str(calculated_total)}, status=400)
+            
+            # Sell the stock; a shortfall rolls back the whole checkout
+            inventory.reserve_order(order)
+            order.save()
+            inventory.consume_reservations(order)
+            jobs.enqueue_order_completed(order)
             logger.info(f"Order #{order.id} completed with transaction {transaction_id}")
-        else:
-            logger.warning(f"Order total mismatch: submitted={submitted_total}, calculated={calculated_total}")
-            return JsonResponse({'error': 'Order total mismatch'}, status=400)
-        
-        order.save()
-        
-        # Create shipping address if physical products exist
-        if order.shipping and 'shipping' in data:
-            ShippingAddress.objects.create(
-                customer=customer,
-                order=order,
-                address=data['shipping'].get('address', ''),
-                city=data['shipping'].get('city', ''),
-                state=data['shipping'].get('state', ''),
-                zipcode=data['shipping'].get('zipcode', ''),
-            )
-            logger.info(f"Shipping address created for order #{order.id}")
+            
+            # Create shipping address if physical products exist
+            if order.shipping and 'shipping' in data:
+                ShippingAddress.objects.create(
+                    customer=customer,
+                    order=order,
+                    address=data['shipping'].get('address', ''),
+                    city=data['shipping'].get('city', ''),
+                    state=data['shipping'].get('state', ''),
+                    zipcode=data['shipping'].get('zipcode', ''),
+                )
+                logger.info(f"Shipping address created for order #{order.id}")
+            
+            if not request.user.is_authenticated:
+                guest_cart.clear(request)
         
-        return JsonResponse({'message': 'Payment complete!', 'transaction_id': transaction_id}, safe=False)
+        response = JsonResponse({'message': 'Payment complete!', 'transaction_id': transaction_id}, safe=False)
+        return guest_cart.set_cookies(request, response)
         
+    except InsufficientStock as e:
+        logger.warning(f"Checkout rejected: {e.message}")
+        return JsonResponse({'error': 'Not enough stock', 'productId': e.product_id}, status=409)
     except json.JSONDecodeError:
         logger.error("Invalid JSON in processOrder")
         return JsonResponse({'error': 'Invalid JSON'}, status=400)